@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'reviews.middleware.MetricsMiddleware',  # First, to measure the whole processing of the requests
+    'reviews.middleware.PrimaryPinningMiddleware',  # Before the sessions, which are read from the database
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,35 +59,155 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'book_review.urls'
 
+TEMPLATE_CONTEXT_PROCESSORS = [
+    'django.template.context_processors.debug',
+    'django.template.context_processors.request',
+    'django.contrib.auth.context_processors.auth',
+    'django.contrib.messages.context_processors.messages',
+    'django.template.context_processors.media',  # add this
+]
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates, with the render time recorded in the metrics (see reviews/metrics.py)
+        'NAME': 'django',
+        'BACKEND': 'reviews.template_backends.InstrumentedDjangoTemplates',
+        'DIRS': [],
+        'OPTIONS': {
+            'context_processors': TEMPLATE_CONTEXT_PROCESSORS,
+            # In production, the compiled templates are kept in memory (cached loader)
+            'loaders': TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
+        },
+    },
+    {
+        # Jinja2 versions of the feed templates (reviews/jinja2/), see REVIEWS_TEMPLATE_ENGINE
+        'NAME': 'jinja2',
+        'BACKEND': 'reviews.template_backends.InstrumentedJinja2',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
-            'context_processors': [
-                'django.template.context_processors.debug',
-                'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
-                'django.template.context_processors.media',  # add this
-            ],
+            'environment': 'reviews.jinja2_environment.environment',
+            'context_processors': TEMPLATE_CONTEXT_PROCESSORS,
+            # In production, the compiled templates are kept in memory and never checked for changes
+            'auto_reload': DEBUG,
+            'cache_size': 400,
         },
     },
 ]
 
+# Engine rendering the feed pages (Home and Posts) and their snippets: 'django' or 'jinja2'
+# (the time to render a feed with each engine is compared by the bench_templates command)
+REVIEWS_TEMPLATE_ENGINE = os.environ.get('REVIEWS_TEMPLATE_ENGINE', 'django')
+
 WSGI_APPLICATION = 'book_review.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Profiles of the SQLite database, chosen by the REVIEWS_DATABASE_PROFILE environment variable
+# (see reviews/database.py):
+# - CONN_MAX_AGE: lifetime of the connections in seconds (0: a connection by request),
+# - OPTIONS: options of the connections ("timeout": seconds waited for a locked database),
+# - PRAGMAS: SQLite pragmas set on each new connection,
+# - SERIALIZE_WRITES: the requests which write (POST...) wait for each other, instead of failing on a locked database.
+# Compare them with "python manage.py load_test --profiles default production".
+REVIEWS_DATABASE_PROFILES = {
+    'default': {
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {},
+        'PRAGMAS': {},
+        'SERIALIZE_WRITES': False,
+    },
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 20},
+        'PRAGMAS': {
+            'journal_mode': 'WAL',  # The readers do not block the writer, and the writer does not block the readers
+            'synchronous': 'NORMAL',  # Safe with WAL, no sync of the file at each commit
+            'cache_size': -64000,  # KiB (64 MiB)
+            'mmap_size': 256 * 1024 * 1024,  # Bytes
+            'temp_store': 'MEMORY',
+            'busy_timeout': 20000,  # Milliseconds
+        },
+        'SERIALIZE_WRITES': True,
+    },
+}
+REVIEWS_DATABASE_PROFILE = os.environ.get('REVIEWS_DATABASE_PROFILE', 'default')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'reviews.backends.sqlite3',  # Serializes the write transactions, see reviews/database.py
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': REVIEWS_DATABASE_PROFILES[REVIEWS_DATABASE_PROFILE]['CONN_MAX_AGE'],
+        'OPTIONS': REVIEWS_DATABASE_PROFILES[REVIEWS_DATABASE_PROFILE]['OPTIONS'],
     }
 }
 
+# Replica of the database, read by the requests (see reviews/routers.py): path of its SQLite file, given by the
+# REVIEWS_DATABASE_REPLICA environment variable. Locally, "python manage.py sync_replica --interval 5" copies
+# the primary into it. The reads of a user go to the primary during REVIEWS_REPLICA_PIN_SECONDS after he has written,
+# which must be longer than the replication delay.
+REVIEWS_DATABASE_REPLICA = os.environ.get('REVIEWS_DATABASE_REPLICA')
+if REVIEWS_DATABASE_REPLICA:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': REVIEWS_DATABASE_REPLICA,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['reviews.routers.PrimaryReplicaRouter']
+REVIEWS_REPLICA_PIN_SECONDS = 10
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Home feed pages of the users (ordered post ids) and their versions, see reviews/feed_cache.py: shared by the
+    # processes of the server (a version changed by a process must be read by the others), so a file based cache.
+    # Its directory must only be writable by the server: the entries are unpickled.
+    'feed': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('REVIEWS_FEED_CACHE_DIR', str(BASE_DIR / 'cache' / 'feed')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,  # Bounded size: a third of the entries is evicted when it is reached
+            'CULL_FREQUENCY': 3,
+        },
+    },
+    # Rendered snippets of the posts, see reviews/fragment_cache.py
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 3,
+        },
+    },
+    # Sessions (see reviews/sessions.py): shared by the processes of the server, so a file based cache here.
+    # Its directory must only be writable by the server: the sessions are unpickled.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('REVIEWS_SESSION_CACHE_DIR', str(BASE_DIR / 'cache' / 'sessions')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# Sessions read from the cache, written in the database only when they change (see reviews/sessions.py)
+SESSION_ENGINE = 'reviews.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+# Minimal extension of the expiry date of an unchanged session which is written (with SESSION_SAVE_EVERY_REQUEST)
+SESSION_REFRESH_SECONDS = 24 * 3600
+
+# The tests use temporary file based caches, not the caches of the server (see reviews/testing.py)
+TEST_RUNNER = 'reviews.testing.TestRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -143,3 +265,36 @@ MESSAGE_TAGS = {
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 MEDIA_URL = "/media/"
+# The ticket images are stored once by content (see reviews/storage.py).
+# Run "python manage.py dedup_media" to convert the images stored before, "python manage.py gc_media" to remove
+# the images which no ticket points at anymore.
+DEFAULT_FILE_STORAGE = 'reviews.storage.ContentAddressedStorage'
+# The uploads are streamed to disk and the images are validated while they arrive (see reviews/uploadhandlers.py).
+FILE_UPLOAD_HANDLERS = ['reviews.uploadhandlers.ImageUploadHandler']
+REVIEWS_UPLOAD_MAX_SIZE = 10 * 1024 * 1024  # Bytes
+REVIEWS_UPLOAD_MAX_PIXELS = 40 * 1000 * 1000  # Width x height
+
+# Resized variants of the ticket images (see reviews/images.py): also create a WebP version of each variant.
+# Run "python manage.py regenerate_image_variants" to create the variants of the images already stored.
+REVIEWS_IMAGE_WEBP = True
+
+# Feed of the Home and Posts pages
+REVIEWS_FEED_PAGE_SIZE = 20  # Number of posts by page
+# Timeline mode: read the Home feed from the materialized FeedEntry table (filled on write).
+# Run "python manage.py rebuild_feed" to backfill the table before enabling it.
+REVIEWS_FEED_TIMELINE = False
+# Alias of the cache used for the Home feed pages (None to disable it) and lifetime of a cached page in seconds.
+# The hit ratio is displayed on /feed/cache_stats/ (staff members only).
+REVIEWS_FEED_CACHE = 'feed'
+REVIEWS_FEED_CACHE_TIMEOUT = 300
+# Alias of the cache used for the rendered snippets of the posts (None to disable it) and lifetime of a snippet
+REVIEWS_FRAGMENT_CACHE = 'fragments'
+REVIEWS_FRAGMENT_CACHE_TIMEOUT = 3600
+# Minimal number of reviews of a ticket listed on the top tickets page (/tickets/top/)
+REVIEWS_TOP_MIN_REVIEWS = 1
+
+# Performance metrics of the views, exposed in the Prometheus text format on /metrics/ (see reviews/metrics.py).
+# They are only shown to the staff members, and to the scrapers which send the token in an
+# "Authorization: Bearer <token>" header, unless REVIEWS_METRICS_PUBLIC opens them to everyone.
+REVIEWS_METRICS_TOKEN = os.environ.get('REVIEWS_METRICS_TOKEN')
+REVIEWS_METRICS_PUBLIC = os.environ.get('REVIEWS_METRICS_PUBLIC') == '1'
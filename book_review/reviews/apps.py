@@ -6,3 +6,8 @@ from django.apps import AppConfig
 class ReviewsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reviews'
+
+    def ready(self):
+        """Connect the signal receivers of the application."""
+
+        from . import signals  # noqa: F401
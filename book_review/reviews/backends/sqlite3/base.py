@@ -0,0 +1,73 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""SQLite backend of book_review project, which serializes the write transactions (see reviews.database).
+
+When the database profile serializes the writes, the write lock is only held while the database is written:
+- a transaction (atomic block) waits for the write lock, then starts with BEGIN IMMEDIATE, so it holds the lock
+of SQLite from its start, and releases the write lock when it is committed or rolled back,
+- a write statement outside a transaction (autocommit) holds the write lock while it runs.
+The rest of the requests (password hashing, image processing, rendering...) runs without the lock.
+"""
+
+from django.db.backends.sqlite3 import base
+
+from reviews import database
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.holds_write_lock = False
+        # First wrapper: connection.execute_wrapper() removes the last one
+        self.execute_wrappers.insert(0, self.serialize_autocommit_writes)
+
+    def acquire_write_lock(self):
+        database.acquire_write_lock(self.alias)
+        self.holds_write_lock = True
+
+    def release_write_lock(self):
+        if self.holds_write_lock:
+            self.holds_write_lock = False
+            database.release_write_lock(self.alias)
+
+    def _start_transaction_under_autocommit(self):
+        if not database.is_write_serialization_enabled():
+            return super()._start_transaction_under_autocommit()
+        self.acquire_write_lock()
+        try:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self.release_write_lock()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self.release_write_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_write_lock()
+
+    def serialize_autocommit_writes(self, execute, sql, params, many, context):
+        """Hold the write lock while a write statement runs outside a transaction."""
+
+        if (self.holds_write_lock or self.in_atomic_block or not database.is_write_serialization_enabled()
+                or not sql.lstrip().upper().startswith(WRITE_STATEMENTS)):
+            return execute(sql, params, many, context)
+        self.acquire_write_lock()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.release_write_lock()
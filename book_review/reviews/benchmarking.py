@@ -0,0 +1,211 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Tools of the benchmark commands for book_review project.
+
+- temporary_database: run a benchmark on a temporary SQLite database file and on temporary caches (the real
+database and the real caches are never used),
+- get_temporary_caches: CACHES setting with the file based caches stored in a given directory,
+- wsgi_request / asgi_request: send a request directly to the WSGI / ASGI application, as a server would,
+- summarize: latency percentiles and throughput of a run,
+- histogram: distribution of the latencies of a run,
+- find_regressions: compare the results of a run with saved baseline results.
+"""
+
+import asyncio
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+HOST = 'localhost'
+
+
+def get_temporary_caches(directory):
+    """Get a copy of the CACHES setting where the file based caches are stored in a directory.
+
+    The cached data (feed pages, sessions) refers to the rows of a database: a temporary database must not share
+    the caches of the real one, whose users would see posts of the other database.
+    """
+
+    cache_settings = copy.deepcopy(settings.CACHES)
+    for alias, config in cache_settings.items():
+        if config['BACKEND'] == 'django.core.cache.backends.filebased.FileBasedCache':
+            config['LOCATION'] = os.path.join(directory, alias)
+    return cache_settings
+
+
+@contextmanager
+def temporary_database(alias='default'):
+    """Create the tables in a temporary SQLite database file, and use it instead of the configured database.
+
+    A file (and not the in-memory test database) is used, so it can be shared by threads and processes.
+    The file based caches are also replaced by temporary ones (see get_temporary_caches).
+    """
+
+    connection = connections[alias]
+    directory = tempfile.mkdtemp(prefix='book_review_bench_')
+    connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    try:
+        with override_settings(CACHES=get_temporary_caches(os.path.join(directory, 'caches'))):
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                yield connection.settings_dict['NAME']
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def create_session_cookie(user):
+    """Log a user in and return the Cookie header of his session."""
+
+    client = Client()
+    client.force_login(user)
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+
+def wsgi_request(application, path, cookie='', method='GET', body=b'', content_type='', client_delay=0):
+    """Send a request to a WSGI application, return (status code, response headers, response body).
+
+    client_delay simulates a slow client: it is the time taken to receive each chunk of the response.
+    """
+
+    path, _, query_string = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'HTTP_HOST': HOST,
+        'SERVER_NAME': HOST,
+        'HTTP_COOKIE': cookie,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+    }
+    setup_testing_defaults(environ)
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = headers
+
+    chunks = []
+    response = application(environ, start_response)
+    try:
+        for chunk in response:
+            chunks.append(chunk)
+            if client_delay:
+                time.sleep(client_delay)
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return response_start['status'], response_start['headers'], b''.join(chunks)
+
+
+async def asgi_request(application, path, cookie='', client_delay=0):
+    """Send a GET request to an ASGI application, return (status code, response body).
+
+    client_delay simulates a slow client: it is the time taken to receive each chunk of the response.
+    """
+
+    path, _, query_string = path.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [(b'host', HOST.encode()), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 50000),
+        'server': (HOST, 80),
+    }
+    response = {'status': None, 'chunks': []}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['chunks'].append(message.get('body', b''))
+            if client_delay:
+                await asyncio.sleep(client_delay)
+
+    await application(scope, receive, send)
+    return response['status'], b''.join(response['chunks'])
+
+
+def percentile(sorted_values, fraction):
+    """Get a percentile (fraction between 0 and 1) of sorted values (nearest rank)."""
+
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed):
+    """Summarize the latencies (seconds) of the requests of a run which lasted `elapsed` seconds."""
+
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else None,  # Requests by second
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p90_ms': percentile(latencies, 0.90) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'max_ms': latencies[-1] * 1000 if latencies else None,
+    }
+
+
+# Upper bounds (milliseconds) of the buckets of the latency histograms
+HISTOGRAM_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def histogram(latencies, bounds_ms=HISTOGRAM_BOUNDS_MS):
+    """Count the latencies (seconds) by bucket, return {'<=5ms': count, ..., '>5000ms': count}."""
+
+    buckets = {f'<={bound}ms': 0 for bound in bounds_ms}
+    buckets[f'>{bounds_ms[-1]}ms'] = 0
+    for latency in latencies:
+        latency_ms = latency * 1000
+        bound = next((bound for bound in bounds_ms if latency_ms <= bound), None)
+        buckets[f'<={bound}ms' if bound is not None else f'>{bounds_ms[-1]}ms'] += 1
+    return buckets
+
+
+def find_regressions(results, baseline, tolerance, metrics):
+    """Compare the metrics of the results of a benchmark with a baseline (both: {case: {metric: value}}).
+
+    Return the regressions as messages: a value more than `tolerance` (fraction) higher than its baseline,
+    or any increase of the number of queries. The cases missing from the baseline are ignored.
+    """
+
+    regressions = []
+    for case, values in results.items():
+        if case not in baseline:
+            continue
+        for metric in metrics:
+            value, reference = values.get(metric), baseline[case].get(metric)
+            if value is None or reference is None:
+                continue
+            limit = reference if metric == 'queries' else reference * (1 + tolerance)
+            if value > limit:
+                regressions.append(f"{case}: {metric} {value:.1f} > {reference:.1f} (baseline)")
+    return regressions
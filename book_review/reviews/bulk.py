@@ -0,0 +1,64 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Bulk insertion helpers for book_review project (used by the import and data generation commands).
+
+- preserve_time_created: keep the time_created given to the objects instead of the current time,
+- bulk_create_with_ids: insert objects in bulk and get their ids, whatever the database backend.
+
+The bulk insertions do not send the post_save signals: the commands rebuild what the signals maintain
+(see refresh_derived_data).
+"""
+
+from contextlib import contextmanager
+
+from django.db import connections, router
+from django.db.models import Max
+
+from . import feed_cache
+from .feed import is_timeline_enabled
+from .models import Ticket
+
+
+@contextmanager
+def preserve_time_created(*models):
+    """Disable auto_now_add on the time_created fields of models, so the given times are inserted."""
+
+    fields = [model._meta.get_field('time_created') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def bulk_create_with_ids(model, objects, batch_size=None):
+    """Insert objects in bulk and set their ids.
+
+    When the database cannot return the ids of inserted rows (SQLite with Django 3.2), the ids are allocated
+    after the current maximal id. It must be called in a transaction, and the table must not be written
+    by another process meanwhile.
+    """
+
+    objects = list(objects)
+    connection = connections[router.db_for_write(model)]
+    if not connection.features.can_return_rows_from_bulk_insert:
+        next_id = (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+        for offset, instance in enumerate(objects):
+            instance.id = next_id + offset
+    return model.objects.bulk_create(objects, batch_size=batch_size)
+
+
+def refresh_derived_data(stdout=None):
+    """Rebuild the data maintained by signals after bulk insertions (timelines, statistics of the tickets,
+    feed cache)."""
+
+    from django.core.management import call_command
+
+    if is_timeline_enabled():
+        call_command('rebuild_feed', stdout=stdout)
+    repaired = Ticket.repair_review_stats()
+    if stdout is not None:
+        stdout.write(f"Statistics of {repaired} tickets computed.")
+    feed_cache.clear()
@@ -0,0 +1,95 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Conditional GET for book_review project: unchanged pages are answered with 304 Not Modified.
+
+A page gets cheap validators, computed before the view runs (the cost does not depend on the number of posts):
+- feeds: an ETag only, from the feed version of the user (see feed_cache module), read from the feed cache.
+The version changes when the user follows or unfollows someone, and when a post displayed by his feeds
+(or its ticket, or the reviews of its ticket) is created, updated or deleted (see signals module). The feeds are
+not conditional when the feed cache is disabled. A feed has no Last-Modified: a date does not change when a post
+is deleted or a user is unfollowed,
+- detail pages: an ETag and a Last-Modified, from the update time of the ticket or of the review (and of its
+ticket).
+A review created or deleted updates its ticket (see signals module), whose pages show whether it has reviews.
+
+The ETag also depends on the user and on his CSRF secret (the forms of the pages contain a token), so a page is
+never reused across users or logins. The pages with pending messages are not conditional, and the browser must
+revalidate the pages each time (Cache-Control: private, no-cache).
+"""
+
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import feed_cache
+from .models import Ticket, Review
+
+
+def conditional_page(get_validators):
+    """Decorate a view to answer the conditional GET and HEAD requests.
+
+    get_validators(request, *args, **kwargs) returns the parts of the ETag and the Last-Modified datetime
+    of the page (None to send no Last-Modified), or None when the page is not conditional.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            validators = None
+            if request.method in ('GET', 'HEAD') and not get_messages(request):
+                validators = get_validators(request, *args, **kwargs)
+            if validators is None:
+                return view(request, *args, **kwargs)
+
+            etag_parts, last_modified = validators
+            etag = compute_etag(request, etag_parts)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                if timestamp is not None:
+                    response.headers.setdefault('Last-Modified', http_date(timestamp))
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def compute_etag(request, etag_parts):
+    """Build the ETag of a page from its parts, for the user of the request."""
+
+    parts = (request.get_full_path(), request.user.pk, request.META.get('CSRF_COOKIE'), *etag_parts)
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def get_feed_validators(request):
+    """Get the validators of the feeds of the user: the parts of the ETag only (see the module docstring)."""
+
+    cache = feed_cache.get_cache()
+    if not request.user.is_authenticated or cache is None:
+        return None
+    return ('feed', feed_cache.get_version(cache, request.user.pk)), None
+
+
+get_home_feed_validators = get_own_posts_validators = get_feed_validators
+
+
+def get_ticket_validators(request, pk):
+    time_updated = Ticket.objects.filter(pk=pk).values_list('time_updated', flat=True).first()
+    if time_updated is None:
+        return None  # The view answers 404
+    return ('ticket', time_updated), time_updated
+
+
+def get_review_validators(request, pk):
+    times = Review.objects.filter(pk=pk).values_list('time_updated', 'ticket__time_updated').first()
+    if times is None:
+        return None
+    return ('review', *times), max(times)
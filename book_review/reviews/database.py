@@ -0,0 +1,105 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""SQLite database profiles for book_review project.
+
+The profile (REVIEWS_DATABASE_PROFILE setting, among REVIEWS_DATABASE_PROFILES) sets:
+- the lifetime and the options of the connections (in DATABASES, see settings.py),
+- the pragmas set on each new SQLite connection (apply_pragmas, connected to the connection_created signal),
+- the serialization of the writes: the write transactions wait for the write lock (see reviews.backends.sqlite3).
+The write lock is a lock of the process (between its threads) and a lock of a file next to the database
+(between the processes), so the writers queue instead of failing with "database is locked". It is only held during
+the write transactions, not during the rest of the requests (password hashing, image processing, rendering...).
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+try:
+    import fcntl
+except ImportError:  # Windows: the writes are only serialized between the threads of a process
+    fcntl = None
+
+WRITE_LOCK_SUFFIX = '.write-lock'
+
+_thread_lock = threading.Lock()
+_lock_files = {}  # Path of a lock file: file object (opened once by process)
+
+
+def get_profile(name=None):
+    """Get a database profile (the current one by default)."""
+
+    return settings.REVIEWS_DATABASE_PROFILES[name or settings.REVIEWS_DATABASE_PROFILE]
+
+
+def apply_connection_settings(name, alias='default'):
+    """Use the connection settings of a profile at runtime (load tests). The connections must be reopened."""
+
+    profile = get_profile(name)
+    connections[alias].settings_dict.update(CONN_MAX_AGE=profile['CONN_MAX_AGE'], OPTIONS=dict(profile['OPTIONS']))
+
+
+def apply_pragmas(connection):
+    """Set the pragmas of the current profile on a new SQLite connection."""
+
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in get_profile()['PRAGMAS'].items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def is_write_serialization_enabled():
+    return get_profile()['SERIALIZE_WRITES']
+
+
+def get_lock_file(alias='default'):
+    """Get the lock file of a database (opened once by process)."""
+
+    path = f"{connections[alias].settings_dict['NAME']}{WRITE_LOCK_SUFFIX}"
+    lock_file = _lock_files.get(path)
+    if lock_file is None:
+        lock_file = _lock_files[path] = open(path, 'a')
+    return lock_file
+
+
+def uses_lock_file(connection):
+    """Return True when the writers of a database are serialized between the processes (file lock)."""
+
+    return fcntl is not None and connection.vendor == 'sqlite' and not connection.is_in_memory_db()
+
+
+def acquire_write_lock(alias='default'):
+    """Wait for the write lock of a database, see release_write_lock."""
+
+    connection = connections[alias]
+    _thread_lock.acquire()
+    if uses_lock_file(connection):
+        try:
+            fcntl.flock(get_lock_file(alias).fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            _thread_lock.release()
+            raise
+
+
+def release_write_lock(alias='default'):
+    """Release the write lock of a database, acquired by acquire_write_lock."""
+
+    connection = connections[alias]
+    try:
+        if uses_lock_file(connection):
+            fcntl.flock(get_lock_file(alias).fileno(), fcntl.LOCK_UN)
+    finally:
+        _thread_lock.release()
+
+
+@contextmanager
+def write_lock(alias='default'):
+    """Hold the write lock of a database: only one thread of all processes can hold it at a time."""
+
+    acquire_write_lock(alias)
+    try:
+        yield
+    finally:
+        release_write_lock(alias)
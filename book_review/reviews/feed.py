@@ -0,0 +1,248 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Feed pagination for book_review project.
+
+A feed is the list of posts (tickets and reviews) displayed on the Home page and on the Posts page,
+from the newest to the oldest one.
+
+- The tickets and the reviews of a feed are merged and ordered in the database (UNION ALL),
+only the posts of the requested page are loaded.
+- Pages are navigated with a cursor (keyset pagination) on (time_created, content_type, id) of the last post
+of the previous page, so rendering any page costs the same as rendering the first one.
+- The Home feed pages are cached by user (see feed_cache module).
+- The async Home feed loads a page of tickets and a page of reviews concurrently,
+and merges them in Python (see get_posts_page and merge_posts_pages).
+- The whole feed can be read in constant memory by chunks of posts (see iter_feed_posts).
+- In timeline mode (REVIEWS_FEED_TIMELINE setting), the Home feed is read from the FeedEntry table
+(materialized feed): a page is one range scan on the timeline index of the user.
+"""
+
+import heapq
+import itertools
+
+from django.conf import settings
+from django.db.models import CharField, Exists, OuterRef, Q, Value
+from django.utils.dateparse import parse_datetime
+
+from . import feed_cache, routers
+from .models import Ticket, Review, FeedEntry
+
+TICKET = 'TICKET'
+REVIEW = 'REVIEW'
+
+DEFAULT_FEED_PAGE_SIZE = 20
+
+
+def encode_cursor(row):
+    """Build the cursor pointing after a feed row (it is used in the "older posts" link)."""
+
+    return f"{row['content_type']}_{row['id']}_{row['time_created'].isoformat()}"
+
+
+def decode_cursor(value):
+    """Parse a cursor built by encode_cursor, return None when it is missing or invalid."""
+
+    try:
+        content_type, post_id, time_created = value.split('_', 2)
+        time_created = parse_datetime(time_created)
+        post_id = int(post_id)
+    except (AttributeError, ValueError):
+        return None
+    if content_type not in (TICKET, REVIEW) or time_created is None:
+        return None
+    return time_created, content_type, post_id
+
+
+def filter_posts_before(queryset, content_type, cursor):
+    """Keep only the posts of a queryset (all of `content_type`) which come after the cursor in the feed.
+
+    Posts are ordered by time_created, then content_type, then id, all descending.
+    """
+
+    if cursor is None:
+        return queryset
+    time_created, cursor_content_type, cursor_id = cursor
+    if content_type == cursor_content_type:
+        same_time = Q(time_created=time_created, id__lt=cursor_id)
+    elif content_type < cursor_content_type:
+        same_time = Q(time_created=time_created)
+    else:
+        return queryset.filter(time_created__lt=time_created)
+    return queryset.filter(Q(time_created__lt=time_created) | same_time)
+
+
+def get_feed_rows(tickets, reviews, cursor=None):
+    """Merge tickets and reviews in the database.
+
+    Return a (not evaluated) queryset of dicts (content_type, id, time_created) ordered from the newest post.
+    """
+
+    tickets = filter_posts_before(tickets, TICKET, cursor).annotate(
+        content_type=Value(TICKET, CharField())).values('content_type', 'id', 'time_created')
+    reviews = filter_posts_before(reviews, REVIEW, cursor).annotate(
+        content_type=Value(REVIEW, CharField())).values('content_type', 'id', 'time_created')
+    return tickets.union(reviews, all=True).order_by('-time_created', '-content_type', '-id')
+
+
+def load_posts(rows):
+    """Load the tickets and reviews of feed rows (one query per post type), keeping the order of the rows.
+
+    The posts are loaded with everything the feed templates display (see the get_feed_queryset methods).
+    """
+
+    ticket_ids = [row['id'] for row in rows if row['content_type'] == TICKET]
+    review_ids = [row['id'] for row in rows if row['content_type'] == REVIEW]
+    posts_by_type = {
+        TICKET: Ticket.get_feed_queryset().in_bulk(ticket_ids) if ticket_ids else {},
+        REVIEW: Review.get_feed_queryset().in_bulk(review_ids) if review_ids else {},
+    }
+    posts = []
+    for row in rows:
+        post = posts_by_type[row['content_type']].get(row['id'])
+        if post is not None:  # The post may have been deleted meanwhile
+            post.content_type = row['content_type']
+            posts.append(post)
+    return posts
+
+
+def is_timeline_enabled():
+    """Return True when the Home feed is read from the FeedEntry table."""
+
+    return getattr(settings, 'REVIEWS_FEED_TIMELINE', False)
+
+
+def get_page_size():
+    """Number of posts by feed page (REVIEWS_FEED_PAGE_SIZE setting)."""
+
+    return getattr(settings, 'REVIEWS_FEED_PAGE_SIZE', DEFAULT_FEED_PAGE_SIZE)
+
+
+def get_feed_page(tickets, reviews, cursor=None, page_size=None):
+    """Get a page of the feed made of tickets and reviews querysets.
+
+    Return the posts of the page and the cursor of the next page (None for the last page).
+    """
+
+    page_size = page_size or get_page_size()
+    rows = list(get_feed_rows(tickets, reviews, cursor)[:page_size + 1])
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return load_posts(rows[:page_size]), next_cursor
+
+
+def iter_feed_posts(tickets, reviews, cursor=None, chunk_size=500):
+    """Yield all posts of the feed made of tickets and reviews querysets (from the cursor), from the newest one.
+
+    The feed rows are read from the database by chunks, and the posts of each chunk are loaded together,
+    so the memory used does not depend on the length of the feed.
+    """
+
+    rows = get_feed_rows(tickets, reviews, cursor).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from load_posts(chunk)
+
+
+def get_feed_key(post):
+    """Sort key of a post in a feed (the feeds are in the descending order of this key)."""
+
+    return post.time_created, post.content_type, post.pk
+
+
+def get_posts_page(posts, content_type, cursor=None, page_size=None):
+    """Load the first posts of one type (tickets or reviews) after the cursor, with one more post than a page.
+
+    The posts are loaded with everything the feed templates display (see the get_feed_queryset methods).
+    """
+
+    page_size = page_size or get_page_size()
+    model = Ticket if content_type == TICKET else Review
+    posts = model.get_feed_queryset(filter_posts_before(posts, content_type, cursor))
+    posts = list(posts.order_by('-time_created', '-id')[:page_size + 1])
+    for post in posts:
+        post.content_type = content_type
+    return posts
+
+
+def merge_posts_pages(tickets, reviews, page_size=None):
+    """Merge the pages of tickets and of reviews loaded by get_posts_page into one feed page.
+
+    Return the posts of the page and the cursor of the next page (None for the last page).
+    """
+
+    page_size = page_size or get_page_size()
+    posts = heapq.merge(tickets, reviews, key=get_feed_key, reverse=True)
+    posts = list(itertools.islice(posts, page_size + 1))
+    next_cursor = None
+    if len(posts) > page_size:
+        last_post = posts[page_size - 1]
+        next_cursor = encode_cursor(
+            {'content_type': last_post.content_type, 'id': last_post.pk, 'time_created': last_post.time_created})
+    return posts[:page_size], next_cursor
+
+
+def filter_entries_before(entries, cursor):
+    """Keep only the feed entries which come after the cursor in the timeline."""
+
+    if cursor is None:
+        return entries
+    time_created, content_type, post_id = cursor
+    return entries.filter(
+        Q(time_created__lt=time_created)
+        | Q(time_created=time_created, content_type__lt=content_type)
+        | Q(time_created=time_created, content_type=content_type, post_id__lt=post_id))
+
+
+def get_timeline_page(user, cursor=None, page_size=None):
+    """Get a page of the materialized Home feed of a user (one query on the FeedEntry table).
+
+    Return the posts of the page and the cursor of the next page (None for the last page).
+    """
+
+    page_size = page_size or get_page_size()
+    entries = filter_entries_before(FeedEntry.objects.filter(user=user), cursor).select_related(
+        'ticket__user', 'review__user', 'review__ticket__user').annotate(
+        ticket_has_reviews=Exists(Review.objects.filter(ticket=OuterRef('ticket'))))
+    entries = list(entries.order_by('-time_created', '-content_type', '-post_id')[:page_size + 1])
+    next_cursor = None
+    if len(entries) > page_size:
+        last_entry = entries[page_size - 1]
+        next_cursor = encode_cursor({
+            'content_type': last_entry.content_type,
+            'id': last_entry.post_id,
+            'time_created': last_entry.time_created})
+    posts = []
+    for entry in entries[:page_size]:
+        post = entry.post
+        post.content_type = entry.content_type
+        if entry.content_type == TICKET:
+            post.has_reviews = entry.ticket_has_reviews
+        posts.append(post)
+    return posts, next_cursor
+
+
+def get_home_feed_page(user, cursor=None, page_size=None):
+    """Get a page of the Home feed of a user (his posts, which of his following users and the replies to him).
+
+    Return the posts of the page and the cursor of the next page (None for the last page).
+    """
+
+    page_size = page_size or get_page_size()
+    page = f'{page_size}:' + ('' if cursor is None else encode_cursor(
+        {'content_type': cursor[1], 'id': cursor[2], 'time_created': cursor[0]}))
+    cached_page = feed_cache.get_page(user.id, page)
+    if cached_page is not None:
+        rows, next_cursor = cached_page
+        return load_posts(rows), next_cursor
+
+    if is_timeline_enabled():
+        posts, next_cursor = get_timeline_page(user, cursor, page_size)
+    else:
+        posts, next_cursor = get_feed_page(
+            Ticket.get_users_viewable_tickets(user), Review.get_users_viewable_reviews(user), cursor, page_size)
+    rows = [{'content_type': post.content_type, 'id': post.pk} for post in posts]
+    # A page read from the replica may miss the latest posts: it is only kept until the replica has caught up
+    timeout = routers.get_pin_seconds() if routers.is_reading_from_replica() else None
+    feed_cache.set_page(user.id, page, rows, next_cursor, timeout)
+    return posts, next_cursor
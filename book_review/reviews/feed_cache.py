@@ -0,0 +1,144 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Per-user cache of the Home feed for book_review project.
+
+The ordered list of post ids of each Home feed page is stored in the cache given by the REVIEWS_FEED_CACHE setting
+(an alias of CACHES, the size of the cache is bounded by its MAX_ENTRIES option). The cache must be shared by all
+the processes of the server (see the "feed" cache in settings.py), else a version changed by a process would not be
+seen by the others, which would keep serving the old pages.
+
+- Each user has a feed version, it is part of the keys of his cached pages.
+- A relevant event (a post of the user or of a followed user is created, updated or deleted, a reply to one of
+his tickets, a follow or an unfollow) changes the version, so the old pages are never read again
+and are evicted by the cache.
+- Hits and misses are counted in the cache itself, see get_stats(). In a cache shared by processes, they are
+approximate: an increment reads then writes the counter, so the increments of concurrent processes can be lost.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+VERSION_KEY = 'feed:version:{user_id}'
+PAGE_KEY = 'feed:page:{user_id}:{version}:{page}'
+HITS_KEY = 'feed:stats:hits'
+MISSES_KEY = 'feed:stats:misses'
+
+
+def get_cache():
+    """Get the cache used for the feeds, None when the feed cache is disabled."""
+
+    alias = getattr(settings, 'REVIEWS_FEED_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_timeout():
+    """Lifetime in seconds of a cached feed page (REVIEWS_FEED_CACHE_TIMEOUT setting)."""
+
+    return getattr(settings, 'REVIEWS_FEED_CACHE_TIMEOUT', 300)
+
+
+def new_version():
+    """A new feed version, unique even when an evicted version is recreated."""
+
+    return time.time_ns()
+
+
+def get_version(cache, user_id):
+    """Get the current feed version of a user."""
+
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        # Another request may have set the version meanwhile, keep the first one.
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate(user_ids):
+    """Invalidate the cached feeds of users (called when a relevant event happens)."""
+
+    cache = get_cache()
+    if cache is None:
+        return
+    version = new_version()
+    cache.set_many({VERSION_KEY.format(user_id=user_id): version for user_id in set(user_ids)}, timeout=None)
+
+
+def get_page_key(cache, user_id, page):
+    """Build the cache key of a feed page (page identifies the page in the feed of the user)."""
+
+    return PAGE_KEY.format(user_id=user_id, version=get_version(cache, user_id), page=page)
+
+
+def count(cache, key):
+    """Increment a statistic counter stored in the cache (lost increments: see are_counts_approximate)."""
+
+    try:
+        cache.incr(key)
+    except ValueError:  # The counter does not exist yet (or it has been evicted)
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def are_counts_approximate(cache):
+    """Return True when the counters of a cache can lose increments.
+
+    The increments of a local memory cache are atomic (under its lock), but the increments of a cache shared by
+    processes (e.g. file based) are not atomic across the processes: the counts are then a lower bound.
+    """
+
+    return not isinstance(cache, LocMemCache)
+
+
+def get_page(user_id, page):
+    """Get a cached feed page: a (rows, next_cursor) tuple, or None when it is not cached."""
+
+    cache = get_cache()
+    if cache is None:
+        return None
+    cached_page = cache.get(get_page_key(cache, user_id, page))
+    count(cache, MISSES_KEY if cached_page is None else HITS_KEY)
+    return cached_page
+
+
+def set_page(user_id, page, rows, next_cursor, timeout=None):
+    """Cache a feed page (rows are dicts with the content_type and the id of the posts).
+
+    timeout (seconds) shortens the lifetime of the page, e.g. when it has been read from a lagging replica.
+    """
+
+    cache = get_cache()
+    if cache is not None:
+        timeout = get_timeout() if timeout is None else min(timeout, get_timeout())
+        cache.set(get_page_key(cache, user_id, page), (rows, next_cursor), timeout=timeout)
+
+
+def get_stats():
+    """Get the number of hits and misses of the feed cache and the hit ratio."""
+
+    cache = get_cache()
+    if cache is None:
+        return {'enabled': False, 'hits': 0, 'misses': 0, 'hit_ratio': None, 'approximate': False}
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    return {
+        'enabled': True,
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+        'approximate': are_counts_approximate(cache),
+        'timeout': get_timeout(),
+    }
+
+
+def clear():
+    """Invalidate the cached feeds of all users (after bulk changes, which send no signal)."""
+
+    cache = get_cache()
+    if cache is not None:
+        cache.clear()
@@ -89,6 +89,19 @@ class TicketModelForm(forms.ModelForm):
         model = Ticket
         fields = ["title", "description", "image"]
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        """Keep the reasons of the uploads rejected by the upload handler (see reviews.uploadhandlers)."""
+
+        super(TicketModelForm, self).__init__(*args, **kwargs)
+        self.upload_errors = upload_errors or {}
+
+    def clean_image(self):
+        """Display the reason why the uploaded image has been rejected while it was received."""
+
+        if self.add_prefix("image") in self.upload_errors:
+            raise forms.ValidationError(self.upload_errors[self.add_prefix("image")])
+        return self.cleaned_data["image"]
+
 
 class ReviewModelForm(forms.ModelForm):
     """Form to display Review's attributes."""
@@ -0,0 +1,97 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Cache of the rendered post snippets (template fragments) for book_review project.
+
+The snippets of the tickets and reviews (post_fragment tag, reviews_fragments library) are stored in the cache
+given by the REVIEWS_FRAGMENT_CACHE setting (an alias of CACHES), under a key made of:
+- the name of the fragment, the type and the id of the post,
+- the version of the post: its update time, and for a review the update time of its ticket (displayed with it),
+- the perspective of the viewer when the fragment depends on it ("own" post or "other" user's post),
+- the language and the other values the fragment depends on (e.g. whether a ticket has reviews).
+
+An updated post gets a new version, so its old fragments are never read again and expire
+(REVIEWS_FRAGMENT_CACHE_TIMEOUT setting, which also bounds how long a renamed user is displayed with his old name).
+The fragments must not contain anything specific to a request, as a CSRF token.
+Hits and misses are counted in the cache itself, see get_stats() (approximate in a cache shared by processes).
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import translation
+
+from .feed_cache import are_counts_approximate, count
+
+FRAGMENT_KEY = 'fragment:{name}:{model}:{id}:{version}:{perspective}:{vary_on}'
+HITS_KEY = 'fragment:stats:hits'
+MISSES_KEY = 'fragment:stats:misses'
+
+
+def get_cache():
+    """Get the cache used for the fragments, None when the fragment cache is disabled."""
+
+    alias = getattr(settings, 'REVIEWS_FRAGMENT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_timeout():
+    """Lifetime in seconds of a cached fragment (REVIEWS_FRAGMENT_CACHE_TIMEOUT setting)."""
+
+    return getattr(settings, 'REVIEWS_FRAGMENT_CACHE_TIMEOUT', 3600)
+
+
+def get_post_version(post):
+    """Get the version of a post: the update times (in microseconds) of the post and of its ticket for a review."""
+
+    posts = [post, post.ticket] if hasattr(post, 'ticket_id') else [post]
+    return '.'.join(str(int(instance.time_updated.timestamp() * 1000000)) for instance in posts)
+
+
+def get_perspective(post, viewer):
+    """Get the perspective of a viewer on a post: "own" for his posts, "other" else, "-" without viewer."""
+
+    if viewer is None:
+        return '-'
+    return 'own' if post.user_id == viewer.pk else 'other'
+
+
+def get_key(name, post, viewer=None, vary_on=()):
+    """Build the cache key of a fragment of a post."""
+
+    vary_on = hashlib.md5(repr((translation.get_language(), *vary_on)).encode()).hexdigest()
+    return FRAGMENT_KEY.format(name=name, model=post._meta.model_name, id=post.pk, version=get_post_version(post),
+                               perspective=get_perspective(post, viewer), vary_on=vary_on)
+
+
+def render_fragment(render, name, post, viewer=None, vary_on=()):
+    """Get a fragment of a post from the cache, or render it with render() and cache it."""
+
+    cache = get_cache()
+    if cache is None:
+        return render()
+    key = get_key(name, post, viewer, vary_on)
+    fragment = cache.get(key)
+    count(cache, MISSES_KEY if fragment is None else HITS_KEY)
+    if fragment is None:
+        fragment = render()
+        cache.set(key, fragment, timeout=get_timeout())
+    return fragment
+
+
+def get_stats():
+    """Get the number of hits and misses of the fragment cache and the hit ratio."""
+
+    cache = get_cache()
+    if cache is None:
+        return {'enabled': False, 'hits': 0, 'misses': 0, 'hit_ratio': None, 'approximate': False}
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    return {
+        'enabled': True,
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+        'approximate': are_counts_approximate(cache),
+        'timeout': get_timeout(),
+    }
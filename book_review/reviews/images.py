@@ -0,0 +1,108 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Resized variants of the ticket images for book_review project.
+
+The uploaded images are kept at full resolution, and smaller variants are created next to them
+(in the "variants" directory of the media storage):
+- "feed": thumbnail displayed in the feeds,
+- "detail": image displayed on the detail pages.
+
+Each variant is saved in the format of the original image and, when the REVIEWS_IMAGE_WEBP setting is enabled,
+also in WebP. The template tag responsive_image (reviews_images library) picks the right variant.
+"""
+
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Name of the variant: maximal (width, height) of the resized image
+VARIANT_SIZES = {
+    'feed': (400, 400),
+    'detail': (1024, 1024),
+}
+VARIANTS_DIRECTORY = 'variants'
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+
+def is_webp_enabled():
+    """Return True when WebP variants are created (REVIEWS_IMAGE_WEBP setting)."""
+
+    return getattr(settings, 'REVIEWS_IMAGE_WEBP', True)
+
+
+def get_variant_name(name, variant, webp=False):
+    """Get the storage name of a variant of an image, e.g. images/cover.jpg -> variants/feed/images/cover.jpg"""
+
+    if webp:
+        name = os.path.splitext(name)[0] + '.webp'
+    return f'{VARIANTS_DIRECTORY}/{variant}/{name}'
+
+
+def resize(image, size, image_format, quality):
+    """Resize an image to fit in size (without upscaling it) and encode it, return the bytes."""
+
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    if image_format in ('JPEG', 'WEBP') and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def generate_variants(name, storage=default_storage):
+    """Create (or replace) all variants of an image of the storage. Return the names of the created files."""
+
+    with storage.open(name, 'rb') as image_file:
+        image = Image.open(image_file)
+        image_format = image.format if image.format in ('JPEG', 'PNG', 'GIF', 'WEBP') else 'JPEG'
+        # Apply the EXIF orientation, the variants have no EXIF data
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    created_names = []
+    for variant, size in VARIANT_SIZES.items():
+        encodings = [(get_variant_name(name, variant), image_format, JPEG_QUALITY)]
+        if is_webp_enabled() and image_format != 'WEBP':
+            encodings.append((get_variant_name(name, variant, webp=True), 'WEBP', WEBP_QUALITY))
+        for variant_name, variant_format, quality in encodings:
+            content = resize(image, size, variant_format, quality)
+            if storage.exists(variant_name):
+                storage.delete(variant_name)
+            created_names.append(storage.save(variant_name, ContentFile(content)))
+    return created_names
+
+
+def has_variants(name, storage=default_storage):
+    """Return True when the variants of an image already exist."""
+
+    return all(storage.exists(get_variant_name(name, variant)) for variant in VARIANT_SIZES)
+
+
+def delete_variants(name, storage=default_storage):
+    """Delete all variants of an image."""
+
+    for variant in VARIANT_SIZES:
+        for webp in (False, True):
+            variant_name = get_variant_name(name, variant, webp)
+            if storage.exists(variant_name):
+                storage.delete(variant_name)
+
+
+def get_variant_urls(image, variant, storage=default_storage):
+    """Get the URL of a variant of an image field file and the URL of its WebP version (None when missing).
+
+    The URL of the original image is returned when the variant does not exist (yet).
+    """
+
+    variant_name = get_variant_name(image.name, variant)
+    if not storage.exists(variant_name):
+        return image.url, None
+    webp_name = get_variant_name(image.name, variant, webp=True)
+    webp_url = storage.url(webp_name) if is_webp_enabled() and storage.exists(webp_name) else None
+    return storage.url(variant_name), webp_url
@@ -0,0 +1,54 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Jinja2 environment of book_review project (templates of reviews/jinja2/, see template_backends module).
+
+The Jinja2 templates get the helpers of the Django template tags they replace:
+- url(name, *args): reverse the URL of a view ({% url %}),
+- static(path): URL of a static file ({% static %}),
+- image_variant_urls(image, variant): URLs of a resized variant of an image (responsive_image tag),
+- post_fragment(name, post, viewer, *vary_on): cache the fragment of a post, in a call block (post_fragment tag),
+- localize filter: display a date in the current time zone and language, as the Django templates do.
+
+The snippets of the posts are macros (imported once by the pages) instead of included templates.
+"""
+
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils import formats, timezone
+from jinja2 import Environment
+from markupsafe import Markup
+
+from . import fragment_cache
+from .images import get_variant_urls
+
+
+def url(name, *args, **kwargs):
+    return reverse(name, args=args or None, kwargs=kwargs or None)
+
+
+def localize(value):
+    """Display a value (e.g. a datetime) as the Django templates do."""
+
+    return formats.localize(timezone.template_localtime(value))
+
+
+def post_fragment(name, post, viewer=None, *vary_on, caller):
+    """Get the fragment of a post (the body of the call block) from the fragment cache, or render it.
+
+    Usage:
+        {% call post_fragment('ticket', post, user, post.has_reviews) %} ... {% endcall %}
+    """
+
+    return Markup(fragment_cache.render_fragment(caller, f'jinja2-{name}', post, viewer=viewer, vary_on=vary_on))
+
+
+def environment(**options):
+    env = Environment(**options)
+    env.globals.update({
+        'url': url,
+        'static': static,
+        'image_variant_urls': get_variant_urls,
+        'post_fragment': post_fragment,
+    })
+    env.filters['localize'] = localize
+    return env
@@ -0,0 +1,166 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Virtual users of the load_test command for book_review project.
+
+A virtual user sends requests to the WSGI application (book_review/wsgi.py) as a browser would:
+it keeps its cookies (session and CSRF token), logs in with the login form, then performs operations
+drawn from a weighted mix:
+- login: log in again (the login page, then the login form),
+- feed: read the Home feed,
+- ticket: create a ticket (TicketCreateView),
+- review: create a ticket and its review (create_new_ticket_review_view),
+- follow: follow a random user.
+
+The requests which fail because the database is locked are counted apart (got_request_exception signal).
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from django.db import OperationalError, close_old_connections, connections
+from django.core.signals import got_request_exception
+from django.urls import reverse
+
+from .benchmarking import wsgi_request
+
+OPERATIONS = ('login', 'feed', 'ticket', 'review', 'follow')
+PASSWORD = 'load-test-password'
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+_local = threading.local()
+
+
+def is_lock_error(exception):
+    """Return True when an exception is the "database is locked" error of SQLite."""
+
+    return isinstance(exception, OperationalError) and 'locked' in str(exception)
+
+
+def count_lock_error(sender, **kwargs):
+    """Count the requests of the current thread which failed because the database was locked."""
+
+    if is_lock_error(sys.exc_info()[1]):
+        _local.lock_errors = getattr(_local, 'lock_errors', 0) + 1
+
+
+def setup_worker(database_name=None, profile=None, cache_settings=None):
+    """Prepare a worker process: set Django up and use the database (and the database profile) and the caches
+    of the load test."""
+
+    import django
+
+    django.setup()
+    if database_name:
+        from django.conf import settings
+        from django.db import connections
+        from django.test.utils import override_settings
+
+        from .database import apply_connection_settings
+
+        connections['default'].settings_dict['NAME'] = database_name
+        settings.REVIEWS_DATABASE_PROFILE = profile
+        apply_connection_settings(profile)
+        override_settings(CACHES=cache_settings).enable()  # For the life of the process
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)  # The errors are counted, not logged
+
+
+class CookieJar:
+    """Cookies of a virtual user, updated with the Set-Cookie headers of the responses."""
+
+    def __init__(self):
+        self.cookies = {}
+
+    def update(self, headers):
+        for name, value in headers:
+            if name.lower() != 'set-cookie':
+                continue
+            for morsel in SimpleCookie(value).values():
+                if morsel['max-age'] == '0' or not morsel.value:
+                    self.cookies.pop(morsel.key, None)
+                else:
+                    self.cookies[morsel.key] = morsel.value
+
+    def header(self):
+        return '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+
+
+class VirtualUser:
+    """User who sends requests to the WSGI application, and records (operation, success, latency) of each one."""
+
+    def __init__(self, application, username, usernames, rng):
+        self.application = application
+        self.username = username
+        self.usernames = usernames
+        self.rng = rng
+        self.cookies = CookieJar()
+        self.records = []
+
+    def request(self, path, data=None):
+        """Send a GET request (or a POST request of a form when data is given), return the status code."""
+
+        body = b''
+        if data is not None:
+            data['csrfmiddlewaretoken'] = self.cookies.cookies.get('csrftoken', '')
+            body = urlencode(data).encode()
+        status, headers, _ = wsgi_request(
+            self.application, path, self.cookies.header(), method='GET' if data is None else 'POST',
+            body=body, content_type=FORM_CONTENT_TYPE if data is not None else '')
+        self.cookies.update(headers)
+        close_old_connections()
+        return status
+
+    def login(self):
+        self.request(reverse('reviews:connection'))  # Sets the CSRF cookie
+        return self.request(reverse('reviews:connection'), {'username': self.username, 'password': PASSWORD})
+
+    def feed(self):
+        return self.request(reverse('reviews:home'))
+
+    def ticket(self):
+        title = f'Livre {self.rng.randrange(10 ** 6)}'
+        return self.request(reverse('reviews:ticket-create'), {'title': title, 'description': 'Demande de critique'})
+
+    def review(self):
+        return self.request(reverse('reviews:review-create'), {
+            'new_ticket_review': 'new_ticket_review',
+            'title': f'Livre {self.rng.randrange(10 ** 6)}',
+            'description': 'Critique du livre',
+            'headline': 'Titre de la critique',
+            'rating': self.rng.randint(0, 5),
+            'body': 'Avis sur le livre. ' * 10,
+        })
+
+    def follow(self):
+        return self.request(reverse('reviews:user-follows'), {'will_follow_user': self.rng.choice(self.usernames)})
+
+    def run_operation(self, operation):
+        start = time.perf_counter()
+        lock_errors = getattr(_local, 'lock_errors', 0)
+        status = getattr(self, operation)()
+        lock_error = getattr(_local, 'lock_errors', 0) > lock_errors
+        self.records.append((operation, status < 400, lock_error, time.perf_counter() - start))
+
+
+def run_virtual_user(index, usernames, mix, duration, seed):
+    """Run a virtual user during `duration` seconds. Return its records (operation, success, lock error, latency).
+
+    mix gives the weight of each operation. It is the function run by the threads and the processes of load_test.
+    """
+
+    from book_review.wsgi import application
+
+    got_request_exception.connect(count_lock_error, dispatch_uid='load_test_lock_errors')
+    rng = random.Random(seed + index)
+    user = VirtualUser(application, usernames[index % len(usernames)], usernames, rng)
+    user.run_operation('login')
+    operations, weights = zip(*mix.items())
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        user.run_operation(rng.choices(operations, weights)[0])
+    connections.close_all()  # The persistent connection of the worker
+    return user.records
@@ -0,0 +1,118 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Benchmark of the async Home feed (ASGI) against the sync Home feed (WSGI).
+
+A temporary database is filled with a user who follows many users, then the same number of requests of his
+Home page is sent:
+- to the WSGI application (book_review/wsgi.py) by a pool of threads, like a threaded WSGI server,
+- to the ASGI application (book_review/asgi.py) by concurrent tasks of one event loop, like uvicorn.
+The clients may be slow (--client-delay), a slow client holds a WSGI thread but no ASGI worker.
+
+Usage:
+    python manage.py bench_async_feed --requests 200 --threads 8 --concurrency 64 --client-delay 0.05
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from reviews.benchmarking import asgi_request, create_session_cookie, summarize, temporary_database, wsgi_request
+from reviews.models import Ticket, Review, UserFollows
+
+
+def seed(follow_count, posts_per_user):
+    """Create a reader who follows `follow_count` users, each of them with tickets and reviews."""
+
+    reader = User.objects.create_user(username='reader', password='bench-password')
+    User.objects.bulk_create([User(username=f'writer_{i}') for i in range(follow_count)])
+    writers = list(User.objects.filter(username__startswith='writer_'))
+    UserFollows.objects.bulk_create([UserFollows(user=reader, followed_user=writer) for writer in writers])
+    Ticket.objects.bulk_create([
+        Ticket(title=f'Ticket {i} of {writer.username}', description='Description ' * 20, user=writer)
+        for writer in writers for i in range(posts_per_user)])
+    tickets = list(Ticket.objects.all())
+    Review.objects.bulk_create([
+        Review(ticket=ticket, rating=i % 6, headline=f'Review {i}', body='Body ' * 50, user=writers[i % len(writers)])
+        for i, ticket in enumerate(tickets)])
+    return reader
+
+
+class Command(BaseCommand):
+    help = "Compare the async Home feed under ASGI concurrency with the sync Home feed under WSGI threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Number of requests by run.")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI threads.")
+        parser.add_argument('--concurrency', type=int, default=64, help="Concurrent ASGI requests.")
+        parser.add_argument('--client-delay', type=float, default=0.0,
+                            help="Seconds taken by a slow client to receive each chunk of the response.")
+        parser.add_argument('--follows', type=int, default=200, help="Number of users followed by the reader.")
+        parser.add_argument('--posts-per-user', type=int, default=5, help="Tickets created by each followed user.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        # The feed cache would hide the cost of the feed queries
+        with temporary_database(), override_settings(REVIEWS_FEED_CACHE=None, REVIEWS_FEED_TIMELINE=False):
+            reader = seed(options['follows'], options['posts_per_user'])
+            cookie = create_session_cookie(reader)
+            close_old_connections()
+            results = {
+                'wsgi': self.run_wsgi(reverse('reviews:home'), cookie, options),
+                'asgi': self.run_asgi(reverse('reviews:home-async'), cookie, options),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: {result['requests']} requests, {result['errors']} errors, "
+                f"{result['throughput']:.1f} req/s, p50 {result['p50_ms']:.1f} ms, "
+                f"p90 {result['p90_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms")
+
+    def run_wsgi(self, path, cookie, options):
+        from book_review.wsgi import application
+
+        def send_request(_):
+            start = time.perf_counter()
+            try:
+                status, _, _ = wsgi_request(application, path, cookie, client_delay=options['client_delay'])
+            finally:
+                close_old_connections()
+            return status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            responses = list(executor.map(send_request, range(options['requests'])))
+        return self.get_result(responses, time.perf_counter() - start)
+
+    def run_asgi(self, path, cookie, options):
+        from book_review.asgi import application
+
+        async def run():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def send_request():
+                async with semaphore:
+                    start = time.perf_counter()
+                    status, _ = await asgi_request(application, path, cookie, client_delay=options['client_delay'])
+                    return status, time.perf_counter() - start
+
+            return await asyncio.gather(*(send_request() for _ in range(options['requests'])))
+
+        start = time.perf_counter()
+        responses = asyncio.run(run())
+        return self.get_result(responses, time.perf_counter() - start)
+
+    @staticmethod
+    def get_result(responses, elapsed):
+        result = summarize([latency for _, latency in responses], elapsed)
+        result['errors'] = sum(1 for status, _ in responses if status != 200)
+        return result
@@ -0,0 +1,113 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Benchmark of the rendering of the feed templates with the Django and the Jinja2 engines.
+
+A temporary database is filled with a user who follows a writer, and a feed of --posts posts (half tickets,
+half reviews) is loaded once. Then the Home and Posts templates are rendered --renders times with each engine
+(see REVIEWS_TEMPLATE_ENGINE), without the fragment cache and with a warm fragment cache. Only the rendering
+is timed: the posts are already loaded, and the engines are configured as in production (compiled templates
+kept in memory, even with DEBUG), so the templates are compiled once.
+
+Usage:
+    python manage.py bench_templates --posts 200 --renders 50
+"""
+
+import copy
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from reviews import feed
+from reviews.benchmarking import summarize, temporary_database
+from reviews.models import Ticket, Review, UserFollows
+
+ENGINES = ('django', 'jinja2')
+# Name of the benchmarked page: template
+PAGES = {'home': 'reviews/users/home.html', 'own-posts': 'reviews/users/own_posts.html'}
+
+
+def get_production_templates():
+    """Get the TEMPLATES setting with the template caches of production (see settings.py)."""
+
+    templates = copy.deepcopy(settings.TEMPLATES)
+    for config in templates:
+        if config['NAME'] == 'django':
+            config['OPTIONS']['loaders'] = [('django.template.loaders.cached.Loader', settings.TEMPLATE_LOADERS)]
+        elif config['NAME'] == 'jinja2':
+            config['OPTIONS']['auto_reload'] = False
+    return templates
+
+
+def seed(post_count):
+    """Create a reader who follows a writer, and post_count posts of both users. Return the reader."""
+
+    reader = User.objects.create_user(username='reader')
+    writer = User.objects.create_user(username='writer')
+    UserFollows.objects.create(user=reader, followed_user=writer)
+    Ticket.objects.bulk_create([
+        Ticket(title=f"Livre {i}", description="Description du livre. " * 10, user=writer if i % 2 else reader)
+        for i in range(post_count - post_count // 2)])
+    Review.objects.bulk_create([
+        Review(ticket=ticket, rating=ticket.id % 6, headline=f"Critique {ticket.id}", body="Critique du livre. " * 20,
+               user=reader if ticket.user_id == writer.id else writer)
+        for ticket in Ticket.objects.all()[:post_count // 2]])
+    return reader
+
+
+class Command(BaseCommand):
+    help = "Compare the time to render the feed templates with the Django and the Jinja2 engines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=200, help="Number of posts of the rendered feed.")
+        parser.add_argument('--renders', type=int, default=50, help="Number of timed renders by case.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with temporary_database(), override_settings(TEMPLATES=get_production_templates()):
+            reader = seed(options['posts'])
+            posts, _ = feed.get_feed_page(
+                Ticket.get_users_viewable_tickets(reader), Review.get_users_viewable_reviews(reader),
+                page_size=options['posts'])
+            request = RequestFactory().get('/')
+            request.user = reader
+            request._messages = CookieStorage(request)  # No message, without session
+            context = {'posts': posts, 'next_cursor': None}
+
+            for page, template_name in PAGES.items():
+                for engine in ENGINES:
+                    for fragment_cache_alias in (None, 'fragments'):
+                        case = f"{page}/{engine}/{'fragment-cache' if fragment_cache_alias else 'no-cache'}"
+                        with override_settings(REVIEWS_FRAGMENT_CACHE=fragment_cache_alias):
+                            results[case] = self.measure(template_name, engine, context, request, options['renders'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for case, result in results.items():
+            self.stdout.write(
+                f"{case}: p50 {result['p50_ms']:.2f} ms, p90 {result['p90_ms']:.2f} ms, "
+                f"max {result['max_ms']:.2f} ms, {result['size_kb']:.0f} KiB")
+
+    @staticmethod
+    def measure(template_name, engine, context, request, render_count):
+        """Time the renders of a template (after a first render, which compiles it and fills the caches)."""
+
+        content = render_to_string(template_name, context, request, using=engine)
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(render_count):
+            render_start = time.perf_counter()
+            render_to_string(template_name, context, request, using=engine)
+            latencies.append(time.perf_counter() - render_start)
+        result = summarize(latencies, time.perf_counter() - start)
+        del result['requests'], result['throughput']
+        result['size_kb'] = len(content.encode()) / 1024
+        return result
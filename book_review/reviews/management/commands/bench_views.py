@@ -0,0 +1,131 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Benchmark of the pages of the users (Home, own posts, follows) on synthetic social graphs of several sizes.
+
+For each graph size, a temporary database is filled by reviews.synthetic, then each page is requested through
+the WSGI application for two readers: a typical one (median number of followed users) and a heavy one
+(the user who follows the most users). For each page, the command reports:
+- the latency percentiles of --requests requests,
+- the number of SQL queries of a request,
+- the peak memory allocated by a request (tracemalloc).
+The feed cache is disabled, so each request computes its page.
+
+The results can be saved as a baseline (JSON file), and compared with a baseline: the command fails when
+a median or p90 latency or a peak memory is more than --tolerance higher, or when a page makes more queries.
+
+Usage:
+    python manage.py bench_views --sizes 100 1000 10000 --save-baseline bench_views.json
+    python manage.py bench_views --sizes 100 1000 10000 --baseline bench_views.json --tolerance 0.25
+"""
+
+import json
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from reviews.benchmarking import create_session_cookie, find_regressions, summarize, temporary_database, wsgi_request
+from reviews.synthetic import generate_social_graph
+
+BENCHMARKED_URL_NAMES = ('reviews:home', 'reviews:own-posts', 'reviews:user-follows')
+# Metrics compared with the baseline (the highest percentiles are too noisy)
+COMPARED_METRICS = ('p50_ms', 'p90_ms', 'queries', 'peak_memory_kb')
+
+
+def get_readers():
+    """Get the benchmarked readers: {'typical': user with the median number of follows, 'heavy': the maximal one}."""
+
+    users = list(User.objects.annotate(follow_count=Count('following')).order_by('follow_count', 'id'))
+    return {'typical': users[len(users) // 2], 'heavy': users[-1]}
+
+
+class Command(BaseCommand):
+    help = "Measure the latency, the queries and the memory of the pages of the users on synthetic social graphs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000],
+                            help="Numbers of users of the graphs.")
+        parser.add_argument('--requests', type=int, default=20, help="Number of timed requests by page.")
+        parser.add_argument('--mean-follows', type=float, default=20, help="Mean number of users followed by a user.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator.")
+        parser.add_argument('--save-baseline', metavar='PATH', help="Save the results as a baseline.")
+        parser.add_argument('--baseline', metavar='PATH', help="Compare the results with a saved baseline.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Accepted increase of the latencies and of the memory (fraction, default: 0.25).")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        from book_review.wsgi import application
+
+        results = {}
+        for size in options['sizes']:
+            with temporary_database(), override_settings(REVIEWS_FEED_CACHE=None):
+                counts = generate_social_graph(users=size, mean_follows=options['mean_follows'], seed=options['seed'])
+                if options['verbosity'] > 1:
+                    self.stderr.write(f"Graph of {size} users: {counts}")
+                for reader_name, reader in get_readers().items():
+                    cookie = create_session_cookie(reader)
+                    for url_name in BENCHMARKED_URL_NAMES:
+                        case = f"{size}/{reader_name}/{url_name.split(':')[1]}"
+                        results[case] = self.measure(application, reverse(url_name), cookie, options['requests'])
+                close_old_connections()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for case, result in results.items():
+                self.stdout.write(
+                    f"{case}: p50 {result['p50_ms']:.1f} ms, p90 {result['p90_ms']:.1f} ms, "
+                    f"p99 {result['p99_ms']:.1f} ms, {result['queries']} queries, "
+                    f"peak memory {result['peak_memory_kb']:.0f} KiB")
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as baseline_file:
+                json.dump(results, baseline_file, indent=2)
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = find_regressions(results, baseline, options['tolerance'], COMPARED_METRICS)
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regression against the baseline."))
+
+    @staticmethod
+    def measure(application, path, cookie, request_count):
+        """Measure the queries, the peak memory and the latencies of the requests of a page."""
+
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        # connection.queries is reset when a request starts, the queries are counted by a wrapper
+        with connection.execute_wrapper(count_query):
+            status, _, _ = wsgi_request(application, path, cookie)  # Also warms up the caches of Django
+        if status != 200:
+            raise CommandError(f"{path} answered {status}.")
+
+        tracemalloc.start()
+        try:
+            wsgi_request(application, path, cookie)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(request_count):
+            request_start = time.perf_counter()
+            wsgi_request(application, path, cookie)
+            latencies.append(time.perf_counter() - request_start)
+        result = summarize(latencies, time.perf_counter() - start)
+        del result['requests'], result['throughput']
+        result['queries'] = len(queries)
+        result['peak_memory_kb'] = peak_memory / 1024
+        return result
@@ -0,0 +1,74 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to convert the ticket images stored before the content-addressed storage (see reviews.storage).
+
+Each image is hashed and moved to its content-addressed name, the tickets are updated to point at it,
+and the copies of the same content are removed.
+
+Usage:
+    python manage.py dedup_media --dry-run
+    python manage.py dedup_media
+"""
+
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from reviews import images
+from reviews.models import Ticket
+from reviews.storage import get_blob_name, hash_file, is_blob_name, is_content_addressed
+
+
+class Command(BaseCommand):
+    help = "Store the existing ticket images once by content and point the tickets at them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only display what would be done.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        names = Ticket.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True)
+        names = sorted(name for name in set(names) if is_content_addressed(name) and not is_blob_name(name))
+
+        moved = removed = missing = 0
+        freed_bytes = 0
+        blob_names = set()  # Content-addressed names already used during this run (for the dry run)
+        for name in names:
+            if not default_storage.exists(name):
+                missing += 1
+                self.stderr.write(f"{name}: missing file, skipped")
+                continue
+            with default_storage.open(name, 'rb') as image_file:
+                blob_name = get_blob_name(name, hash_file(image_file))
+            already_stored = blob_name in blob_names or default_storage.exists(blob_name)
+            blob_names.add(blob_name)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{name} -> {blob_name}{' (duplicate)' if already_stored else ''}")
+            if already_stored:
+                removed += 1
+                freed_bytes += default_storage.size(name)
+            else:
+                moved += 1
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                if not already_stored:
+                    full_path = default_storage.path(blob_name)
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(default_storage.path(name), full_path)
+                # time_updated is set too: the validators and the cached fragments of the tickets change
+                Ticket.objects.filter(image=name).update(image=blob_name, time_updated=timezone.now())
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            images.delete_variants(name)
+            if not images.has_variants(blob_name):
+                images.generate_variants(blob_name)
+
+        prefix = "[dry run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{moved} images moved, {removed} duplicates removed ({freed_bytes / 1024 / 1024:.1f} MiB), "
+            f"{missing} missing."))
@@ -0,0 +1,69 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to export the tickets, the reviews and the follows to a JSONL file (one JSON object by line).
+
+The rows are streamed from the database, so the export uses little memory whatever the size of the tables.
+The users are referenced by their username (the accounts themselves, with their passwords, are not exported)
+and the images by their name in the media storage (the files must be copied separately).
+The file is read by the import_jsonl command.
+
+Usage:
+    python manage.py export_jsonl data.jsonl
+    python manage.py export_jsonl - > data.jsonl
+"""
+
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from reviews.models import Review, Ticket, UserFollows
+
+# Model name in the file: (model, exported fields), in the order of the export (a row follows what it references)
+EXPORTED_MODELS = {
+    'ticket': (Ticket, ('id', 'title', 'description', 'image', 'user__username', 'time_created')),
+    'review': (Review, ('id', 'ticket_id', 'rating', 'headline', 'body', 'user__username', 'time_created')),
+    'userfollows': (UserFollows, ('user__username', 'followed_user__username')),
+}
+# Name in the file of the fields which are not exported under their own name
+RENAMED_FIELDS = {
+    'ticket_id': 'ticket',
+    'user__username': 'user',
+    'followed_user__username': 'followed_user',
+}
+
+
+def serialize_row(model_name, row):
+    """Convert a row (dictionary of the exported fields) to a line of the JSONL file."""
+
+    record = {'model': model_name}
+    for field, value in row.items():
+        if field == 'time_created':
+            value = value.isoformat()
+        record[RENAMED_FIELDS.get(field, field)] = value
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class Command(BaseCommand):
+    help = "Export the tickets, the reviews and the follows to a JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the exported file, - for the standard output.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Number of rows fetched at once.")
+
+    def handle(self, *args, **options):
+        output = sys.stdout if options['path'] == '-' else open(options['path'], 'w', encoding='utf-8')
+        counts = {}
+        try:
+            for model_name, (model, fields) in EXPORTED_MODELS.items():
+                rows = model.objects.order_by('id').values(*fields)
+                counts[model_name] = 0
+                for row in rows.iterator(chunk_size=options['chunk_size']):
+                    output.write(serialize_row(model_name, row))
+                    counts[model_name] += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        summary = ', '.join(f"{count} {model_name}" for model_name, count in counts.items())
+        self.stderr.write(self.style.SUCCESS(f"Exported: {summary}."))
@@ -0,0 +1,79 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to remove the orphaned files of the content-addressed storage (see reviews.storage).
+
+A file is orphaned when no ticket points at it anymore (the ticket has been deleted or its image changed).
+Its resized variants are removed with it. Recent files are kept (--grace-minutes), as an image may have been
+uploaded for a ticket which is not saved yet (an upload of an existing content updates the modification time of
+the file). Right before a file is removed, its references and its modification time are checked again.
+
+Usage:
+    python manage.py gc_media --dry-run
+    python manage.py gc_media --grace-minutes 60
+"""
+
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from reviews import images
+from reviews.models import Ticket
+from reviews.storage import CONTENT_ADDRESSED_DIRECTORIES, UPLOADS_DIRECTORY
+
+
+def walk_files(directory):
+    """Yield the names (relative to the media root) of all files of a storage directory."""
+
+    root = default_storage.path('')
+    for path, _, file_names in os.walk(default_storage.path(directory)):
+        for file_name in file_names:
+            yield os.path.relpath(os.path.join(path, file_name), root).replace(os.sep, '/')
+
+
+class Command(BaseCommand):
+    help = "Remove the stored images (and their variants) which no ticket points at."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only display what would be removed.")
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help="Keep the files modified during the last minutes (default: 60).")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        oldest_kept = time.time() - options['grace_minutes'] * 60
+        referenced = set(Ticket.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True))
+
+        orphans = []
+        for directory in CONTENT_ADDRESSED_DIRECTORIES + (UPLOADS_DIRECTORY,):
+            for name in walk_files(directory):
+                if name not in referenced and os.path.getmtime(default_storage.path(name)) < oldest_kept:
+                    orphans.append(name)
+
+        removed = freed_bytes = 0
+        for name in orphans:
+            if not dry_run and not self.is_still_orphaned(name, oldest_kept):
+                continue  # Uploaded again or pointed at by a ticket since the walk
+            removed += 1
+            freed_bytes += default_storage.size(name)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{name}: orphaned")
+            if not dry_run:
+                default_storage.delete(name)
+                images.delete_variants(name)
+
+        prefix = "[dry run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{removed} orphaned files removed ({freed_bytes / 1024 / 1024:.1f} MiB)."))
+
+    @staticmethod
+    def is_still_orphaned(name, oldest_kept):
+        """Check again that a file is old and that no ticket points at it, right before removing it."""
+
+        try:
+            if os.path.getmtime(default_storage.path(name)) >= oldest_kept:
+                return False
+        except FileNotFoundError:
+            return False
+        return not Ticket.objects.filter(image=name).exists()
@@ -0,0 +1,42 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to fill the database with synthetic users, follows, tickets and reviews (see reviews.synthetic).
+
+Usage:
+    python manage.py generate_social_graph --users 10000 --mean-follows 50
+    python manage.py generate_social_graph --users 1000 --tickets-per-user 5 --reviews-per-ticket 2 --days 90
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from reviews.synthetic import generate_social_graph
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic users with a power-law follow graph, tickets and reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Number of created users.")
+        parser.add_argument('--mean-follows', type=float, default=20, help="Mean number of users followed by a user.")
+        parser.add_argument('--exponent', type=float, default=1.0,
+                            help="Exponent of the power law of the popularity (the higher, the more skewed).")
+        parser.add_argument('--tickets-per-user', type=float, default=3.0, help="Mean number of tickets by user.")
+        parser.add_argument('--reviews-per-ticket', type=float, default=1.0, help="Mean number of reviews by ticket.")
+        parser.add_argument('--days', type=int, default=365, help="The posts are spread over the last days.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = generate_social_graph(
+            users=options['users'],
+            mean_follows=options['mean_follows'],
+            exponent=options['exponent'],
+            tickets_per_user=options['tickets_per_user'],
+            reviews_per_ticket=options['reviews_per_ticket'],
+            days=options['days'],
+            seed=options['seed'],
+        )
+        summary = ', '.join(f"{count} {model_name}" for model_name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Created: {summary} in {time.perf_counter() - start:.1f} s."))
@@ -0,0 +1,175 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to import the tickets, the reviews and the follows of a JSONL file (written by the export_jsonl command).
+
+The file is streamed and imported by batches: each batch is inserted with bulk_create in its own transaction.
+The rows get new ids: the ids of the file are mapped to the new ones in memory (the users are found by their
+username, the missing users are created without a usable password). time_created is kept.
+
+The import is resumable: each batch records a checkpoint (ImportCheckpoint model) with the number of imported
+lines and the new ids of the tickets, in the transaction of the batch. So a batch and its checkpoint are committed
+together, and when the import is run again (with the same --checkpoint name, the absolute path of the file
+by default), it starts after the last imported batch.
+
+The timelines and the feed cache are refreshed at the end, since bulk_create sends no signal.
+
+Usage:
+    python manage.py import_jsonl data.jsonl
+    python manage.py import_jsonl data.jsonl --batch-size 10000
+    python manage.py import_jsonl data.jsonl --restart    # ignore the checkpoint of a previous import
+"""
+
+import json
+import os
+
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from reviews.bulk import bulk_create_with_ids, preserve_time_created, refresh_derived_data
+from reviews.models import ImportCheckpoint, Review, Ticket, UserFollows
+
+# Number of usernames looked up by query
+USERNAME_QUERY_SIZE = 500
+
+
+def read_checkpoint(name):
+    """Read the checkpoints of an import, return (number of imported lines, map of the ticket ids)."""
+
+    imported_lines, ticket_ids = 0, {}
+    for lines, tickets in ImportCheckpoint.objects.filter(name=name).order_by('lines').values_list('lines', 'tickets'):
+        imported_lines = lines
+        ticket_ids.update((int(old_id), new_id) for old_id, new_id in tickets.items())
+    return imported_lines, ticket_ids
+
+
+class Command(BaseCommand):
+    help = "Import the tickets, the reviews and the follows of a JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the file written by export_jsonl.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of lines imported by transaction.")
+        parser.add_argument('--checkpoint', help="Name of the checkpoint (default: absolute path of the file).")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of a previous import.")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['path']):
+            raise CommandError(f"{options['path']} does not exist.")
+        self.checkpoint_name = options['checkpoint'] or os.path.abspath(options['path'])
+        if options['restart']:
+            ImportCheckpoint.objects.filter(name=self.checkpoint_name).delete()
+
+        self.verbosity = options['verbosity']
+        imported_lines, self.ticket_ids = read_checkpoint(self.checkpoint_name)
+        if imported_lines:
+            self.stdout.write(f"Resuming after line {imported_lines}.")
+        self.user_ids = {}
+        self.counts = {'ticket': 0, 'review': 0, 'userfollows': 0, 'skipped': 0}
+
+        batch = []
+        line_number = 0
+        with open(options['path'], encoding='utf-8') as data_file, preserve_time_created(Ticket, Review):
+            for line_number, line in enumerate(data_file, start=1):
+                if line_number <= imported_lines or not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    raise CommandError(f"Line {line_number} is not valid JSON.")
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(batch, line_number)
+                    batch = []
+            if batch:
+                self.import_batch(batch, line_number)
+
+        refresh_derived_data(stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported: {self.counts['ticket']} tickets, {self.counts['review']} reviews, "
+            f"{self.counts['userfollows']} follows ({self.counts['skipped']} lines skipped)."))
+
+    def import_batch(self, records, line_number):
+        """Insert the records of a batch and its checkpoint in a transaction."""
+
+        records_by_model = {'ticket': [], 'review': [], 'userfollows': []}
+        for record in records:
+            if record.get('model') not in records_by_model:
+                raise CommandError(f"Unknown model in record: {record}")
+            records_by_model[record['model']].append(record)
+
+        with transaction.atomic():
+            self.load_user_ids(records)
+            new_ticket_ids = self.import_tickets(records_by_model['ticket'])
+            self.import_reviews(records_by_model['review'])
+            self.import_follows(records_by_model['userfollows'])
+            ImportCheckpoint.objects.create(name=self.checkpoint_name, lines=line_number, tickets=new_ticket_ids)
+
+        if self.verbosity > 1:
+            self.stdout.write(f"{line_number} lines imported.")
+
+    def load_user_ids(self, records):
+        """Add the users of the records to the map of the user ids, create the missing users."""
+
+        usernames = {record[field] for record in records for field in ('user', 'followed_user') if field in record}
+        usernames -= self.user_ids.keys()
+        usernames = sorted(usernames)
+        for start in range(0, len(usernames), USERNAME_QUERY_SIZE):
+            chunk = usernames[start:start + USERNAME_QUERY_SIZE]
+            self.user_ids.update(User.objects.filter(username__in=chunk).values_list('username', 'id'))
+
+        missing = [username for username in usernames if username not in self.user_ids]
+        if missing:
+            password = make_password(None)  # Unusable password
+            users = [User(username=username, password=password) for username in missing]
+            for user in bulk_create_with_ids(User, users, batch_size=USERNAME_QUERY_SIZE):
+                self.user_ids[user.username] = user.id
+
+    def import_tickets(self, records):
+        """Insert the tickets of a batch, return the map of their ids (id of the file: new id)."""
+
+        tickets = [
+            Ticket(
+                title=record['title'],
+                description=record.get('description', ''),
+                image=record.get('image') or None,
+                user_id=self.user_ids[record['user']],
+                time_created=parse_datetime(record['time_created']),
+            )
+            for record in records
+        ]
+        bulk_create_with_ids(Ticket, tickets)
+        new_ticket_ids = {record['id']: ticket.id for record, ticket in zip(records, tickets)}
+        self.ticket_ids.update(new_ticket_ids)
+        self.counts['ticket'] += len(tickets)
+        return new_ticket_ids
+
+    def import_reviews(self, records):
+        """Insert the reviews of a batch (the reviews of unknown tickets are skipped)."""
+
+        reviews = []
+        for record in records:
+            ticket_id = self.ticket_ids.get(record['ticket'])
+            if ticket_id is None:
+                self.counts['skipped'] += 1
+                continue
+            reviews.append(Review(
+                ticket_id=ticket_id,
+                rating=record['rating'],
+                headline=record['headline'],
+                body=record.get('body', ''),
+                user_id=self.user_ids[record['user']],
+                time_created=parse_datetime(record['time_created']),
+            ))
+        Review.objects.bulk_create(reviews)  # Their new ids are not needed
+        self.counts['review'] += len(reviews)
+
+    def import_follows(self, records):
+        """Insert the follows of a batch (the existing ones are ignored)."""
+
+        follows = [
+            UserFollows(user_id=self.user_ids[record['user']], followed_user_id=self.user_ids[record['followed_user']])
+            for record in records
+        ]
+        UserFollows.objects.bulk_create(follows, ignore_conflicts=True)
+        self.counts['userfollows'] += len(follows)
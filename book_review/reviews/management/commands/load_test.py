@@ -0,0 +1,144 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Load test of the WSGI application with concurrent virtual users (see reviews.loadtest).
+
+A temporary database (with temporary caches) is filled with a synthetic social graph (reviews.synthetic), then
+virtual users log in and send a mix of feed reads, post creations and follows, from threads or from processes
+(one database connection by thread or process, as a WSGI server). The command reports, overall and by operation:
+- the throughput and the latency percentiles, with a latency histogram,
+- the errors, and among them the "database is locked" errors of SQLite.
+
+With several database profiles (REVIEWS_DATABASE_PROFILES setting), the same test is run on a new database
+for each of them, to compare them.
+
+Usage:
+    python manage.py load_test --workers 8 --duration 30
+    python manage.py load_test --workers 16 --processes --profiles default production
+    python manage.py load_test --workers 8 --processes --mix feed=10 ticket=2 review=2 follow=1 login=1 --json
+"""
+
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from reviews.benchmarking import histogram, summarize, temporary_database
+from reviews.database import apply_connection_settings
+from reviews.loadtest import OPERATIONS, PASSWORD, run_virtual_user, setup_worker
+from reviews.synthetic import generate_social_graph
+
+DEFAULT_MIX = {'login': 1, 'feed': 10, 'ticket': 2, 'review': 2, 'follow': 1}
+
+
+def parse_mix(values):
+    """Parse the operation weights, e.g. ['feed=10', 'ticket=2'] -> {'feed': 10, 'ticket': 2}."""
+
+    mix = {}
+    for value in values:
+        operation, _, weight = value.partition('=')
+        if operation not in OPERATIONS or not weight.isdigit():
+            raise CommandError(f"Invalid operation weight: {value} (operations: {', '.join(OPERATIONS)}).")
+        mix[operation] = int(weight)
+    if not any(mix.values()):
+        raise CommandError("At least one operation must have a weight.")
+    return mix
+
+
+def get_report(records, elapsed):
+    """Summarize the records (operation, success, lock error, latency) of a load test, overall and by operation."""
+
+    def summarize_records(selected):
+        report = summarize([latency for _, _, _, latency in selected], elapsed)
+        report['errors'] = sum(1 for _, success, _, _ in selected if not success)
+        report['lock_errors'] = sum(1 for _, _, lock_error, _ in selected if lock_error)
+        report['histogram'] = histogram([latency for _, _, _, latency in selected])
+        return report
+
+    report = {'total': summarize_records(records)}
+    for operation in OPERATIONS:
+        selected = [record for record in records if record[0] == operation]
+        if selected:
+            report[operation] = summarize_records(selected)
+    return report
+
+
+class Command(BaseCommand):
+    help = "Load test the WSGI application with concurrent users who read feeds, create posts and follow users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Number of concurrent virtual users.")
+        parser.add_argument('--processes', action='store_true',
+                            help="Run the virtual users in processes instead of threads.")
+        parser.add_argument('--duration', type=float, default=20, help="Duration of the test in seconds.")
+        parser.add_argument('--mix', nargs='+', metavar='OPERATION=WEIGHT',
+                            help=f"Weights of the operations ({', '.join(OPERATIONS)}), default: "
+                                 f"{' '.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items())}.")
+        parser.add_argument('--users', type=int, default=200, help="Number of users of the synthetic graph.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generators.")
+        parser.add_argument('--profiles', nargs='+', choices=list(settings.REVIEWS_DATABASE_PROFILES),
+                            help="Database profiles to compare (default: the current one).")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix']) if options['mix'] else DEFAULT_MIX
+        reports = {}
+        for profile in options['profiles'] or [settings.REVIEWS_DATABASE_PROFILE]:
+            reports[profile] = self.run_profile(profile, mix, options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+            return
+        for profile, report in reports.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Database profile: {profile}"))
+            for operation, result in report.items():
+                self.stdout.write(
+                    f"{operation}: {result['requests']} requests, {result['throughput']:.1f} req/s, "
+                    f"p50 {result['p50_ms']:.1f} ms, p90 {result['p90_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+                    f"{result['errors']} errors ({result['lock_errors']} database locked)")
+            self.stdout.write("Latency histogram (all operations):")
+            total = report['total']['requests']
+            for bucket, count in report['total']['histogram'].items():
+                self.stdout.write(f"  {bucket:>9} {count:7} {'#' * round(50 * count / total)}")
+
+    def run_profile(self, profile, mix, options):
+        """Run the load test on a new database with a database profile, return its report."""
+
+        connection_settings = {key: connections['default'].settings_dict[key] for key in ('CONN_MAX_AGE', 'OPTIONS')}
+        with override_settings(REVIEWS_DATABASE_PROFILE=profile), temporary_database() as database_name:
+            try:
+                apply_connection_settings(profile)
+                connections.close_all()  # Reopened with the settings and the pragmas of the profile
+                generate_social_graph(users=options['users'], seed=options['seed'])
+                User.objects.update(password=make_password(PASSWORD))
+                usernames = list(User.objects.order_by('id').values_list('username', flat=True))
+                connections.close_all()  # The workers open their own connections
+
+                start = time.perf_counter()
+                records = self.run_workers(database_name, profile, usernames, mix, options)
+                return get_report(records, time.perf_counter() - start)
+            finally:
+                connections['default'].settings_dict.update(connection_settings)
+
+    @staticmethod
+    def run_workers(database_name, profile, usernames, mix, options):
+        """Run the virtual users in threads or processes, return all their records."""
+
+        arguments = [
+            (index, usernames, mix, options['duration'], options['seed']) for index in range(options['workers'])]
+        if options['processes']:
+            executor = ProcessPoolExecutor(max_workers=options['workers'], mp_context=get_context('spawn'),
+                                           initializer=setup_worker,
+                                           initargs=(database_name, profile, settings.CACHES))
+        else:
+            setup_worker()
+            executor = ThreadPoolExecutor(max_workers=options['workers'])
+        with executor:
+            futures = [executor.submit(run_virtual_user, *worker_arguments) for worker_arguments in arguments]
+            return [record for future in futures for record in future.result()]
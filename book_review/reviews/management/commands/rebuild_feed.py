@@ -0,0 +1,38 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to backfill or rebuild the timelines (FeedEntry table) used by the timeline mode of the Home feed.
+
+Usage:
+    python manage.py rebuild_feed                  # rebuild the timelines of all users
+    python manage.py rebuild_feed alice bob        # rebuild the timelines of some users
+"""
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from reviews.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = "Backfill or rebuild the materialized Home feed (FeedEntry table) of users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only rebuild the timelines of these users.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of entries inserted by query.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+
+        count = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                FeedEntry.rebuild_timeline(user, batch_size=options['batch_size'])
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"{count} timelines rebuilt, {FeedEntry.objects.count()} feed entries in total."))
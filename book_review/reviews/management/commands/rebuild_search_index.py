@@ -0,0 +1,28 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to rebuild the full-text search index of the posts (see reviews.search).
+
+The triggers keep the index up to date: a rebuild is only needed when it has been damaged or when the triggers
+were missing (e.g. the posts written before a migration which rebuilt a table).
+
+Usage:
+    python manage.py rebuild_search_index
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from reviews.search import has_search_index, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index (FTS5) of the tickets and reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to rebuild the index of.")
+
+    def handle(self, *args, **options):
+        if not has_search_index(connections[options['database']]):
+            raise CommandError("This database has no search index (SQLite only), the posts are searched without it.")
+        count = rebuild_index(options['database'])
+        self.stdout.write(self.style.SUCCESS(f"{count} posts indexed."))
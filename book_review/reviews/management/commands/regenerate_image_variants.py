@@ -0,0 +1,62 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to create the resized variants (see reviews.images) of the ticket images already stored.
+
+The images are processed in parallel, by a pool of processes (one by CPU core by default).
+
+Usage:
+    python manage.py regenerate_image_variants              # only the images without variants
+    python manage.py regenerate_image_variants --force      # all images
+    python manage.py regenerate_image_variants --workers 4
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+
+from reviews import images
+from reviews.models import Ticket
+
+
+def generate_variants(name):
+    """Create the variants of an image in a worker process, return (name, error message or None)."""
+
+    try:
+        images.generate_variants(name)
+    except Exception as error:  # The other images are processed even if one is broken
+        return name, f'{type(error).__name__}: {error}'
+    return name, None
+
+
+class Command(BaseCommand):
+    help = "Create the resized variants of the ticket images, in parallel across CPU cores."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Number of worker processes (default: number of CPU cores).")
+        parser.add_argument('--force', action='store_true',
+                            help="Also regenerate the variants which already exist.")
+
+    def handle(self, *args, **options):
+        names = Ticket.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True)
+        names = sorted(set(names))
+        if not options['force']:
+            names = [name for name in names if not images.has_variants(name)]
+        if not names:
+            self.stdout.write("No image to process.")
+            return
+
+        errors = 0
+        # The workers set up Django themselves, so the command also works with the "spawn" start method.
+        with ProcessPoolExecutor(max_workers=max(1, options['workers']), initializer=django.setup) as executor:
+            futures = [executor.submit(generate_variants, name) for name in names]
+            for future in as_completed(futures):
+                name, error = future.result()
+                if error:
+                    errors += 1
+                    self.stderr.write(f"{name}: {error}")
+                elif options['verbosity'] > 1:
+                    self.stdout.write(f"{name}: done")
+        self.stdout.write(self.style.SUCCESS(f"{len(names) - errors} images processed, {errors} errors."))
@@ -0,0 +1,25 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to recompute the statistics of the reviews of the tickets (review_count, rating_sum, last_reviewed_at).
+
+The signals keep them up to date: a repair is needed after writes which send no signal (bulk insertions, raw SQL)
+or to check them. Only the tickets whose statistics are wrong are updated.
+
+Usage:
+    python manage.py repair_ticket_stats
+"""
+
+from django.core.management.base import BaseCommand
+
+from reviews.models import Ticket
+
+
+class Command(BaseCommand):
+    help = "Recompute the number of reviews, the sum of the ratings and the last review time of the tickets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of tickets updated by query.")
+
+    def handle(self, *args, **options):
+        count = Ticket.repair_review_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{count} tickets repaired."))
@@ -0,0 +1,38 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Command to copy the primary database into the replica (replication stand-in, see reviews.replication).
+
+Usage:
+    python manage.py sync_replica                 # copy once (also creates the replica)
+    python manage.py sync_replica --interval 5    # copy every 5 seconds, until interrupted
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews.replication import replicate
+from reviews.routers import has_replica
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database into the replica, once or periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Copy every INTERVAL seconds (default: copy once).")
+
+    def handle(self, *args, **options):
+        if not has_replica():
+            raise CommandError("No replica is configured (REVIEWS_DATABASE_REPLICA environment variable).")
+        while True:
+            start = time.perf_counter()
+            replicate()
+            if options['verbosity'] > 1 or not options['interval']:
+                self.stdout.write(f"Replica synchronized in {(time.perf_counter() - start) * 1000:.0f} ms.")
+            if not options['interval']:
+                return
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
@@ -0,0 +1,190 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Performance metrics of the views for book_review project, exposed in the Prometheus text format.
+
+For each request, MetricsMiddleware records by URL name (e.g. reviews:home) and method:
+- the latency of the request,
+- the number of SQL queries and the time spent in SQL (execute wrapper installed on each database connection),
+- the time spent rendering templates (InstrumentedDjangoTemplates backend, see reviews.template_backends),
+- the size of the response (for a streamed response, all is recorded when the stream ends).
+
+The measures of a request are gathered in a RequestMetrics object of the request context (a context variable,
+so the queries of the async views run in other threads are counted too), then added once to the registry under
+a lock. The metrics view (/metrics/) exposes the registry and the counters of the feed and fragment caches.
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+from . import feed_cache, fragment_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)  # Bytes
+UNRESOLVED_VIEW = '<unresolved>'
+# End of the help of the cache counters which can lose increments (see feed_cache.are_counts_approximate)
+APPROXIMATE_HELP = " Approximate: the increments of concurrent processes can be lost."
+
+current_request = contextvars.ContextVar('reviews_metrics_request', default=None)
+
+
+class RequestMetrics:
+    """Measures of one request, filled while it is processed."""
+
+    __slots__ = ('queries', 'sql_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus format (not thread-safe, protected by the lock of the registry)."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last one is the +Inf bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """Yield the lines of the histogram, labels being the formatted labels of the series."""
+
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+# Name of the histogram: (help, bucket bounds)
+HISTOGRAMS = {
+    'reviews_request_duration_seconds': ("Latency of the requests.", LATENCY_BUCKETS),
+    'reviews_request_queries': ("Number of SQL queries by request.", QUERY_BUCKETS),
+    'reviews_request_sql_duration_seconds': ("Time spent in SQL queries by request.", LATENCY_BUCKETS),
+    'reviews_request_template_duration_seconds': ("Time spent rendering templates by request.", LATENCY_BUCKETS),
+    'reviews_response_size_bytes': ("Size of the response bodies.", SIZE_BUCKETS),
+}
+
+
+class Registry:
+    """Histograms and counters of the requests, by (view name, method). Safe across threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (view name, method): {histogram name: Histogram}
+        self.responses = {}  # (view name, method, status): count
+
+    def record(self, view_name, method, status, duration, request_metrics, size):
+        values = {
+            'reviews_request_duration_seconds': duration,
+            'reviews_request_queries': request_metrics.queries,
+            'reviews_request_sql_duration_seconds': request_metrics.sql_seconds,
+            'reviews_request_template_duration_seconds': request_metrics.template_seconds,
+            'reviews_response_size_bytes': size,
+        }
+        with self.lock:
+            histograms = self.histograms.get((view_name, method))
+            if histograms is None:
+                histograms = self.histograms[(view_name, method)] = {
+                    name: Histogram(bounds) for name, (_, bounds) in HISTOGRAMS.items()}
+            for name, value in values.items():
+                histograms[name].observe(value)
+            key = (view_name, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.responses.clear()
+
+    def render(self):
+        """Render the metrics in the Prometheus text format."""
+
+        lines = []
+        with self.lock:
+            lines.append('# HELP reviews_responses_total Number of responses.')
+            lines.append('# TYPE reviews_responses_total counter')
+            for (view_name, method, status), count in sorted(self.responses.items()):
+                labels = format_labels(view=view_name, method=method, status=status)
+                lines.append(f'reviews_responses_total{{{labels}}} {count}')
+            for name, (help_text, _) in HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (view_name, method), histograms in sorted(self.histograms.items()):
+                    lines.extend(histograms[name].samples(name, format_labels(view=view_name, method=method)))
+
+        stats = feed_cache.get_stats()
+        for name, help_text in (('hits', "Home feed pages read from the cache."),
+                                ('misses', "Home feed pages computed and stored in the cache.")):
+            if stats['approximate']:
+                help_text += APPROXIMATE_HELP
+            lines.append(f'# HELP reviews_feed_cache_{name}_total {help_text}')
+            lines.append(f'# TYPE reviews_feed_cache_{name}_total counter')
+            lines.append(f'reviews_feed_cache_{name}_total {stats[name]}')
+
+        stats = fragment_cache.get_stats()
+        for name, help_text in (('hits', "Post snippets read from the cache."),
+                                ('misses', "Post snippets rendered and stored in the cache.")):
+            if stats['approximate']:
+                help_text += APPROXIMATE_HELP
+            lines.append(f'# HELP reviews_fragment_cache_{name}_total {help_text}')
+            lines.append(f'# TYPE reviews_fragment_cache_{name}_total counter')
+            lines.append(f'reviews_fragment_cache_{name}_total {stats[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def format_labels(**labels):
+    """Format labels of a Prometheus series, e.g. view="reviews:home",method="GET"."""
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper of the database connections: time the queries of the current request."""
+
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.sql_seconds += time.perf_counter() - start
+        request_metrics.queries += 1
+
+
+def install_query_timer(connection):
+    """Install the query timer on a database connection (once).
+
+    It is inserted first: connection.execute_wrapper() removes the last wrapper when it exits, and the connection
+    may be opened inside it.
+    """
+
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def record_template_time(seconds):
+    """Add a template render time to the current request."""
+
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        request_metrics.template_seconds += seconds
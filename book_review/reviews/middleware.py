@@ -0,0 +1,109 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Middleware for book_review project.
+
+- MetricsMiddleware: record the performance metrics of each request, by URL name (see metrics module),
+- PrimaryPinningMiddleware: choose the database read by a request, primary or replica (see routers module).
+"""
+
+import time
+
+from . import metrics, routers
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# Cookie of the users who have just written: expiry time (timestamp) of the pin of their reads to the primary
+PRIMARY_PIN_COOKIE = 'primary_pin'
+
+
+def iterate_in_context(content, variable, value):
+    """Iterate over a streamed content with a context variable set, while each chunk is generated."""
+
+    iterator = iter(content)
+    while True:
+        token = variable.set(value)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            variable.reset(token)
+        yield chunk
+
+
+class MetricsMiddleware:
+    """Record the latency, the SQL queries, the template render time and the response size of each request.
+
+    It should be the first middleware, to measure the whole processing of the request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        start = time.perf_counter()
+        token = metrics.current_request.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = resolver_match.view_name if resolver_match else metrics.UNRESOLVED_VIEW
+        record = (view_name, request.method, response.status_code)
+        if response.streaming:
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, request_metrics, start, record)
+        else:
+            metrics.registry.record(*record, time.perf_counter() - start, request_metrics, len(response.content))
+        return response
+
+    @staticmethod
+    def measure_stream(content, request_metrics, start, record):
+        """Stream the content of a response, and record the metrics of the request when the stream ends.
+
+        The queries run while the content is generated are counted in the metrics of the request.
+        """
+
+        size = 0
+        try:
+            for chunk in iterate_in_context(content, metrics.current_request, request_metrics):
+                size += len(chunk)
+                yield chunk
+        finally:
+            metrics.registry.record(*record, time.perf_counter() - start, request_metrics, size)
+
+
+class PrimaryPinningMiddleware:
+    """Read from the replica during the requests, except for the users who have just written.
+
+    A request which writes is pinned to the primary, and so are the requests of the same user during
+    REVIEWS_REPLICA_PIN_SECONDS after it (cookie), so he sees what he has just posted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not routers.has_replica():
+            return self.get_response(request)
+
+        writes = request.method in WRITE_METHODS
+        try:
+            pinned = writes or float(request.COOKIES.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        token = routers.pinned_to_primary.set(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.pinned_to_primary.reset(token)
+
+        if response.streaming:
+            response.streaming_content = iterate_in_context(
+                response.streaming_content, routers.pinned_to_primary, pinned)
+        if writes and response.status_code < 400:
+            pin_seconds = routers.get_pin_seconds()
+            response.set_cookie(PRIMARY_PIN_COOKIE, str(time.time() + pin_seconds), max_age=pin_seconds,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 3.2 on 2026-10-17 00:41
+
+from django.db import migrations, models
+
+
+def copy_time_created(apps, schema_editor):
+    """The existing posts have not been updated since their creation."""
+
+    for model_name in ('Ticket', 'Review'):
+        apps.get_model('reviews', model_name).objects.update(time_updated=models.F('time_created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0003_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='time_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='time_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_time_created, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2 on 2026-10-17 01:10
+
+from django.db import migrations
+
+# FTS5 index of the tickets (rowid: 2 * id) and of the reviews (rowid: 2 * id + 1), see reviews/search.py.
+# Its triggers are created after each migration (post_migrate signal): a migration which rebuilds the table of the
+# tickets or of the reviews on SQLite drops them.
+CREATE_SEARCH_INDEX = [
+    """CREATE VIRTUAL TABLE reviews_post_search USING fts5(
+        title, body, tokenize = 'unicode61 remove_diacritics 2')""",
+    # The titles weigh more than the bodies in the ranking
+    "INSERT INTO reviews_post_search(reviews_post_search, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    # Index the existing posts
+    "INSERT INTO reviews_post_search(rowid, title, body) SELECT 2 * id, title, description FROM reviews_ticket",
+    "INSERT INTO reviews_post_search(rowid, title, body) SELECT 2 * id + 1, headline, body FROM reviews_review",
+]
+
+DROP_SEARCH_INDEX = [
+    'DROP TRIGGER IF EXISTS reviews_ticket_search_insert',
+    'DROP TRIGGER IF EXISTS reviews_ticket_search_update',
+    'DROP TRIGGER IF EXISTS reviews_ticket_search_delete',
+    'DROP TRIGGER IF EXISTS reviews_review_search_insert',
+    'DROP TRIGGER IF EXISTS reviews_review_search_update',
+    'DROP TRIGGER IF EXISTS reviews_review_search_delete',
+    'DROP TABLE reviews_post_search',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':  # Other databases search with icontains
+        for sql in CREATE_SEARCH_INDEX:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SEARCH_INDEX:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0004_time_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
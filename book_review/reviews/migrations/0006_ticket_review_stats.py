@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-17 01:01
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.db.models.functions import Coalesce
+
+
+def compute_review_stats(apps, schema_editor):
+    """Compute the statistics of the reviews of the existing tickets."""
+
+    Ticket = apps.get_model('reviews', 'Ticket')
+    Review = apps.get_model('reviews', 'Review')
+    reviews = Review.objects.filter(ticket=models.OuterRef('pk')).order_by().values('ticket')
+    Ticket.objects.update(
+        review_count=Coalesce(models.Subquery(reviews.annotate(value=models.Count('id')).values('value')), 0),
+        rating_sum=Coalesce(models.Subquery(reviews.annotate(value=models.Sum('rating')).values('value')), 0),
+        last_reviewed_at=models.Subquery(reviews.annotate(value=models.Max('time_created')).values('value')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0005_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='last_reviewed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['-review_count', '-id'], name='ticket_review_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(django.db.models.expressions.OrderBy(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast('rating_sum', models.FloatField()), '/', django.db.models.expressions.F('review_count')), descending=True), django.db.models.expressions.OrderBy(django.db.models.expressions.F('id'), descending=True), name='ticket_average_rating_idx'),
+        ),
+        migrations.RunPython(compute_review_stats, migrations.RunPython.noop),
+    ]
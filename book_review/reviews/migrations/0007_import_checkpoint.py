@@ -0,0 +1,26 @@
+# Generated by Django 3.2 on 2026-10-17 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0006_ticket_review_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('lines', models.PositiveIntegerField()),
+                ('tickets', models.JSONField(default=dict)),
+                ('time_created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('name', 'lines')},
+            },
+        ),
+    ]
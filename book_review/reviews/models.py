@@ -3,9 +3,12 @@
 """Models for book_review project.
 
 Models contain:
-- Ticket model is used when a user demands a review for a book or an article.
+- Ticket model is used when a user demands a review for a book or an article
+(with the statistics of its reviews: number, sum of the ratings, last review time).
 - Review model is used when a user posts a review.
 - UserFollows model is used to handle the following relationship between users.
+- FeedEntry model is used to materialize the Home feed of a user (timeline mode).
+- ImportCheckpoint model is used to resume an import of the import_jsonl command.
 
 - A user can:
 - create many tickets
@@ -17,8 +20,11 @@ Models contain:
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
 from django.db import models
+from django.db.models import Count, Exists, F, FloatField, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 
 
 class Ticket(models.Model):
@@ -30,17 +36,127 @@ class Ticket(models.Model):
     user = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tickets')
     image = models.ImageField(null=True, blank=True, upload_to="images/")
     time_created = models.DateTimeField(auto_now_add=True)
+    # Last change of the ticket or of its reviews (validator of the cached pages, see conditional module)
+    time_updated = models.DateTimeField(auto_now=True)
+    # Statistics of the reviews, maintained by the signals (see update_review_stats) and by repair_ticket_stats,
+    # never written by save() (see REVIEW_STATS_FIELDS)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    last_reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Feeds: the tickets of some users, from the newest one
+            models.Index(fields=['user', 'time_created'], name='ticket_user_time_idx'),
+            # Top tickets: the most reviewed ones, the best rated ones (same expression as average_rating_expression)
+            models.Index(fields=['-review_count', '-id'], name='ticket_review_count_idx'),
+            models.Index((Cast('rating_sum', FloatField()) / F('review_count')).desc(), F('id').desc(),
+                         name='ticket_average_rating_idx'),
+        ]
+
+    # Only changed by UPDATE queries (update_review_stats, repair_review_stats), which read the current values
+    REVIEW_STATS_FIELDS = ('review_count', 'rating_sum', 'last_reviewed_at')
 
     def __str__(self):
         """To display a Ticket object in a readable format."""
 
         return f'{self.title} (créé par {self.user})'
 
+    def save(self, *args, **kwargs):
+        """Save the ticket, without the statistics of its reviews when it is updated.
+
+        The instance may hold outdated statistics (e.g. a review created while the ticket is edited): writing them
+        back would lose the changes of the reviews.
+        """
+
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.REVIEW_STATS_FIELDS]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         """To redirect toward the detail view for a ticket object."""
 
         return reverse("reviews:ticket-detail", kwargs={"pk": self.id})
 
+    @classmethod
+    def get_feed_queryset(cls, tickets=None):
+        """Get the tickets (all of them by default) ready to be displayed in a feed.
+
+        The author is joined and `has_reviews` is annotated, so the feed templates run no query by ticket.
+        """
+
+        tickets = cls.objects.all() if tickets is None else tickets
+        return tickets.select_related('user').annotate(
+            has_reviews=Exists(Review.objects.filter(ticket=OuterRef('pk'))))
+
+    @property
+    def average_rating(self):
+        """Average rating of the reviews of the ticket, None without review."""
+
+        return self.rating_sum / self.review_count if self.review_count else None
+
+    @staticmethod
+    def average_rating_expression():
+        """The average rating computed by the database (indexed, see Meta.indexes), NULL without review."""
+
+        return Cast('rating_sum', FloatField()) / F('review_count')
+
+    @classmethod
+    def update_review_stats(cls, ticket_id, count=0, rating=0, reviewed_at=None):
+        """Add a review (count=1) or remove one (count=-1) from the statistics of a ticket, in one UPDATE query.
+
+        The ticket is also marked as updated: its pages show whether it has reviews.
+        """
+
+        if reviewed_at is not None:
+            last_reviewed_at = Coalesce(Greatest('last_reviewed_at', Value(reviewed_at)), Value(reviewed_at))
+        else:  # A review was removed, it may have been the last one
+            last_reviewed_at = Subquery(Review.objects.filter(ticket=OuterRef('pk')).order_by().values(
+                'ticket').annotate(last=Max('time_created')).values('last'))
+        # Never negative, even when the statistics are wrong (reviews inserted in bulk, before a repair)
+        cls.objects.filter(id=ticket_id).update(
+            review_count=Greatest(F('review_count') + count, 0), rating_sum=Greatest(F('rating_sum') + rating, 0),
+            last_reviewed_at=last_reviewed_at, time_updated=timezone.now())
+
+    @classmethod
+    def repair_review_stats(cls, tickets=None, batch_size=500):
+        """Recompute the statistics of the reviews of tickets (all by default), return the number of fixed tickets."""
+
+        reviews = Review.objects.filter(ticket=OuterRef('pk')).order_by().values('ticket')
+        actual_stats = {
+            'review_count': Coalesce(Subquery(reviews.annotate(value=Count('id')).values('value')), 0),
+            'rating_sum': Coalesce(Subquery(reviews.annotate(value=Sum('rating')).values('value')), 0),
+            'last_reviewed_at': Subquery(reviews.annotate(value=Max('time_created')).values('value')),
+        }
+        tickets = (cls.objects.all() if tickets is None else tickets).annotate(
+            **{f'actual_{name}': value for name, value in actual_stats.items()})
+        broken_ids = list(tickets.exclude(
+            Q(review_count=F('actual_review_count')) & Q(rating_sum=F('actual_rating_sum'))
+            & (Q(last_reviewed_at=F('actual_last_reviewed_at'))
+               | Q(last_reviewed_at__isnull=True, actual_last_reviewed_at__isnull=True))
+        ).values_list('id', flat=True))
+        for start in range(0, len(broken_ids), batch_size):
+            cls.objects.filter(id__in=broken_ids[start:start + batch_size]).update(**actual_stats)
+        return len(broken_ids)
+
+    @classmethod
+    def get_top_tickets(cls, order, cursor=None, min_reviews=1):
+        """Get the tickets with at least min_reviews reviews, the best rated (order "rating") or the most
+        reviewed (order "reviews") first, after a cursor (value, id) of the previous page.
+
+        The queryset is read in the order of an index, the value of the order is annotated as `top_value`.
+        """
+
+        value = cls.average_rating_expression() if order == 'rating' else F('review_count')
+        tickets = cls.objects.filter(review_count__gte=min_reviews).annotate(top_value=value)
+        if cursor is not None:
+            top_value, ticket_id = cursor
+            # The first condition lets the database start the scan of the index at the cursor
+            tickets = tickets.filter(Q(top_value__lte=top_value), Q(top_value__lt=top_value) | Q(id__lt=ticket_id))
+        return tickets.select_related('user').order_by(value.desc(), '-id')
+
     @staticmethod
     def get_tickets_created_by_user(user):
         """Get all tickets of a user."""
@@ -49,21 +165,18 @@ class Ticket(models.Model):
 
     @classmethod
     def get_tickets_created_by_following_user(cls, user):
-        """Get tickets from other users who the user follows."""
+        """Get tickets from other users who the user follows.
+
+        The followed users are resolved in a subquery, so only one query is run whatever the number of follows.
+        """
 
-        tickets = User.objects.none()
-        userfollows_followings = user.following.all()  # Queryset of UserFollows objects
-        for userfollow in userfollows_followings:
-            following_user = userfollow.followed_user  # The person who the "user" follows
-            tickets_from_following_users = cls.get_tickets_created_by_user(following_user)
-            tickets |= tickets_from_following_users  # Union of queryset
-        return tickets
+        return cls.objects.filter(user__in=UserFollows.get_followed_user_ids_subquery(user))
 
     @classmethod
     def get_users_viewable_tickets(cls, user):
         """Get all tickets that a user can see (his own tickets and which of his following users)."""
 
-        return cls.get_tickets_created_by_user(user) | cls.get_tickets_created_by_following_user(user)
+        return cls.objects.filter(Q(user=user) | Q(user__in=UserFollows.get_followed_user_ids_subquery(user)))
 
 
 class Review(models.Model):
@@ -80,6 +193,16 @@ class Review(models.Model):
     user = models.ForeignKey(
         to=settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='reviews')
     time_created = models.DateTimeField(auto_now_add=True)  # Add this
+    # Last change of the review (validator of the cached pages, see conditional module)
+    time_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Feeds: the reviews of some users, from the newest one
+            models.Index(fields=['user', 'time_created'], name='review_user_time_idx'),
+            # Feeds: the replies to the tickets of a user, from the newest one
+            models.Index(fields=['ticket', 'time_created'], name='review_ticket_time_idx'),
+        ]
 
     def __str__(self):
         """To display a Review object in a readable format."""
@@ -94,6 +217,16 @@ class Review(models.Model):
 
         return reverse("reviews:review-detail", kwargs={"pk": self.id})
 
+    @classmethod
+    def get_feed_queryset(cls, reviews=None):
+        """Get the reviews (all of them by default) ready to be displayed in a feed.
+
+        The author, the ticket and its author are joined, so the feed templates run no query by review.
+        """
+
+        reviews = cls.objects.all() if reviews is None else reviews
+        return reviews.select_related('user', 'ticket__user')
+
     @staticmethod
     def get_reviews_posted_by_user(user):
         """Get all reviews of a user."""
@@ -106,33 +239,32 @@ class Review(models.Model):
 
         return ticket.reviews.all()
 
-    @staticmethod
-    def get_reviews_related_to_all_tickets_of_user(user):
-        """Get all reviews posted by a user."""
+    @classmethod
+    def get_reviews_related_to_all_tickets_of_user(cls, user):
+        """Get all reviews posted in response to the tickets of a user."""
 
-        reviews = User.objects.none()
-        for ticket in user.tickets.all():
-            reviews |= ticket.reviews.all()
-        return reviews
+        return cls.objects.filter(ticket__in=Ticket.objects.filter(user=user).values('id'))
 
     @classmethod
     def get_reviews_posted_by_following_user(cls, user):
-        """Get all reviews posted by following users of an user."""
+        """Get all reviews posted by following users of an user.
+
+        The followed users are resolved in a subquery, so only one query is run whatever the number of follows.
+        """
 
-        reviews = User.objects.none()
-        user_follows_followings = user.following.all()  # Queryset of UserFollows objects
-        for user_follows in user_follows_followings:
-            following_user = user_follows.followed_user  # The person who the "user" follows
-            reviews_from_following_user = cls.get_reviews_posted_by_user(following_user)
-            reviews |= reviews_from_following_user  # Union of queryset
-        return reviews
+        return cls.objects.filter(user__in=UserFollows.get_followed_user_ids_subquery(user))
 
     @classmethod
     def get_users_viewable_reviews(cls, user):
-        """Get all reviews that a user can see (his own reviews and which of his following users)."""
+        """Get all reviews that a user can see.
+
+        These are his own reviews, which of his following users and the reviews posted for his tickets.
+        """
 
-        return cls.get_reviews_posted_by_user(user) | cls.get_reviews_posted_by_following_user(
-            user) | cls.get_reviews_related_to_all_tickets_of_user(user)
+        return cls.objects.filter(
+            Q(user=user)
+            | Q(user__in=UserFollows.get_followed_user_ids_subquery(user))
+            | Q(ticket__in=Ticket.objects.filter(user=user).values('id')))
 
 
 class UserFollows(models.Model):
@@ -147,6 +279,10 @@ class UserFollows(models.Model):
         # Ensures we don't get multiple UserFollows instances
         # for unique user-user_followed pairs
         unique_together = ('user', 'followed_user',)
+        indexes = [
+            # Followers of a user (the unique constraint already covers the users followed by a user)
+            models.Index(fields=['followed_user', 'user'], name='userfollows_followed_user_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} follows {self.followed_user}'
@@ -162,12 +298,147 @@ class UserFollows(models.Model):
     def get_following_user_follows_from_user(cls, user):
         """Get all users who the user follows."""
 
-        user_follows_following = cls.objects.filter(user__username=user.username)
+        user_follows_following = cls.objects.filter(user_id=user.id).select_related('followed_user')
         return user_follows_following
 
     @classmethod
     def get_followed_user_follows_from_user(cls, user):
         """Get all users they follow the user."""
 
-        user_follows_followed_by = cls.objects.filter(followed_user__username=user.username)
+        user_follows_followed_by = cls.objects.filter(followed_user_id=user.id).select_related('user')
         return user_follows_followed_by
+
+    @classmethod
+    def get_followed_user_ids_subquery(cls, user):
+        """Get the ids of all users who the user follows, as a queryset usable in a subquery (not evaluated)."""
+
+        return cls.objects.filter(user=user).values('followed_user')
+
+    @classmethod
+    def get_follower_ids(cls, user_id):
+        """Get the ids of all users who follow a user."""
+
+        return cls.objects.filter(followed_user_id=user_id).values_list('user_id', flat=True)
+
+
+class FeedEntry(models.Model):
+    """FeedEntry is a post (ticket or review) written in the timeline of a user who can see it.
+
+    The timeline is the materialized Home feed (fan-out on write): entries are added when a post is created
+    or when the user follows someone, and removed when a post is deleted or when the user unfollows someone.
+    It is only maintained when the REVIEWS_FEED_TIMELINE setting is enabled.
+    """
+
+    TICKET = 'TICKET'
+    REVIEW = 'REVIEW'
+    CONTENT_TYPE_CHOICES = ((TICKET, 'Ticket'), (REVIEW, 'Review'))
+
+    # The owner of the timeline
+    user = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='feed_entries')
+    content_type = models.CharField(max_length=6, choices=CONTENT_TYPE_CHOICES)
+    # Id of the ticket or of the review, used to order the posts with the same creation time
+    post_id = models.BigIntegerField()
+    # Exactly one of ticket and review is set, the entry is deleted with its post.
+    ticket = models.ForeignKey(to=Ticket, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    review = models.ForeignKey(to=Review, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    # Copy of the time_created of the post
+    time_created = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'content_type', 'post_id',)
+        indexes = [
+            # A page of a timeline is a range scan on this index.
+            models.Index(fields=['user', '-time_created', '-content_type', '-post_id'], name='feedentry_timeline_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.content_type} {self.post_id} in the feed of {self.user}'
+
+    @property
+    def post(self):
+        """The ticket or the review of the entry."""
+
+        return self.ticket if self.content_type == self.TICKET else self.review
+
+    @classmethod
+    def from_ticket(cls, user_id, ticket):
+        """Build (without saving) the entry of a ticket for the timeline of a user."""
+
+        return cls(user_id=user_id, content_type=cls.TICKET, post_id=ticket.id, ticket_id=ticket.id,
+                   time_created=ticket.time_created)
+
+    @classmethod
+    def from_review(cls, user_id, review):
+        """Build (without saving) the entry of a review for the timeline of a user."""
+
+        return cls(user_id=user_id, content_type=cls.REVIEW, post_id=review.id, review_id=review.id,
+                   time_created=review.time_created)
+
+    @classmethod
+    def add_ticket(cls, ticket):
+        """Write a new ticket in the timelines of its author and of his followers."""
+
+        user_ids = {ticket.user_id, *UserFollows.get_follower_ids(ticket.user_id)}
+        cls.objects.bulk_create([cls.from_ticket(user_id, ticket) for user_id in user_ids], ignore_conflicts=True)
+
+    @classmethod
+    def add_review(cls, review):
+        """Write a new review in the timelines of its author, of his followers and of the author of the ticket."""
+
+        ticket_user_id = Ticket.objects.filter(id=review.ticket_id).values_list('user_id', flat=True).first()
+        user_ids = {review.user_id, *UserFollows.get_follower_ids(review.user_id)}
+        if ticket_user_id is not None:
+            user_ids.add(ticket_user_id)
+        cls.objects.bulk_create([cls.from_review(user_id, review) for user_id in user_ids], ignore_conflicts=True)
+
+    @classmethod
+    def add_followed_user_posts(cls, user, followed_user, batch_size=500):
+        """Write all posts of a followed user in the timeline of the user who has just followed him."""
+
+        tickets = Ticket.objects.filter(user=followed_user).only('id', 'time_created')
+        reviews = Review.objects.filter(user=followed_user).only('id', 'time_created')
+        cls.objects.bulk_create(
+            [cls.from_ticket(user.id, ticket) for ticket in tickets], batch_size=batch_size, ignore_conflicts=True)
+        cls.objects.bulk_create(
+            [cls.from_review(user.id, review) for review in reviews], batch_size=batch_size, ignore_conflicts=True)
+
+    @classmethod
+    def remove_followed_user_posts(cls, user, followed_user):
+        """Remove the posts of an unfollowed user from the timeline of the user, except the reviews of his tickets."""
+
+        if user.id == followed_user.id:
+            return  # The own posts always stay in the timeline
+        entries = cls.objects.filter(user=user)
+        entries.filter(ticket__user=followed_user).delete()
+        entries.filter(review__user=followed_user).exclude(review__ticket__user=user).delete()
+
+    @classmethod
+    def rebuild_timeline(cls, user, batch_size=500):
+        """Rebuild the whole timeline of a user from the tickets and reviews he can see."""
+
+        cls.objects.filter(user=user).delete()
+        tickets = Ticket.get_users_viewable_tickets(user).only('id', 'time_created')
+        reviews = Review.get_users_viewable_reviews(user).only('id', 'time_created')
+        cls.objects.bulk_create([cls.from_ticket(user.id, ticket) for ticket in tickets], batch_size=batch_size)
+        cls.objects.bulk_create([cls.from_review(user.id, review) for review in reviews], batch_size=batch_size)
+
+
+class ImportCheckpoint(models.Model):
+    """ImportCheckpoint records a batch imported by the import_jsonl command, in the transaction of the batch.
+
+    An import is resumed after its last checkpoint, with the map of the ticket ids of all its checkpoints.
+    """
+
+    # Name of the import (by default the absolute path of the imported file)
+    name = models.CharField(max_length=255)
+    # Number of lines of the file imported with this batch and the previous ones
+    lines = models.PositiveIntegerField()
+    # Map of the ids of the tickets of the batch: id in the file (as a string): new id
+    tickets = models.JSONField(default=dict)
+    time_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('name', 'lines',)
+
+    def __str__(self):
+        return f'{self.name}: {self.lines} lines imported'
@@ -0,0 +1,31 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Replication stand-in for book_review project, to run the primary/replica setup locally with two SQLite files.
+
+The replica (alias "replica", see routers module) is refreshed by copying the primary database into it with
+the online backup API of SQLite: the copy is consistent, and the connections open on the replica see the new
+content once it is done. The sync_replica command runs it once or periodically (the period is the replication
+delay, which REVIEWS_REPLICA_PIN_SECONDS must exceed).
+"""
+
+import sqlite3
+from contextlib import closing
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .routers import REPLICA_DB_ALIAS
+
+PAGES_BY_STEP = 1024  # Pages copied at once, the primary is not locked between the steps
+
+
+def copy_database(source_path, target_path):
+    """Copy a SQLite database into another one (created if needed) with the backup API."""
+
+    with closing(sqlite3.connect(source_path)) as source, closing(sqlite3.connect(target_path)) as target:
+        source.backup(target, pages=PAGES_BY_STEP)
+
+
+def replicate(source_alias=DEFAULT_DB_ALIAS, target_alias=REPLICA_DB_ALIAS):
+    """Copy the primary database into the replica."""
+
+    copy_database(connections[source_alias].settings_dict['NAME'], connections[target_alias].settings_dict['NAME'])
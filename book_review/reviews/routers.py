@@ -0,0 +1,57 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Database router for book_review project: the reads of the requests go to a replica of the database.
+
+When a replica is configured (REVIEWS_DATABASE_REPLICA setting, alias "replica"):
+- the writes always go to the primary database (alias "default"),
+- the reads of a request go to the replica, except when the request is pinned to the primary:
+a request which writes (POST...) and the requests of the same user during REVIEWS_REPLICA_PIN_SECONDS after it
+(PrimaryPinningMiddleware), so the user sees what he has just posted,
+- the reads in a transaction of the primary, and the reads outside of the requests (commands, shell), go to
+the primary.
+
+The replica lags behind the primary (see replication module): REVIEWS_REPLICA_PIN_SECONDS must be longer than
+the replication delay.
+"""
+
+import contextvars
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+# None outside of the requests, else True when the request must read from the primary
+pinned_to_primary = contextvars.ContextVar('reviews_pinned_to_primary', default=None)
+
+
+def has_replica():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def get_pin_seconds():
+    """Get the time during which the reads of a user go to the primary after he has written."""
+
+    return getattr(settings, 'REVIEWS_REPLICA_PIN_SECONDS', 10)
+
+
+def is_reading_from_replica():
+    """Return True when the reads of the current context go to the replica."""
+
+    return has_replica() and pinned_to_primary.get() is False and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+class PrimaryReplicaRouter:
+    """Send the writes to the primary database, and the reads of the requests to the replica when it is possible."""
+
+    def db_for_read(self, model, **hints):
+        return REPLICA_DB_ALIAS if is_reading_from_replica() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # The replica is a copy of the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS  # The replica gets the tables from the primary
@@ -0,0 +1,145 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Full-text search of the posts for book_review project.
+
+On SQLite, the titles and descriptions of the tickets and the headlines and bodies of the reviews are indexed in
+an FTS5 table (reviews_post_search, created by the migration 0005), whose rowid encodes the post:
+2 * id for a ticket, 2 * id + 1 for a review.
+- Triggers on the tables of the tickets and of the reviews keep the index up to date, whatever writes them
+(bulk insertions, updates of querysets, deletions). They are (re)created after each migration.
+- The results are ranked by bm25 (the titles weigh more than the bodies), and can be restricted to the posts
+viewable by a user (subqueries on the ids, evaluated by SQLite with the match).
+- Ranking all the matches of a very common word would take seconds with a million posts: only the
+MAX_RANKED_MATCHES newest matches (the highest rowids) are ranked.
+- The words of the query are prefixes, accents and case are ignored.
+- rebuild_index() fills the index again from the tables (rebuild_search_index command).
+
+On the other databases, the posts are searched with icontains (no ranking).
+"""
+
+import re
+
+from django.db import connections, router, transaction
+from django.db.models import Q, Value, CharField
+
+from .feed import TICKET, REVIEW
+from .models import Ticket, Review
+
+SEARCH_TABLE = 'reviews_post_search'
+MAX_QUERY_WORDS = 16
+MAX_RANKED_MATCHES = 10000
+
+# (trigger name, SQL), the index is written by INSERT OR REPLACE, so a missing entry is created by an update
+TRIGGERS = [
+    ('reviews_ticket_search_insert', f"""AFTER INSERT ON reviews_ticket BEGIN
+        INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, title, body) VALUES (2 * new.id, new.title, new.description);
+    END"""),
+    ('reviews_ticket_search_update', f"""AFTER UPDATE OF title, description ON reviews_ticket BEGIN
+        INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, title, body) VALUES (2 * new.id, new.title, new.description);
+    END"""),
+    ('reviews_ticket_search_delete', f"""AFTER DELETE ON reviews_ticket BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = 2 * old.id;
+    END"""),
+    ('reviews_review_search_insert', f"""AFTER INSERT ON reviews_review BEGIN
+        INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, title, body) VALUES (2 * new.id + 1, new.headline, new.body);
+    END"""),
+    ('reviews_review_search_update', f"""AFTER UPDATE OF headline, body ON reviews_review BEGIN
+        INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, title, body) VALUES (2 * new.id + 1, new.headline, new.body);
+    END"""),
+    ('reviews_review_search_delete', f"""AFTER DELETE ON reviews_review BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = 2 * old.id + 1;
+    END"""),
+]
+
+
+def get_connection():
+    return connections[router.db_for_read(Ticket)]
+
+
+def has_search_index(connection):
+    """Return True when the posts of a database are searched in the FTS5 index (created by the migrations)."""
+
+    return connection.vendor == 'sqlite'
+
+
+def create_triggers(connection):
+    """Create the triggers which maintain the index (when they do not exist)."""
+
+    if not has_search_index(connection) or SEARCH_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for name, sql in TRIGGERS:
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {sql}')
+
+
+def rebuild_index(using='default'):
+    """Index all the posts again, return the number of indexed posts."""
+
+    connection = connections[using]
+    if not has_search_index(connection) or SEARCH_TABLE not in connection.introspection.table_names():
+        return 0
+    create_triggers(connection)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(f'INSERT INTO {SEARCH_TABLE}(rowid, title, body) '
+                       f'SELECT 2 * id, title, description FROM {Ticket._meta.db_table}')
+        count = cursor.rowcount
+        cursor.execute(f'INSERT INTO {SEARCH_TABLE}(rowid, title, body) '
+                       f'SELECT 2 * id + 1, headline, body FROM {Review._meta.db_table}')
+        count += cursor.rowcount
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return count
+
+
+def get_words(text):
+    """Get the words of a search text (the FTS5 syntax of the text is ignored)."""
+
+    return re.findall(r'\w+', text or '')[:MAX_QUERY_WORDS]
+
+
+def build_match_query(words):
+    """Build the FTS5 query matching the posts which contain all the words (as prefixes)."""
+
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_posts(text, user=None, limit=20, offset=0):
+    """Search the posts (only the ones viewable by user when given), from the most relevant one.
+
+    Return a list of rows (dicts with the content_type and the id of the posts), see feed.load_posts.
+    """
+
+    words = get_words(text)
+    if not words:
+        return []
+    connection = get_connection()
+    if not has_search_index(connection):
+        return search_posts_without_index(words, user, limit, offset)
+
+    sql = f'SELECT rowid, rank FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s'
+    params = [build_match_query(words)]
+    if user is not None:
+        ticket_ids, ticket_params = Ticket.get_users_viewable_tickets(user).values('id').query.sql_with_params()
+        review_ids, review_params = Review.get_users_viewable_reviews(user).values('id').query.sql_with_params()
+        sql += (f' AND ((rowid & 1 = 0 AND rowid / 2 IN ({ticket_ids}))'
+                f' OR (rowid & 1 = 1 AND rowid / 2 IN ({review_ids})))')
+        params += [*ticket_params, *review_params]
+    sql = f'SELECT rowid FROM ({sql} ORDER BY rowid DESC LIMIT %s) ORDER BY rank LIMIT %s OFFSET %s'
+    params += [MAX_RANKED_MATCHES, limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [{'content_type': REVIEW if rowid % 2 else TICKET, 'id': rowid // 2} for rowid, in cursor.fetchall()]
+
+
+def search_posts_without_index(words, user, limit, offset):
+    """Search the posts with icontains (databases without FTS5), from the newest one."""
+
+    tickets, reviews = Ticket.objects.all(), Review.objects.all()
+    if user is not None:
+        tickets, reviews = Ticket.get_users_viewable_tickets(user), Review.get_users_viewable_reviews(user)
+    for word in words:
+        tickets = tickets.filter(Q(title__icontains=word) | Q(description__icontains=word))
+        reviews = reviews.filter(Q(headline__icontains=word) | Q(body__icontains=word))
+    tickets = tickets.annotate(content_type=Value(TICKET, CharField())).values('content_type', 'id', 'time_created')
+    reviews = reviews.annotate(content_type=Value(REVIEW, CharField())).values('content_type', 'id', 'time_created')
+    return list(tickets.union(reviews, all=True).order_by('-time_created')[offset:offset + limit])
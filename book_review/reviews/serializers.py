@@ -0,0 +1,61 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""JSON serialization of the feeds for book_review project.
+
+The feeds are streamed as a JSON array of posts (see stream_posts_as_json), each post is a dict:
+- ticket: type, id, title, description, image (URL or null), user, time_created, has_reviews
+- review: type, id, headline, body, rating, user, time_created, ticket (id, title and user of the ticket)
+"""
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .feed import TICKET, REVIEW
+
+encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+
+def serialize_ticket(ticket):
+    """Get the dict of a ticket."""
+
+    return {
+        'type': TICKET,
+        'id': ticket.id,
+        'title': ticket.title,
+        'description': ticket.description,
+        'image': ticket.image.url if ticket.image else None,
+        'user': ticket.user.username,
+        'time_created': ticket.time_created,
+        'has_reviews': getattr(ticket, 'has_reviews', None),
+    }
+
+
+def serialize_review(review):
+    """Get the dict of a review (with a summary of its ticket)."""
+
+    return {
+        'type': REVIEW,
+        'id': review.id,
+        'headline': review.headline,
+        'body': review.body,
+        'rating': review.rating,
+        'user': review.user.username,
+        'time_created': review.time_created,
+        'ticket': {'id': review.ticket.id, 'title': review.ticket.title, 'user': review.ticket.user.username},
+    }
+
+
+def serialize_post(post):
+    """Get the dict of a post of a feed."""
+
+    return serialize_ticket(post) if post.content_type == TICKET else serialize_review(post)
+
+
+def stream_posts_as_json(posts):
+    """Yield the JSON array of posts piece by piece (one piece by post), for a StreamingHttpResponse."""
+
+    yield '['
+    separator = '\n'
+    for post in posts:
+        yield separator + encoder.encode(serialize_post(post))
+        separator = ',\n'
+    yield '\n]\n'
@@ -0,0 +1,90 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Session engine of book_review project (SESSION_ENGINE = 'reviews.sessions'): cache first, coalesced writes.
+
+- The sessions are read from the cache (SESSION_CACHE_ALIAS), and from the database only on a cache miss,
+- a session is written (in the database, then in the cache) only when its content has really changed: a session
+modified then restored during a request (as a message added then displayed) is not written again,
+- the expiry date of an unchanged session is only extended in the database every SESSION_REFRESH_SECONDS
+(when SESSION_SAVE_EVERY_REQUEST is set), instead of at each request.
+
+The cache must be shared by all the processes of the server (see the "sessions" cache in settings.py), else a
+process could read an outdated session from its own cache. It must not be writable by other users, who could plant
+sessions in it (they are unpickled), and the tests use a temporary one (see reviews.testing).
+"""
+
+import copy
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends import db
+from django.core.cache import caches
+
+KEY_PREFIX = 'reviews.sessions.'
+
+
+def get_refresh_seconds():
+    """Get the minimal extension of the expiry date which is written for an unchanged session."""
+
+    return getattr(settings, 'SESSION_REFRESH_SECONDS', 24 * 3600)
+
+
+class SessionStore(db.SessionStore):
+    """Database sessions, read through the cache and written only when they change."""
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        self._saved = None  # (data, expiry timestamp) of the session as in the database and in the cache
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return KEY_PREFIX + self._get_or_create_session_key()
+
+    def load(self):
+        saved = None
+        if self.session_key is not None:
+            try:
+                saved = self._cache.get(self.cache_key)
+            except Exception:
+                saved = None  # The cache is not available: read the database
+        if saved is None:
+            session = self._get_session_from_db()
+            if session is None:
+                return {}
+            saved = (self.decode(session.session_data), session.expire_date.timestamp())
+            self._cache_session(saved)
+        self._saved = saved
+        return copy.deepcopy(saved[0])  # Modified in place by the request, compared with the saved data
+
+    def exists(self, session_key):
+        return KEY_PREFIX + session_key in self._cache or super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        expiry = self.get_expiry_date().timestamp()
+        if (not must_create and self._saved is not None and data == self._saved[0]
+                and expiry - self._saved[1] < get_refresh_seconds()):
+            return  # Nothing has changed since the session was written
+        super().save(must_create)
+        self._saved = (copy.deepcopy(data), expiry)
+        self._cache_session(self._saved)
+
+    def delete(self, session_key=None):
+        super().delete(session_key)
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(KEY_PREFIX + session_key)
+        self._saved = None
+
+    def _cache_session(self, saved):
+        """Cache the saved session until its expiry date."""
+
+        try:
+            self._cache.set(self.cache_key, saved, timeout=max(0, int(saved[1] - time.time())))
+        except Exception:
+            pass  # The database stays the reference
@@ -0,0 +1,171 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Signal receivers for book_review project.
+
+The cached feeds (see feed_cache module) of the users who can see a post are invalidated when the post is
+created, updated or deleted, and the cached Home feed of a user is invalidated when he follows or unfollows someone.
+A ticket is displayed with its reviews, and a review with its ticket: the users who see one see a change of the
+other (the feed version is also the ETag of the feeds, see conditional module).
+The feeds are invalidated when the transaction is committed: a request running meanwhile could otherwise cache a
+page of the data before the commit under the new version of the feed.
+
+The statistics of the reviews of a ticket (number, sum of the ratings, last review time) are updated in one
+query with F-expressions when one of its reviews is created, updated or deleted, and the ticket is marked as
+updated: its pages show whether it has reviews (see the validators of the conditional module).
+
+The resized variants of the image of a ticket are created when the image is uploaded (when the image of the ticket
+changes), a missing or unreadable image does not prevent the ticket from being saved.
+
+When the timeline mode is enabled (REVIEWS_FEED_TIMELINE setting), the FeedEntry table is kept up to date:
+- a new ticket or review is written in the timelines of the users who can see it,
+- following a user adds his posts in the timeline of the follower, unfollowing him removes them.
+
+The entries of a deleted post are removed by the database cascade.
+
+The triggers of the search index (see search module) are created after the migrations.
+
+The query timer of the metrics (see metrics module) and the pragmas of the database profile (see database module)
+are set on each new database connection.
+"""
+
+import logging
+
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from . import database, feed_cache, images, metrics, search
+from .feed import is_timeline_enabled
+from .models import Ticket, Review, UserFollows, FeedEntry
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Ticket)
+def add_ticket_to_timelines(sender, instance, created, **kwargs):
+    if created and is_timeline_enabled():
+        with transaction.atomic():
+            FeedEntry.add_ticket(instance)
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_timelines(sender, instance, created, **kwargs):
+    if created and is_timeline_enabled():
+        with transaction.atomic():
+            FeedEntry.add_review(instance)
+
+
+@receiver(post_save, sender=UserFollows)
+def add_followed_user_posts_to_timeline(sender, instance, created, **kwargs):
+    if created and is_timeline_enabled():
+        with transaction.atomic():
+            FeedEntry.add_followed_user_posts(instance.user, instance.followed_user)
+
+
+@receiver(post_delete, sender=UserFollows)
+def remove_followed_user_posts_from_timeline(sender, instance, **kwargs):
+    if is_timeline_enabled():
+        with transaction.atomic():
+            FeedEntry.remove_followed_user_posts(instance.user, instance.followed_user)
+
+
+def invalidate_feeds_on_commit(user_ids):
+    """Invalidate the cached Home feeds of users once the current transaction is committed."""
+
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: feed_cache.invalidate(user_ids))
+
+
+def get_audience_ids(author_ids):
+    """Get the ids of the users whose feeds show the posts of some authors: the authors and their followers."""
+
+    author_ids = set(author_ids)
+    follower_ids = UserFollows.objects.filter(followed_user_id__in=author_ids).values_list('user_id', flat=True)
+    return author_ids | set(follower_ids)
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def invalidate_ticket_audience_feeds(sender, instance, **kwargs):
+    # The reviews of the ticket are displayed with it
+    reviewer_ids = Review.objects.filter(ticket_id=instance.id).values_list('user_id', flat=True)
+    invalidate_feeds_on_commit(get_audience_ids([instance.user_id, *reviewer_ids]))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_audience_feeds(sender, instance, **kwargs):
+    # The author of the ticket sees the replies to it, and the snippet of the ticket shows whether it has reviews
+    ticket_user_id = Ticket.objects.filter(id=instance.ticket_id).values_list('user_id', flat=True).first()
+    author_ids = [instance.user_id] if ticket_user_id is None else [instance.user_id, ticket_user_id]
+    invalidate_feeds_on_commit(get_audience_ids(author_ids))
+
+
+@receiver(post_save, sender=UserFollows)
+@receiver(post_delete, sender=UserFollows)
+def invalidate_follower_feed(sender, instance, **kwargs):
+    invalidate_feeds_on_commit([instance.user_id])
+
+
+@receiver(pre_save, sender=Review)
+def remember_saved_review(sender, instance, **kwargs):
+    # Ticket and rating of the review in the database, before an update
+    instance._saved_review = None
+    if instance.pk is not None:
+        instance._saved_review = Review.objects.filter(pk=instance.pk).values('ticket_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_ticket_stats(sender, instance, created, **kwargs):
+    saved_review = getattr(instance, '_saved_review', None)
+    if created or saved_review is None:
+        Ticket.update_review_stats(instance.ticket_id, 1, instance.rating, instance.time_created)
+    elif saved_review['ticket_id'] != instance.ticket_id:
+        Ticket.update_review_stats(saved_review['ticket_id'], -1, -saved_review['rating'])
+        Ticket.update_review_stats(instance.ticket_id, 1, instance.rating, instance.time_created)
+    else:
+        Ticket.update_review_stats(instance.ticket_id, rating=instance.rating - saved_review['rating'])
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_ticket_stats(sender, instance, **kwargs):
+    Ticket.update_review_stats(instance.ticket_id, -1, -instance.rating)
+
+
+@receiver(pre_save, sender=Ticket)
+def remember_saved_image(sender, instance, update_fields=None, **kwargs):
+    # Image of the ticket in the database, before an update which may change it
+    instance._saved_image = None
+    if instance.pk is not None and (update_fields is None or 'image' in update_fields):
+        instance._saved_image = Ticket.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Ticket)
+def create_image_variants(sender, instance, update_fields=None, **kwargs):
+    name = instance.image.name if instance.image else None
+    if not name or name == getattr(instance, '_saved_image', None) or (
+            update_fields is not None and 'image' not in update_fields):
+        return  # No new image
+    try:
+        if not images.has_variants(name):
+            images.generate_variants(name)
+    except OSError as error:  # Missing or unreadable image (PIL.UnidentifiedImageError is an OSError)
+        # The ticket is saved anyway: the pages show the original image, regenerate_image_variants retries
+        logger.warning("The variants of the image %s were not created: %s", name, error)
+
+
+@receiver(connection_created)
+def install_metrics_query_timer(sender, connection, **kwargs):
+    metrics.install_query_timer(connection)
+
+
+@receiver(connection_created)
+def apply_database_pragmas(sender, connection, **kwargs):
+    database.apply_pragmas(connection)
+
+
+@receiver(post_migrate)
+def create_search_triggers(sender, using, **kwargs):
+    if sender.name == 'reviews':
+        search.create_triggers(connections[using])
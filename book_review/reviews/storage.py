@@ -0,0 +1,100 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Content-addressed storage of the uploaded files for book_review project.
+
+The files uploaded in the content-addressed directories (the ticket images) are stored once by distinct content:
+- the upload is hashed (SHA-256) while it is streamed to a temporary file,
+- it is stored as <directory>/<2 first characters of the digest>/<digest><extension>,
+- when a file with the same digest already exists, the upload is dropped and the existing file is used: its
+modification time is updated, so gc_media sees it as recent while the ticket pointing at it is saved.
+
+Many Ticket rows can then point at the same file. The files are never deleted with a ticket,
+the orphaned ones are removed by the gc_media command (the dedup_media command converts the old files).
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Directories (upload_to of the file fields) whose files are content-addressed
+CONTENT_ADDRESSED_DIRECTORIES = ('images/',)
+# Directory of the uploads being hashed (in the media root, so a finished upload is moved and not copied)
+UPLOADS_DIRECTORY = '.uploads'
+
+
+def hash_file(file, chunk_size=64 * 1024):
+    """Compute the SHA-256 digest of a file object, reading it by chunks."""
+
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_blob_name(name, digest):
+    """Get the content-addressed name of a file, e.g. images/cover.JPG -> images/9f/9f86d0...15b0.jpg"""
+
+    directory = os.path.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return f'{directory}/{digest[:2]}/{digest}{extension}'
+
+
+def is_content_addressed(name):
+    """Return True when a file of this name is stored by content."""
+
+    return name.replace('\\', '/').startswith(CONTENT_ADDRESSED_DIRECTORIES)
+
+
+def is_blob_name(name):
+    """Return True when a name is already a content-addressed name (see get_blob_name)."""
+
+    parts = name.replace('\\', '/').split('/')
+    if len(parts) < 3:
+        return False
+    digest = os.path.splitext(parts[-1])[0]
+    return len(digest) == 64 and parts[-2] == digest[:2] and all(c in '0123456789abcdef' for c in digest)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage which stores the files of the content-addressed directories once by content."""
+
+    def get_available_name(self, name, max_length=None):
+        """The content-addressed names are never suffixed: the same name means the same content."""
+
+        if is_content_addressed(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not is_content_addressed(name):
+            return super()._save(name, content)
+
+        uploads_directory = self.path(UPLOADS_DIRECTORY)
+        os.makedirs(uploads_directory, exist_ok=True)
+        digest = hashlib.sha256()
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=uploads_directory)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temporary_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary_file.write(chunk)
+
+            name = get_blob_name(name, digest.hexdigest())
+            full_path = self.path(name)
+            try:
+                os.utime(full_path)  # The same content is already stored: it is kept by gc_media (grace period)
+                return name
+            except FileNotFoundError:
+                pass
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary_path, self.file_permissions_mode)
+            os.replace(temporary_path, full_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        return name
@@ -0,0 +1,124 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Generator of synthetic data for book_review project (used by the generate_social_graph and bench_views commands).
+
+The generated data looks like a real social network:
+- the follow graph follows a power law: few users are followed by many users, most users by few of them,
+and the number of users followed by a user is also heavy-tailed,
+- the active users write more tickets than the others,
+- the tickets and the reviews are spread over a period of time, a review is always written after its ticket.
+
+The generation is deterministic for a given seed, and the rows are inserted by batches (see reviews.bulk).
+"""
+
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .bulk import bulk_create_with_ids, preserve_time_created, refresh_derived_data
+from .models import Review, Ticket, UserFollows
+
+USERNAME_PREFIX = 'user_'
+BATCH_SIZE = 5000
+
+
+def get_power_law_weights(count, exponent):
+    """Get the weights of `count` items of rank 1..count, proportional to 1 / rank ** exponent."""
+
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def get_follow_count(rng, mean, maximum):
+    """Draw a heavy-tailed number of followed users (Pareto distribution of the given mean)."""
+
+    shape = 2.0  # Mean of the Pareto distribution of minimum 1: shape / (shape - 1) = 2
+    return min(maximum, int(rng.paretovariate(shape) * mean / 2))
+
+
+def get_count(rng, mean):
+    """Draw a number of items (exponential distribution of the given mean, rounded)."""
+
+    return int(rng.expovariate(1 / mean) + 0.5) if mean > 0 else 0
+
+
+def insert_in_batches(model, objects, with_ids=False):
+    """Insert objects by batches, each batch in its own transaction. Return the inserted objects."""
+
+    inserted = []
+    for start in range(0, len(objects), BATCH_SIZE):
+        batch = objects[start:start + BATCH_SIZE]
+        with transaction.atomic():
+            if with_ids:
+                bulk_create_with_ids(model, batch)
+            else:
+                model.objects.bulk_create(batch)
+        inserted.extend(batch)
+    return inserted
+
+
+def generate_social_graph(users=1000, mean_follows=20, exponent=1.0, tickets_per_user=3.0, reviews_per_ticket=1.0,
+                          days=365, seed=0):
+    """Generate users, their follows, tickets and reviews. Return the number of created rows by model.
+
+    The users are named user_0, user_1...: the lower the number, the more popular the user.
+    """
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    period = timedelta(days=days).total_seconds()
+
+    password = make_password(None)  # Unusable password, the users of the benchmarks are logged in directly
+    existing = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+    new_users = insert_in_batches(User, [
+        User(username=f'{USERNAME_PREFIX}{existing + i}', password=password) for i in range(users)], with_ids=True)
+    user_ids = [user.id for user in new_users]
+
+    # Follows: the followed users are drawn by popularity (power law of the rank)
+    cum_weights = list(accumulate(get_power_law_weights(len(user_ids), exponent)))
+    follows = []
+    for user_id in user_ids:
+        follow_count = get_follow_count(rng, mean_follows, len(user_ids) - 1)
+        followed_ids = set(rng.choices(user_ids, cum_weights=cum_weights, k=follow_count))
+        followed_ids.discard(user_id)
+        follows.extend(UserFollows(user_id=user_id, followed_user_id=followed_id) for followed_id in followed_ids)
+    insert_in_batches(UserFollows, follows)
+
+    # Tickets: the activity of a user also follows the power law, in a shuffled order of the users
+    activity = get_power_law_weights(len(user_ids), exponent)
+    rng.shuffle(activity)
+    scale = tickets_per_user * len(user_ids) / sum(activity)
+    tickets = []
+    for user_id, weight in zip(user_ids, activity):
+        for _ in range(get_count(rng, weight * scale)):
+            tickets.append(Ticket(
+                title=f'Livre {rng.randrange(10 ** 6)}',
+                description='Description du livre. ' * rng.randint(1, 20),
+                user_id=user_id,
+                time_created=now - timedelta(seconds=rng.random() * period),
+            ))
+
+    with preserve_time_created(Ticket, Review):
+        tickets = insert_in_batches(Ticket, tickets, with_ids=True)
+
+        # Reviews: written by users drawn by popularity, after the ticket
+        reviews = []
+        for ticket in tickets:
+            for _ in range(get_count(rng, reviews_per_ticket)):
+                age = (now - ticket.time_created).total_seconds()
+                reviews.append(Review(
+                    ticket_id=ticket.id,
+                    rating=rng.randint(0, 5),
+                    headline=f'Critique {rng.randrange(10 ** 6)}',
+                    body='Avis sur le livre. ' * rng.randint(1, 50),
+                    user_id=rng.choices(user_ids, cum_weights=cum_weights)[0],
+                    time_created=now - timedelta(seconds=rng.random() * age),
+                ))
+        insert_in_batches(Review, reviews)
+
+    refresh_derived_data()
+    return {'users': len(user_ids), 'follows': len(follows), 'tickets': len(tickets), 'reviews': len(reviews)}
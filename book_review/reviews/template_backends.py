@@ -0,0 +1,62 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Template backends for book_review project.
+
+InstrumentedDjangoTemplates and InstrumentedJinja2 are the Django and Jinja2 template backends, which time the
+rendering of the templates for the metrics of the requests (see metrics module). Only the templates rendered by
+the views are timed, the included templates are part of their rendering.
+
+The feed pages (Home and Posts) and their snippets have Jinja2 versions (reviews/jinja2/, see jinja2_environment
+module), rendered instead of the Django ones when the REVIEWS_TEMPLATE_ENGINE setting is 'jinja2'.
+"""
+
+import time
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.jinja2 import Jinja2
+
+from . import metrics
+
+
+def get_feed_engine():
+    """Get the name of the template engine rendering the feed pages (REVIEWS_TEMPLATE_ENGINE setting)."""
+
+    return getattr(settings, 'REVIEWS_TEMPLATE_ENGINE', 'django')
+
+
+class InstrumentedTemplate:
+    """Template of a backend, whose render time is added to the metrics of the current request."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.record_template_time(time.perf_counter() - start)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend which times the rendering of its templates."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
+
+
+class InstrumentedJinja2(Jinja2):
+    """Jinja2 template backend which times the rendering of its templates."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
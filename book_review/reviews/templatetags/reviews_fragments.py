@@ -0,0 +1,51 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Template tag to cache the snippets of the posts (see reviews.fragment_cache)."""
+
+from django import template
+
+from reviews import fragment_cache
+
+register = template.Library()
+
+
+class PostFragmentNode(template.Node):
+    def __init__(self, nodelist, name, post, viewer, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.post = post
+        self.viewer = viewer
+        self.vary_on = vary_on
+
+    def render(self, context):
+        return fragment_cache.render_fragment(
+            lambda: self.nodelist.render(context),
+            self.name.resolve(context),
+            self.post.resolve(context),
+            viewer=self.viewer.resolve(context) if self.viewer is not None else None,
+            vary_on=[value.resolve(context) for value in self.vary_on])
+
+
+@register.tag
+def post_fragment(parser, token):
+    """Cache the fragment of a post, by version of the post (and perspective of the viewer when given).
+
+    Usage:
+        {% post_fragment 'ticket' post for user post.has_reviews %} ... {% endpost_fragment %}
+        {% post_fragment 'ticket-info' post image_variant %} ... {% endpost_fragment %}
+    The values after the post (and the viewer) are the other values the fragment depends on.
+    """
+
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name and a post.")
+    name, post = parser.compile_filter(bits[1]), parser.compile_filter(bits[2])
+    bits = bits[3:]
+    viewer = None
+    if bits and bits[0] == 'for':
+        if len(bits) < 2:
+            raise template.TemplateSyntaxError("'for' must be followed by the viewer.")
+        viewer, bits = parser.compile_filter(bits[1]), bits[2:]
+    nodelist = parser.parse(('endpost_fragment',))
+    parser.delete_first_token()
+    return PostFragmentNode(nodelist, name, post, viewer, [parser.compile_filter(bit) for bit in bits])
@@ -0,0 +1,20 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Template tags to display the ticket images with their resized variants (see reviews.images)."""
+
+from django import template
+
+from reviews.images import get_variant_urls
+
+register = template.Library()
+
+
+@register.inclusion_tag('reviews/includes/responsive_image.html')
+def responsive_image(image, variant='feed', alt=''):
+    """Display an image with its resized variant ("feed" or "detail"), and its WebP version when it exists.
+
+    Usage: {% responsive_image post.image 'feed' %}
+    """
+
+    url, webp_url = get_variant_urls(image, variant)
+    return {'url': url, 'webp_url': webp_url, 'alt': alt}
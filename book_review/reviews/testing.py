@@ -0,0 +1,87 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Test utilities for book_review project.
+
+- Budget: maximal number of SQL queries and maximal SQL time of a request,
+- query_budget: context manager which fails when the queries run inside it exceed a budget, and shows them,
+- TestRunner: test runner (TEST_RUNNER setting) which stores the file based caches in a temporary directory.
+
+The queries are captured by an execute wrapper (not with connection.queries, which is reset when a request starts),
+so they can be timed precisely.
+"""
+
+import shutil
+import tempfile
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .benchmarking import get_temporary_caches
+
+Budget = namedtuple('Budget', ['queries', 'sql_ms'])
+# SQL query run inside query_budget, with its duration
+CapturedQuery = namedtuple('CapturedQuery', ['sql', 'params', 'seconds'])
+
+# Length of the SQL displayed for each query in the failure report
+MAX_DISPLAYED_SQL_LENGTH = 500
+
+
+def format_queries(queries):
+    """Format the captured queries for a failure report: the repeated SQL (N+1 queries) are marked."""
+
+    repeated = Counter(query.sql for query in queries)
+    lines = []
+    for number, query in enumerate(queries, start=1):
+        sql = query.sql if len(query.sql) <= MAX_DISPLAYED_SQL_LENGTH else query.sql[:MAX_DISPLAYED_SQL_LENGTH] + '...'
+        marker = f' [run {repeated[query.sql]} times]' if repeated[query.sql] > 1 else ''
+        lines.append(f'{number}. ({query.seconds * 1000:.2f} ms){marker} {sql} -- params: {query.params}')
+    return '\n'.join(lines)
+
+
+@contextmanager
+def query_budget(budget, label=''):
+    """Capture the queries run inside the block and raise AssertionError when they exceed the budget.
+
+    The list of the captured queries (CapturedQuery) is given to the block.
+    """
+
+    queries = []
+
+    def capture(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            queries.append(CapturedQuery(sql, params, time.perf_counter() - start))
+
+    with connection.execute_wrapper(capture):
+        yield queries
+
+    sql_ms = sum(query.seconds for query in queries) * 1000
+    failures = []
+    if budget.queries is not None and len(queries) > budget.queries:
+        failures.append(f'{len(queries)} queries (budget: {budget.queries})')
+    if budget.sql_ms is not None and sql_ms > budget.sql_ms:
+        failures.append(f'{sql_ms:.1f} ms of SQL (budget: {budget.sql_ms} ms)')
+    if failures:
+        raise AssertionError(f"{label}: {', '.join(failures)}\n{format_queries(queries)}")
+
+
+class TestRunner(DiscoverRunner):
+    """Run the tests with temporary file based caches: the tests clear the caches and fill them with the rows of
+    the test database, the caches of the server must not be touched."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.mkdtemp(prefix='book_review_test_caches_')
+        self.cache_settings = override_settings(CACHES=get_temporary_caches(self.cache_directory))
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
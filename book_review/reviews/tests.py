@@ -1,3 +1,1561 @@
-from django.test import TestCase
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Tests for book_review project."""
 
-# Create your tests here.
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.template.defaultfilters import filesizeformat
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date, urlencode
+from PIL import Image
+
+from . import database, feed, feed_cache, fragment_cache, images, metrics, routers, urls
+from .benchmarking import find_regressions, histogram
+from .loadtest import PASSWORD, VirtualUser, count_lock_error, _local
+from .management.commands import import_jsonl
+from .management.commands.gc_media import walk_files
+from .middleware import PRIMARY_PIN_COOKIE, PrimaryPinningMiddleware
+from .models import Ticket, Review, UserFollows, FeedEntry, ImportCheckpoint
+from .replication import copy_database
+from .search import search_posts
+from .sessions import SessionStore
+from .storage import is_blob_name
+from .synthetic import generate_social_graph
+from .testing import Budget, query_budget
+from .uploadhandlers import read_image_header
+from .views import ReviewListView, TicketListView
+
+
+class ReviewsTestCase(TestCase):
+    """Base class of the tests: the caches (as the feed cache) are cleared before each test."""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+
+def create_followed_users(user, count, prefix="followed"):
+    """Create `count` users followed by `user` (bulk insert, to keep the tests fast)."""
+
+    User.objects.bulk_create([User(username=f"{prefix}_{i}") for i in range(count)])
+    followed_users = User.objects.filter(username__startswith=f"{prefix}_")
+    UserFollows.objects.bulk_create(
+        [UserFollows(user=user, followed_user=followed_user) for followed_user in followed_users])
+    return followed_users
+
+
+class FeedQueryTests(ReviewsTestCase):
+    """The feed of a user is made of his posts, which of his following users and the reviews for his tickets."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed = User.objects.create_user(username="writer", password="secret-password")
+        self.stranger = User.objects.create_user(username="stranger", password="secret-password")
+        UserFollows.objects.create(user=self.user, followed_user=self.followed)
+
+        self.own_ticket = Ticket.objects.create(title="Own ticket", user=self.user)
+        self.followed_ticket = Ticket.objects.create(title="Followed ticket", user=self.followed)
+        self.stranger_ticket = Ticket.objects.create(title="Stranger ticket", user=self.stranger)
+
+        self.own_review = Review.objects.create(
+            ticket=self.stranger_ticket, rating=3, headline="Own review", user=self.user)
+        self.followed_review = Review.objects.create(
+            ticket=self.stranger_ticket, rating=4, headline="Followed review", user=self.followed)
+        self.reply_review = Review.objects.create(
+            ticket=self.own_ticket, rating=5, headline="Reply from a stranger", user=self.stranger)
+        self.stranger_review = Review.objects.create(
+            ticket=self.stranger_ticket, rating=1, headline="Stranger review", user=self.stranger)
+
+    def test_viewable_tickets(self):
+        self.assertQuerysetEqual(
+            Ticket.get_users_viewable_tickets(self.user).order_by("id"),
+            [self.own_ticket, self.followed_ticket],
+            transform=lambda ticket: ticket)
+
+    def test_viewable_reviews(self):
+        self.assertQuerysetEqual(
+            Review.get_users_viewable_reviews(self.user).order_by("id"),
+            [self.own_review, self.followed_review, self.reply_review],
+            transform=lambda review: review)
+
+    def test_viewable_posts_are_fetched_with_one_query_each(self):
+        create_followed_users(self.user, 50)
+        with self.assertNumQueries(1):
+            list(Ticket.get_users_viewable_tickets(self.user))
+        with self.assertNumQueries(1):
+            list(Review.get_users_viewable_reviews(self.user))
+
+
+class HomeViewQueryCountTests(ReviewsTestCase):
+    """The number of queries of the home page must not depend on the number of followed users."""
+
+    def count_home_view_queries(self, follow_count):
+        user = User.objects.create_user(username=f"reader_{follow_count}", password="secret-password")
+        create_followed_users(user, follow_count, prefix=f"followed_by_{follow_count}")
+        Ticket.objects.create(title="A ticket", user=user)
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("reviews:home"))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_home_view_query_count_is_flat(self):
+        query_counts = {follow_count: self.count_home_view_queries(follow_count) for follow_count in (1, 100, 1000)}
+        self.assertEqual(len(set(query_counts.values())), 1, query_counts)
+
+
+class FeedPaginationTests(ReviewsTestCase):
+    """Feeds are merged and ordered in the database, then navigated page by page with a cursor."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.client.force_login(self.user)
+        time_created = timezone.now()
+        for i in range(7):
+            ticket = Ticket.objects.create(title=f"Ticket {i}", user=self.user)
+            review = Review.objects.create(ticket=ticket, rating=3, headline=f"Review {i}", user=self.user)
+            # Two posts share each timestamp, the order must still be total
+            Ticket.objects.filter(pk=ticket.pk).update(time_created=time_created - timedelta(minutes=i))
+            Review.objects.filter(pk=review.pk).update(time_created=time_created - timedelta(minutes=i))
+
+    def get_all_pages(self, page_size):
+        cursor, pages = None, []
+        while True:
+            posts, next_cursor = feed.get_feed_page(
+                Ticket.get_tickets_created_by_user(self.user),
+                Review.get_reviews_posted_by_user(self.user),
+                feed.decode_cursor(cursor), page_size=page_size)
+            pages.append(posts)
+            if next_cursor is None:
+                return pages
+            cursor = next_cursor
+
+    def test_pages_cover_the_feed_in_order(self):
+        pages = self.get_all_pages(page_size=3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 3, 2])
+        posts = [post for page in pages for post in page]
+        self.assertEqual(len({(post.content_type, post.pk) for post in posts}), 14)
+        times = [post.time_created for post in posts]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_page_query_count_does_not_depend_on_the_page(self):
+        tickets = Ticket.get_tickets_created_by_user(self.user)
+        reviews = Review.get_reviews_posted_by_user(self.user)
+        cursor = None
+        for _ in range(4):
+            with self.assertNumQueries(3):
+                posts, cursor = feed.get_feed_page(tickets, reviews, feed.decode_cursor(cursor), page_size=3)
+
+    @override_settings(REVIEWS_FEED_PAGE_SIZE=5)
+    def test_older_posts_link(self):
+        response = self.client.get(reverse("reviews:own-posts"))
+        self.assertEqual(len(response.context["posts"]), 5)
+        response = self.client.get(reverse("reviews:own-posts"), {"before": response.context["next_cursor"]})
+        self.assertEqual(len(response.context["posts"]), 5)
+        self.assertContains(response, "Posts plus anciens")
+
+    def test_invalid_cursor_shows_the_first_page(self):
+        self.assertIsNone(feed.decode_cursor("not-a-cursor"))
+        response = self.client.get(reverse("reviews:home"), {"before": "TICKET_x_y"})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(REVIEWS_FEED_TIMELINE=True)
+class TimelineTests(ReviewsTestCase):
+    """In timeline mode, the materialized feed must match the feed computed from the posts."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed = User.objects.create_user(username="writer", password="secret-password")
+        self.stranger = User.objects.create_user(username="stranger", password="secret-password")
+        self.own_ticket = Ticket.objects.create(title="Own ticket", user=self.user)
+        self.followed_ticket = Ticket.objects.create(title="Followed ticket", user=self.followed)
+        self.reply_review = Review.objects.create(
+            ticket=self.own_ticket, rating=5, headline="Reply from a stranger", user=self.stranger)
+        self.stranger_ticket = Ticket.objects.create(title="Stranger ticket", user=self.stranger)
+
+    def get_timeline_posts(self, user):
+        posts, _ = feed.get_timeline_page(user, page_size=100)
+        return {(post.content_type, post.pk) for post in posts}
+
+    def get_computed_posts(self, user):
+        posts, _ = feed.get_feed_page(
+            Ticket.get_users_viewable_tickets(user), Review.get_users_viewable_reviews(user), page_size=100)
+        return {(post.content_type, post.pk) for post in posts}
+
+    def test_timeline_follows_posts_and_follows(self):
+        UserFollows.add_user_follows(self.user, self.followed.username)
+        Review.objects.create(ticket=self.stranger_ticket, rating=2, headline="Followed review", user=self.followed)
+        self.assertEqual(self.get_timeline_posts(self.user), self.get_computed_posts(self.user))
+        self.assertEqual(len(self.get_timeline_posts(self.user)), 4)
+
+        self.followed_ticket.delete()
+        self.assertEqual(self.get_timeline_posts(self.user), self.get_computed_posts(self.user))
+
+        UserFollows.objects.get(user=self.user, followed_user=self.followed).delete()
+        self.assertEqual(self.get_timeline_posts(self.user), {("TICKET", self.own_ticket.pk),
+                                                              ("REVIEW", self.reply_review.pk)})
+
+    def test_timeline_page_is_one_query(self):
+        UserFollows.add_user_follows(self.user, self.followed.username)
+        with self.assertNumQueries(1):
+            feed.get_home_feed_page(self.user)
+
+    def test_rebuild_feed_command(self):
+        with self.settings(REVIEWS_FEED_TIMELINE=False):
+            UserFollows.add_user_follows(self.user, self.stranger.username)
+        self.assertNotEqual(self.get_timeline_posts(self.user), self.get_computed_posts(self.user))
+        call_command("rebuild_feed", stdout=StringIO())
+        for user in (self.user, self.followed, self.stranger):
+            self.assertEqual(self.get_timeline_posts(user), self.get_computed_posts(user))
+
+
+class FeedCacheTests(ReviewsTestCase):
+    """Repeat visits of the Home page are served from the feed cache until a relevant event happens."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed = User.objects.create_user(username="writer", password="secret-password")
+        self.stranger = User.objects.create_user(username="stranger", password="secret-password")
+        UserFollows.objects.create(user=self.user, followed_user=self.followed)
+        self.ticket = Ticket.objects.create(title="Own ticket", user=self.user)
+
+    def get_home_posts(self):
+        posts, _ = feed.get_home_feed_page(self.user)
+        return [(post.content_type, post.pk) for post in posts]
+
+    def assertFeedIsCached(self):
+        self.get_home_posts()
+        with CaptureQueriesContext(connection) as context:
+            self.get_home_posts()
+        # Only the posts are loaded by primary key, the viewable posts are not queried again
+        self.assertTrue(all("UNION" not in query["sql"] for query in context.captured_queries))
+
+    def test_repeat_visit_is_a_cache_hit(self):
+        self.assertFeedIsCached()
+        stats = feed_cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_feed_is_invalidated_by_relevant_events(self):
+        # The feeds are invalidated when the transaction is committed (the callbacks are run by the test)
+        self.assertFeedIsCached()
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = Ticket.objects.create(title="Followed ticket", user=self.followed)
+        self.assertIn(("TICKET", ticket.pk), self.get_home_posts())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(ticket=self.ticket, rating=2, headline="Reply", user=self.stranger)
+        self.assertIn(("REVIEW", review.pk), self.get_home_posts())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.title = "Updated title"
+            ticket.save()
+        self.assertFeedIsCached()
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertNotIn(("REVIEW", review.pk), self.get_home_posts())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFollows.objects.filter(user=self.user).delete()
+        self.assertNotIn(("TICKET", ticket.pk), self.get_home_posts())
+
+    def test_feed_is_invalidated_after_the_commit(self):
+        self.get_home_posts()
+        version = feed_cache.get_version(feed_cache.get_cache(), self.user.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ticket.objects.create(title="Followed ticket", user=self.followed)
+            # A page computed before the commit is cached under the current version, which the commit changes
+            self.assertEqual(feed_cache.get_version(feed_cache.get_cache(), self.user.id), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(feed_cache.get_version(feed_cache.get_cache(), self.user.id), version)
+
+    def test_feed_cache_is_shared_by_the_processes(self):
+        self.assertNotIn("locmem", settings.CACHES[settings.REVIEWS_FEED_CACHE]["BACKEND"])
+
+    def test_tests_do_not_use_the_caches_of_the_server(self):
+        # The caches are cleared by the tests and filled with the rows of the test database (see reviews.testing)
+        for alias in ("feed", "sessions"):
+            self.assertIn("book_review_test_caches_", settings.CACHES[alias]["LOCATION"])
+
+    def test_unrelated_events_keep_the_cache(self):
+        self.get_home_posts()
+        Ticket.objects.create(title="Stranger ticket", user=self.stranger)
+        self.get_home_posts()
+        self.assertEqual(feed_cache.get_stats()["hits"], 1)
+
+    def test_stats_view_is_for_staff_members(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("reviews:feed-cache-stats")).status_code, 302)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse("reviews:feed-cache-stats")).json()["enabled"], True)
+
+    def test_counts_of_a_shared_cache_are_approximate(self):
+        # The increments of the file based cache are not atomic across the processes
+        self.assertTrue(feed_cache.get_stats()["approximate"])
+        self.assertFalse(fragment_cache.get_stats()["approximate"])  # Local memory cache
+        text = metrics.registry.render()
+        self.assertIn("Home feed pages read from the cache. Approximate", text)
+        self.assertNotIn("Post snippets read from the cache. Approximate", text)
+
+
+class FragmentCacheTests(ReviewsTestCase):
+    """The snippets of the posts are cached by version of the post and perspective of the viewer."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed = User.objects.create_user(username="writer", password="secret-password")
+        UserFollows.objects.create(user=self.user, followed_user=self.followed)
+        self.ticket = Ticket.objects.create(title="Followed ticket", user=self.followed)
+        self.client.force_login(self.user)
+
+    def get_home_page(self):
+        feed_cache.clear()  # The posts are loaded again, only the fragments are cached
+        return self.client.get(reverse("reviews:home")).content.decode()
+
+    def test_repeat_render_reads_the_fragments(self):
+        content = self.get_home_page()
+        stats = fragment_cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (0, 2))  # The ticket snippet and its information
+        self.assertEqual(self.get_home_page(), content)
+        stats = fragment_cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(stats["hit_ratio"], 1 / 3)
+
+    def test_fragments_depend_on_the_viewer(self):
+        self.assertIn("writer a demandé une critique", self.get_home_page())
+        self.client.force_login(self.followed)
+        self.assertIn("Vous avez demandé une critique", self.get_home_page())
+
+    def test_updated_posts_are_rendered_again(self):
+        self.get_home_page()
+        self.ticket.title = "Updated title"
+        self.ticket.save()
+        self.assertIn("Updated title", self.get_home_page())
+
+        # A review hides the link to review the ticket, and displays the ticket
+        review = Review.objects.create(ticket=self.ticket, rating=3, headline="Reply", user=self.user)
+        content = self.get_home_page()
+        self.assertNotIn(f"?ticket={self.ticket.pk}", content)
+        self.ticket.title = "Last title"
+        self.ticket.save()
+        self.assertEqual(self.get_home_page().count("Last title"), 2)
+
+        review.headline = "Updated reply"
+        review.save()
+        self.assertIn("Updated reply", self.get_home_page())
+
+    @override_settings(REVIEWS_FRAGMENT_CACHE=None)
+    def test_disabled_cache(self):
+        self.assertIn("Followed ticket", self.get_home_page())
+        self.assertEqual(fragment_cache.get_stats()["enabled"], False)
+
+
+@override_settings(REVIEWS_FEED_PAGE_SIZE=2)
+class PostListTests(ReviewsTestCase):
+    """The lists of tickets and reviews show the posts of the user by pages, without their large columns."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.other = User.objects.create_user(username="writer", password="secret-password")
+        for i in range(3):
+            ticket = Ticket.objects.create(title=f"Ticket {i}", description="Description", user=self.user)
+            Review.objects.create(ticket=ticket, rating=2, headline=f"Review {i}", body="Body", user=self.user)
+        other_ticket = Ticket.objects.create(title="Other ticket", user=self.other)
+        Review.objects.create(ticket=other_ticket, rating=2, headline="Other review", user=self.other)
+        self.client.force_login(self.user)
+
+    def get_all_pages(self, url_name):
+        pages, url = [], reverse(url_name)
+        while url:
+            response = self.client.get(url)
+            pages.append([str(post.pk) for post in response.context["object_list"]])
+            next_cursor = response.context["next_cursor"]
+            url = f"{reverse(url_name)}?{urlencode({'before': next_cursor})}" if next_cursor else None
+        return pages, response.context["object_list"]
+
+    def test_pages_of_the_user_posts(self):
+        for url_name, model in (("reviews:ticket-list", Ticket), ("reviews:review-list", Review)):
+            with self.subTest(url_name=url_name):
+                pages, _ = self.get_all_pages(url_name)
+                expected = [str(pk) for pk in model.objects.filter(user=self.user).order_by("-id").values_list(
+                    "pk", flat=True)]
+                self.assertEqual(pages, [expected[:2], expected[2:]])
+
+    def test_large_columns_are_deferred(self):
+        _, tickets = self.get_all_pages("reviews:ticket-list")
+        self.assertEqual(tickets[0].get_deferred_fields(), {"description"})
+        _, reviews = self.get_all_pages("reviews:review-list")
+        self.assertEqual(reviews[0].get_deferred_fields(), {"body"})
+
+    def test_anonymous_users_are_redirected(self):
+        self.client.logout()
+        self.assertRedirects(self.client.get(reverse("reviews:ticket-list")), reverse("reviews:connection"))
+
+
+@skipUnless(connection.vendor == "sqlite", "The query plans are checked with SQLite")
+class FeedIndexTests(ReviewsTestCase):
+    """The feed and follow queries must be served by the indexes of the migration 0003_feed_indexes."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+
+    def assertUsesIndexes(self, queryset, *index_names):
+        plan = queryset.explain()
+        for index_name in index_names:
+            self.assertIn(f"INDEX {index_name} ", plan)
+        self.assertNotRegex(plan, r"SCAN (reviews_|U\d)", f"Full table scan in the query plan:\n{plan}")
+
+    def test_home_feed_uses_indexes(self):
+        rows = feed.get_feed_rows(Ticket.get_users_viewable_tickets(self.user),
+                                  Review.get_users_viewable_reviews(self.user))
+        self.assertUsesIndexes(rows[:20], "ticket_user_time_idx", "review_user_time_idx", "review_ticket_time_idx")
+
+    def test_own_posts_feed_uses_indexes(self):
+        rows = feed.get_feed_rows(Ticket.get_tickets_created_by_user(self.user),
+                                  Review.get_reviews_posted_by_user(self.user))
+        self.assertUsesIndexes(rows[:20], "ticket_user_time_idx", "review_user_time_idx")
+
+    def test_post_lists_use_indexes(self):
+        cursor = feed.encode_cursor({"content_type": feed.TICKET, "id": 10, "time_created": timezone.now()})
+        request = RequestFactory().get("/", {"before": cursor})
+        request.user = self.user
+        for view_class, index_name in ((TicketListView, "ticket_user_time_idx"),
+                                       (ReviewListView, "review_user_time_idx")):
+            view = view_class()
+            view.setup(request)
+            posts = view.get_queryset()[:20]
+            self.assertUsesIndexes(posts, index_name)
+            self.assertNotIn("TEMP B-TREE", posts.explain())  # Read in the order of the index
+
+    def test_timeline_uses_index(self):
+        entries = FeedEntry.objects.filter(user=self.user).order_by("-time_created", "-content_type", "-post_id")
+        self.assertUsesIndexes(entries[:20], "feedentry_timeline_idx")
+
+    def test_follow_lookups_use_indexes(self):
+        self.assertUsesIndexes(UserFollows.get_followed_user_follows_from_user(self.user),
+                               "userfollows_followed_user_idx")
+        self.assertUsesIndexes(UserFollows.get_follower_ids(self.user.id), "userfollows_followed_user_idx")
+        self.assertUsesIndexes(UserFollows.get_following_user_follows_from_user(self.user))
+
+
+@override_settings(REVIEWS_FEED_PAGE_SIZE=50, REVIEWS_FEED_CACHE=None)
+class FeedTemplateQueryTests(ReviewsTestCase):
+    """Rendering a feed page must run a fixed number of queries, whatever the posts displayed."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        writers = create_followed_users(self.user, 5)
+        for i in range(25):
+            writer = writers[i % 5]
+            ticket = Ticket.objects.create(title=f"Ticket {i}", user=self.user if i % 2 else writer)
+            Review.objects.create(ticket=ticket, rating=4, headline=f"Review {i}", user=writer)
+        self.client.force_login(self.user)
+
+    def assertPageQueries(self, url_name, expected_queries, expected_posts=50):
+        # User (the session is read from the cache), then the feed queries: the validators (see conditional module)
+        # are read from the feed cache
+        with self.assertNumQueries(expected_queries):
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(len(response.context["posts"]), expected_posts)
+
+    def test_home_page(self):
+        self.assertPageQueries("reviews:home", 1 + 3)
+
+    def test_home_page_in_timeline_mode(self):
+        call_command("rebuild_feed", stdout=StringIO())
+        with self.settings(REVIEWS_FEED_TIMELINE=True):
+            self.assertPageQueries("reviews:home", 1 + 1)
+
+    def test_own_posts_page(self):
+        Review.objects.bulk_create([
+            Review(ticket=ticket, rating=1, headline="Own review", user=self.user) for ticket in Ticket.objects.all()])
+        self.assertPageQueries("reviews:own-posts", 1 + 3, expected_posts=12 + 25)
+
+
+def make_image_file(name="cover.jpg", size=(1600, 1200), image_format="JPEG"):
+    """Build an uploaded image file."""
+
+    output = BytesIO()
+    Image.new("RGB", size, color=(120, 40, 200)).save(output, format=image_format)
+    return SimpleUploadedFile(name, output.getvalue(), content_type=f"image/{image_format.lower()}")
+
+
+class MediaTestCase(ReviewsTestCase):
+    """Base class of the tests which store files: the media files are written in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+
+
+class ImageVariantTests(MediaTestCase):
+    """Resized variants of the ticket images are created on upload and used by the templates."""
+
+    def test_variants_are_created_on_upload(self):
+        ticket = Ticket.objects.create(title="Cover", user=self.user, image=make_image_file())
+        self.assertTrue(images.has_variants(ticket.image.name))
+        for variant, max_size in images.VARIANT_SIZES.items():
+            for webp in (False, True):
+                with default_storage.open(images.get_variant_name(ticket.image.name, variant, webp)) as variant_file:
+                    width, height = Image.open(variant_file).size
+                self.assertLessEqual(width, max_size[0])
+                self.assertLessEqual(height, max_size[1])
+
+    def test_templates_use_the_variants(self):
+        ticket = Ticket.objects.create(title="Cover", user=self.user, image=make_image_file())
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("reviews:home"))
+        self.assertContains(response, default_storage.url(images.get_variant_name(ticket.image.name, "feed")))
+        self.assertContains(response, 'type="image/webp"')
+        response = self.client.get(reverse("reviews:ticket-detail", kwargs={"pk": ticket.pk}))
+        self.assertContains(response, default_storage.url(images.get_variant_name(ticket.image.name, "detail")))
+
+    def test_variants_are_only_created_when_the_image_changes(self):
+        ticket = Ticket.objects.create(title="Cover", user=self.user, image=make_image_file())
+        images.delete_variants(ticket.image.name)
+        default_storage.delete(ticket.image.name)  # Missing original
+        ticket.title = "Updated"
+        ticket.save()
+        self.assertFalse(images.has_variants(ticket.image.name))
+
+    def test_unreadable_image_does_not_prevent_the_save(self):
+        name = default_storage.save("images/broken.jpg", ContentFile(b"not an image"))
+        with self.assertLogs("reviews.signals", "WARNING"):
+            ticket = Ticket.objects.create(title="Broken", user=self.user, image=name)
+        with self.assertLogs("reviews.signals", "WARNING"):
+            ticket.image = "images/missing.jpg"
+            ticket.save()
+        self.assertEqual(Ticket.objects.get(pk=ticket.pk).image.name, "images/missing.jpg")
+
+    def test_regenerate_command(self):
+        ticket = Ticket.objects.create(title="Cover", user=self.user, image=make_image_file())
+        images.delete_variants(ticket.image.name)
+        self.assertFalse(images.has_variants(ticket.image.name))
+        call_command("regenerate_image_variants", workers=2, stdout=StringIO())
+        self.assertTrue(images.has_variants(ticket.image.name))
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    """The ticket images are stored once by content, the duplicates and the orphans are removed by commands."""
+
+    def test_identical_uploads_are_stored_once(self):
+        first = Ticket.objects.create(title="First", user=self.user, image=make_image_file("cover.jpg"))
+        second = Ticket.objects.create(title="Second", user=self.user, image=make_image_file("other_name.jpg"))
+        third = Ticket.objects.create(title="Third", user=self.user, image=make_image_file(size=(10, 10)))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, third.image.name)
+        self.assertTrue(is_blob_name(first.image.name))
+        self.assertEqual(len(list(walk_files("images"))), 2)
+
+    def test_reused_blob_is_kept_by_gc_media(self):
+        ticket = Ticket.objects.create(title="First", user=self.user, image=make_image_file())
+        path = default_storage.path(ticket.image.name)
+        os.utime(path, (time.time() - 7200, time.time() - 7200))
+        ticket.delete()
+        # The orphaned blob is uploaded again: gc_media must not remove it before the ticket is saved
+        self.assertEqual(default_storage.save("images/cover.jpg", make_image_file()), ticket.image.name)
+        call_command("gc_media", grace_minutes=60, stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+    def test_dedup_media_command(self):
+        content = make_image_file().read()
+        for name in ("images/Cover.jpg", "images/Cover_a1B2c3D.jpg", "images/Other.jpg"):
+            path = os.path.join(default_storage.path(""), name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as image_file:
+                image_file.write(content if "Cover" in name else content + b"different")
+            Ticket.objects.create(title=name, user=self.user, image=name)
+        time_updated = timezone.now()
+
+        call_command("dedup_media", stdout=StringIO())
+        self.assertFalse(Ticket.objects.filter(time_updated__lt=time_updated).exists())
+        image_names = set(Ticket.objects.values_list("image", flat=True))
+        self.assertEqual(len(image_names), 2)
+        self.assertTrue(all(is_blob_name(name) and default_storage.exists(name) for name in image_names))
+        self.assertEqual(sorted(walk_files("images")), sorted(image_names))
+
+    def test_gc_media_command(self):
+        ticket = Ticket.objects.create(title="Cover", user=self.user, image=make_image_file())
+        kept = Ticket.objects.create(title="Kept", user=self.user, image=make_image_file(size=(20, 20)))
+        name = ticket.image.name
+        ticket.delete()
+
+        call_command("gc_media", grace_minutes=60, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))  # Too recent
+        call_command("gc_media", grace_minutes=-1, stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(images.get_variant_name(name, "feed")))
+        self.assertTrue(default_storage.exists(kept.image.name))
+
+
+class ImageUploadHandlerTests(MediaTestCase):
+    """The uploaded images are validated while they are received, before being decoded."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def create_ticket(self, image_file):
+        return self.client.post(reverse("reviews:ticket-create"), {"title": "Cover", "image": image_file})
+
+    def test_valid_image_is_accepted(self):
+        response = self.create_ticket(make_image_file())
+        self.assertRedirects(response, reverse("reviews:home"))
+        self.assertTrue(Ticket.objects.get().image)
+
+    @override_settings(REVIEWS_UPLOAD_MAX_PIXELS=1000 * 1000)
+    def test_too_many_pixels(self):
+        response = self.create_ticket(make_image_file(size=(2000, 1000), image_format="PNG"))
+        self.assertFormError(response, "form", "image", "L'image doit avoir au plus 1000000 pixels.")
+        self.assertFalse(Ticket.objects.exists())
+
+    @override_settings(REVIEWS_UPLOAD_MAX_SIZE=100 * 1024)
+    def test_too_large_file(self):
+        image_file = SimpleUploadedFile("cover.jpg", make_image_file().read() + b"\0" * 200 * 1024)
+        response = self.create_ticket(image_file)
+        self.assertFormError(response, "form", "image", f"Le fichier doit faire au plus {filesizeformat(100 * 1024)}.")
+
+    def test_not_an_image(self):
+        response = self.create_ticket(SimpleUploadedFile("cover.jpg", b"not an image" * 100))
+        self.assertFormError(response, "form", "image", "Le fichier n'est pas une image.")
+
+    def test_rejection_is_displayed_with_the_review_form(self):
+        response = self.client.post(reverse("reviews:review-create"), {
+            "new_ticket_review": "new_ticket_review", "title": "Cover", "headline": "Review", "rating": "3",
+            "image": SimpleUploadedFile("cover.jpg", b"not an image")})
+        self.assertContains(response, "Le fichier n&#x27;est pas une image.")
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_header_is_read_without_the_rest_of_the_image(self):
+        data = make_image_file(size=(3000, 2000)).read()
+        self.assertEqual(read_image_header(data[:2048]), ("JPEG", (3000, 2000)))
+        self.assertIsNone(read_image_header(data[:10]))
+
+
+class Jinja2TemplateTests(MediaTestCase):
+    """The Jinja2 versions of the feed templates display the same pages as the Django ones."""
+
+    def setUp(self):
+        super().setUp()
+        writer = create_followed_users(self.user, 1)[0]
+        ticket = Ticket.objects.create(title="Cover <b>", description="Book", user=writer, image=make_image_file())
+        Ticket.objects.create(title="Own ticket", user=self.user)
+        Review.objects.create(ticket=ticket, rating=3, headline="Review", body="Text", user=self.user)
+        self.client.force_login(self.user)
+
+    def get_page(self, url_name, engine):
+        feed_cache.clear()
+        with self.settings(REVIEWS_TEMPLATE_ENGINE=engine):
+            content = self.client.get(reverse(url_name)).content.decode()
+        # The CSRF tokens are masked differently at each request, the whitespace differs between the engines
+        return re.sub(r"\s+", "", re.sub(r'name="csrfmiddlewaretoken" value="\w+"', "", content))
+
+    def test_pages_are_the_same_with_both_engines(self):
+        for url_name in ("reviews:home", "reviews:own-posts"):
+            with self.subTest(url_name=url_name):
+                content = self.get_page(url_name, "jinja2")
+                self.assertIn("Cover&lt;b&gt;", content)
+                self.assertEqual(content, self.get_page(url_name, "django"))
+
+    def test_fragments_are_cached(self):
+        self.get_page("reviews:home", "jinja2")
+        hits = fragment_cache.get_stats()["hits"]
+        self.get_page("reviews:home", "jinja2")
+        self.assertEqual(fragment_cache.get_stats()["hits"], hits + 3)  # The 2 tickets and the review
+
+    @override_settings(REVIEWS_TEMPLATE_ENGINE="jinja2")
+    def test_feed_queries(self):
+        # User, then the feed queries: the Jinja2 templates run no query either
+        with self.assertNumQueries(1 + 3):
+            self.client.get(reverse("reviews:home"))
+
+
+@override_settings(REVIEWS_FEED_PAGE_SIZE=4, REVIEWS_FEED_CACHE=None)
+class HomeAsyncViewTests(TransactionTestCase):
+    """The async Home page loads tickets and reviews in other threads, so the data must be committed."""
+
+    databases = "__all__"  # With a replica, the reads of the requests go to it (test mirror of the primary)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        followed_user = create_followed_users(self.user, 1)[0]
+        for i in range(5):
+            ticket = Ticket.objects.create(title=f"Ticket {i}", user=followed_user if i % 2 else self.user)
+            Review.objects.create(ticket=ticket, rating=2, headline=f"Review {i}", user=followed_user)
+
+    def get_pages(self, url_name):
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(reverse(url_name), {"before": cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            pages.append([(post.content_type, post.pk) for post in response.context["posts"]])
+            cursor = response.context["next_cursor"]
+            if cursor is None:
+                return pages
+
+    def test_async_home_page_matches_home_page(self):
+        self.client.force_login(self.user)
+        pages = self.get_pages("reviews:home-async")
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual(pages, self.get_pages("reviews:home"))
+
+    def test_anonymous_user_is_redirected(self):
+        self.assertRedirects(self.client.get(reverse("reviews:home-async")), reverse("reviews:connection"))
+
+
+class FeedApiTests(ReviewsTestCase):
+    """The feeds are streamed in JSON, read from the database by chunks."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed = create_followed_users(self.user, 1)[0]
+        for i in range(7):
+            ticket = Ticket.objects.create(title=f"Ticket {i}", user=self.user if i % 2 else self.followed)
+            Review.objects.create(ticket=ticket, rating=i % 6, headline=f"Review {i}", user=self.followed)
+        self.client.force_login(self.user)
+
+    def get_json(self, url_name):
+        response = self.client.get(reverse(url_name))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/json")
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_home_feed(self):
+        posts = self.get_json("reviews:api-feed")
+        self.assertEqual(len(posts), 14)
+        self.assertEqual([post["time_created"] for post in posts],
+                         sorted((post["time_created"] for post in posts), reverse=True))
+        review = next(post for post in posts if post["type"] == "REVIEW")
+        self.assertEqual(set(review["ticket"]), {"id", "title", "user"})
+
+    def test_own_posts(self):
+        posts = self.get_json("reviews:api-own-posts")
+        self.assertEqual({(post["type"], post["user"]) for post in posts}, {("TICKET", "reader")})
+        self.assertEqual(len(posts), 3)
+
+    def test_posts_are_read_by_chunks(self):
+        tickets = Ticket.get_users_viewable_tickets(self.user)
+        reviews = Review.get_users_viewable_reviews(self.user)
+        with CaptureQueriesContext(connection) as context:
+            posts = list(feed.iter_feed_posts(tickets, reviews, chunk_size=5))
+        self.assertEqual(len(posts), 14)
+        # The rows are read once, and the posts are loaded by chunks of 5 rows
+        self.assertLessEqual(len(context.captured_queries), 1 + 2 * 3)
+
+    def test_anonymous_user(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("reviews:api-feed")).status_code, 403)
+
+
+class ImportExportTests(ReviewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "data.jsonl")
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed = create_followed_users(self.user, 2)
+        for i in range(5):
+            ticket = Ticket.objects.create(title=f"Ticket {i}", user=self.followed[i % 2])
+            Ticket.objects.filter(pk=ticket.pk).update(image=f"images/{i}.jpg")  # Image reference only
+            Review.objects.create(ticket=ticket, rating=i, headline=f"Review {i}", body="Très bien", user=self.user)
+        Ticket.objects.update(time_created=timezone.now() - timedelta(days=30))
+
+    def get_posts(self):
+        tickets = Ticket.objects.order_by("title").values_list("title", "image", "user__username", "time_created")
+        reviews = Review.objects.order_by("headline").values_list(
+            "headline", "body", "rating", "ticket__title", "user__username", "time_created")
+        follows = UserFollows.objects.order_by("followed_user__username").values_list(
+            "user__username", "followed_user__username")
+        return list(tickets), list(reviews), list(follows)
+
+    def export_and_delete(self):
+        call_command("export_jsonl", self.path, stderr=StringIO())
+        posts = self.get_posts()
+        Ticket.objects.all().delete()
+        UserFollows.objects.all().delete()
+        User.objects.exclude(pk=self.user.pk).delete()
+        return posts
+
+    def test_export_then_import(self):
+        posts = self.export_and_delete()
+        with open(self.path, encoding="utf-8") as data_file:
+            self.assertEqual(len(data_file.readlines()), 12)
+        call_command("import_jsonl", self.path, "--batch-size", "4", stdout=StringIO())
+        self.assertEqual(self.get_posts(), posts)
+        self.assertFalse(User.objects.get(username="followed_0").has_usable_password())
+
+    def test_import_resumes_after_the_last_batch(self):
+        posts = self.export_and_delete()
+        with open(self.path, encoding="utf-8") as data_file:
+            lines = data_file.readlines()
+        # A first import stopped after the batch of the 5 tickets
+        partial_path = os.path.join(self.directory, "partial.jsonl")
+        with open(partial_path, "w", encoding="utf-8") as partial_file:
+            partial_file.writelines(lines[:5])
+        call_command("import_jsonl", partial_path, "--batch-size", "5",
+                     "--checkpoint", os.path.abspath(self.path), stdout=StringIO())
+        self.assertEqual(Ticket.objects.count(), 5)
+
+        call_command("import_jsonl", self.path, "--batch-size", "5", stdout=StringIO())
+        self.assertEqual(self.get_posts(), posts)
+
+    def test_failed_batch_is_imported_again_without_duplicates(self):
+        posts = self.export_and_delete()
+        import_follows = import_jsonl.Command.import_follows
+
+        def fail_on_follows(command, records):
+            import_follows(command, records)
+            if records:
+                raise RuntimeError("Import stopped")
+
+        # The import stops in the last batch (lines 11-12, the follows): its rows and its checkpoint are rolled back
+        with mock.patch.object(import_jsonl.Command, "import_follows", fail_on_follows), \
+                self.assertRaises(RuntimeError):
+            call_command("import_jsonl", self.path, "--batch-size", "5", stdout=StringIO())
+        self.assertEqual(Ticket.objects.count(), 5)
+        self.assertEqual(ImportCheckpoint.objects.count(), 2)
+
+        call_command("import_jsonl", self.path, "--batch-size", "5", stdout=StringIO())
+        self.assertEqual(self.get_posts(), posts)
+
+
+class SyntheticDataTests(ReviewsTestCase):
+    def test_generated_graph(self):
+        counts = generate_social_graph(users=200, mean_follows=10, seed=1)
+        self.assertEqual(counts["users"], User.objects.count())
+        self.assertEqual(counts["follows"], UserFollows.objects.count())
+        self.assertEqual(counts["reviews"], Review.objects.count())
+        # Power law: the first user is followed by far more users than the median user
+        follower_counts = sorted(User.objects.annotate(count=Count("followed_by")).values_list("count", flat=True))
+        self.assertEqual(User.objects.annotate(count=Count("followed_by")).order_by("-count")[0].username, "user_0")
+        self.assertGreater(follower_counts[-1], 5 * follower_counts[len(follower_counts) // 2])
+        # The reviews are written after their ticket, the posts are spread over the period
+        self.assertFalse(Review.objects.filter(time_created__lt=F("ticket__time_created")).exists())
+        self.assertLess(Ticket.objects.earliest("time_created").time_created, timezone.now() - timedelta(days=300))
+
+    def test_same_seed_same_graph(self):
+        first = generate_social_graph(users=50, seed=2)
+        self.assertEqual(generate_social_graph(users=50, seed=2), first)
+
+    def test_find_regressions(self):
+        baseline = {"home": {"p50_ms": 10.0, "queries": 4, "peak_memory_kb": 100.0}}
+        results = {"home": {"p50_ms": 12.0, "queries": 5, "peak_memory_kb": 200.0}, "new": {"queries": 9}}
+        regressions = find_regressions(results, baseline, 0.25, ("p50_ms", "queries", "peak_memory_kb"))
+        self.assertEqual([message.split(" ")[1] for message in regressions], ["queries", "peak_memory_kb"])
+
+
+@override_settings(ALLOWED_HOSTS=["localhost"])
+class LoadTestTests(ReviewsTestCase):
+    def setUp(self):
+        super().setUp()
+        from book_review.wsgi import application
+
+        User.objects.create_user(username="writer", password=PASSWORD)
+        User.objects.create_user(username="reader", password=PASSWORD)
+        self.user = VirtualUser(application, "writer", ["reader"], random.Random(0))
+
+    def test_operations_go_through_the_login_and_csrf_checks(self):
+        for operation in ("login", "feed", "ticket", "review", "follow"):
+            self.user.run_operation(operation)
+        self.assertEqual([success for _, success, _, _ in self.user.records], [True] * 5)
+        self.assertEqual(Ticket.objects.filter(user__username="writer").count(), 2)
+        self.assertEqual(Review.objects.filter(user__username="writer").count(), 1)
+        self.assertTrue(UserFollows.objects.filter(user__username="writer", followed_user__username="reader").exists())
+
+    def test_post_without_csrf_token_fails(self):
+        self.user.run_operation("login")
+        del self.user.cookies.cookies["csrftoken"]
+        self.user.run_operation("ticket")
+        self.assertFalse(self.user.records[-1][1])
+
+    def test_lock_errors_are_counted(self):
+        _local.lock_errors = 0
+        try:
+            raise OperationalError("database is locked")
+        except OperationalError:
+            count_lock_error(sender=None)
+        try:
+            raise OperationalError("no such table")
+        except OperationalError:
+            count_lock_error(sender=None)
+        self.assertEqual(_local.lock_errors, 1)
+
+    def test_histogram(self):
+        buckets = histogram([0.001, 0.004, 0.2, 9])
+        self.assertEqual((buckets["<=5ms"], buckets["<=250ms"], buckets[">5000ms"]), (2, 1, 1))
+
+
+class MetricsTests(ReviewsTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        for i in range(3):
+            Ticket.objects.create(title=f"Ticket {i}", user=self.user)
+        self.client.force_login(self.user)
+
+    def get_metrics(self):
+        with self.settings(REVIEWS_METRICS_PUBLIC=True):
+            return self.client.get(reverse("reviews:metrics")).content.decode()
+
+    def get_sample(self, name, view):
+        text = self.get_metrics()
+        prefix = f'{name}{{view="{view}",method="GET"}} '
+        line = next(line for line in text.splitlines() if line.startswith(prefix))
+        return float(line[len(prefix):])
+
+    def test_request_metrics_by_view(self):
+        response = self.client.get(reverse("reviews:home"))
+        self.assertEqual(self.get_sample("reviews_request_duration_seconds_count", "reviews:home"), 1)
+        self.assertGreater(self.get_sample("reviews_request_queries_sum", "reviews:home"), 0)
+        self.assertGreater(self.get_sample("reviews_request_sql_duration_seconds_sum", "reviews:home"), 0)
+        self.assertGreater(self.get_sample("reviews_request_template_duration_seconds_sum", "reviews:home"), 0)
+        self.assertEqual(self.get_sample("reviews_response_size_bytes_sum", "reviews:home"), len(response.content))
+
+    def test_streamed_response_is_recorded_when_it_ends(self):
+        response = self.client.get(reverse("reviews:api-feed"))
+        self.assertNotIn("reviews:api-feed", metrics.registry.render())
+        size = len(b"".join(response.streaming_content))
+        self.assertEqual(self.get_sample("reviews_response_size_bytes_sum", "reviews:api-feed"), size)
+        self.assertGreater(self.get_sample("reviews_request_queries_sum", "reviews:api-feed"), 0)
+
+    def test_feed_cache_counters(self):
+        self.client.get(reverse("reviews:home"))
+        self.client.get(reverse("reviews:home"))
+        text = self.get_metrics()
+        self.assertIn("reviews_feed_cache_hits_total 1\n", text)
+        self.assertIn("reviews_feed_cache_misses_total 1\n", text)
+        # Snippets of the 3 tickets and their information, which is not read again when the snippet is cached
+        self.assertIn("reviews_fragment_cache_hits_total 3\n", text)
+        self.assertIn("reviews_fragment_cache_misses_total 6\n", text)
+
+    @override_settings(REVIEWS_METRICS_TOKEN="scraper-token")
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse("reviews:metrics")).status_code, 401)
+        response = self.client.get(reverse("reviews:metrics"), HTTP_AUTHORIZATION="Bearer wrong-token")
+        self.assertEqual(response.status_code, 401)
+        self.client.logout()
+        response = self.client.get(reverse("reviews:metrics"), HTTP_AUTHORIZATION="Bearer scraper-token")
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_are_private_by_default(self):
+        self.assertEqual(self.client.get(reverse("reviews:metrics")).status_code, 401)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("reviews:metrics")).status_code, 401)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("reviews:metrics")).status_code, 200)
+
+    def test_public_metrics(self):
+        self.client.logout()
+        with self.settings(REVIEWS_METRICS_PUBLIC=True):
+            self.assertEqual(self.client.get(reverse("reviews:metrics")).status_code, 200)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 10))
+        for value in (0, 1, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples("size", 'view="x"')), [
+            'size_bucket{view="x",le="1"} 2', 'size_bucket{view="x",le="10"} 3', 'size_bucket{view="x",le="+Inf"} 4',
+            'size_sum{view="x"} 56', 'size_count{view="x"} 4'])
+
+
+# Maximal number of queries and SQL time (ms) of a GET request of each route, on the dataset of QueryBudgetTests.
+# The number of queries must not depend on the number of posts: a new lookup in a feed template (e.g. post.user
+# without select_related) makes the feed pages exceed their budget.
+QUERY_BUDGETS = {
+    "reviews:connection": Budget(queries=1, sql_ms=20),
+    "reviews:register": Budget(queries=1, sql_ms=20),
+    "reviews:logout": Budget(queries=3, sql_ms=20),
+    "reviews:home": Budget(queries=5, sql_ms=50),
+    "reviews:ticket-create": Budget(queries=1, sql_ms=20),
+    "reviews:ticket-list": Budget(queries=2, sql_ms=20),
+    "reviews:ticket-detail": Budget(queries=4, sql_ms=20),
+    "reviews:ticket-update": Budget(queries=2, sql_ms=20),
+    "reviews:ticket-delete": Budget(queries=2, sql_ms=20),
+    "reviews:review-create": Budget(queries=1, sql_ms=20),
+    "reviews:review-list": Budget(queries=2, sql_ms=20),
+    "reviews:review-detail": Budget(queries=6, sql_ms=20),
+    "reviews:review-update": Budget(queries=4, sql_ms=20),
+    "reviews:review-delete": Budget(queries=2, sql_ms=20),
+    "reviews:own-posts": Budget(queries=5, sql_ms=50),
+    "reviews:user-follows": Budget(queries=3, sql_ms=20),
+    "reviews:user-follows-delete": Budget(queries=3, sql_ms=20),
+    "reviews:api-feed": Budget(queries=5, sql_ms=50),
+    "reviews:api-own-posts": Budget(queries=5, sql_ms=50),
+    "reviews:feed-cache-stats": Budget(queries=1, sql_ms=20),
+    "reviews:metrics": Budget(queries=1, sql_ms=20),
+    "reviews:ticket-top": Budget(queries=2, sql_ms=20),
+    "reviews:search": Budget(queries=4, sql_ms=50),
+    "reviews:api-search": Budget(queries=4, sql_ms=50),
+}
+# Routes without budget, and why
+UNBUDGETED_ROUTES = {
+    "reviews:home-async": "its queries run in other threads (see HomeAsyncViewTests)",
+}
+
+
+class QueryBudgetTests(ReviewsTestCase):
+    """Each route of reviews/urls.py must stay within its budget of QUERY_BUDGETS."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="secret-password", is_staff=True)
+        followed_users = create_followed_users(cls.user, 3)
+        for i, author in enumerate([cls.user, *followed_users] * 4):
+            ticket = Ticket.objects.create(title=f"Ticket {i}", description="Description", user=author)
+            reviewer = followed_users[i % 3] if author == cls.user else cls.user
+            Review.objects.create(ticket=ticket, rating=i % 6, headline=f"Review {i}", body="Body", user=reviewer)
+        cls.ticket = Ticket.objects.filter(user=cls.user).first()
+        cls.review = Review.objects.filter(user=cls.user).first()
+        cls.user_follows = UserFollows.objects.filter(user=cls.user).first()
+
+    def get_url(self, url_name):
+        pattern_name = url_name.split(":")[1]
+        if pattern_name.startswith("ticket-") and pattern_name not in ("ticket-create", "ticket-list", "ticket-top"):
+            return reverse(url_name, args=[self.ticket.pk])
+        if pattern_name.startswith("review-") and pattern_name not in ("review-create", "review-list"):
+            return reverse(url_name, args=[self.review.pk])
+        if pattern_name == "user-follows-delete":
+            return reverse(url_name, args=[self.user_follows.pk])
+        if pattern_name in ("search", "api-search"):
+            return f"{reverse(url_name)}?q=review"
+        return reverse(url_name)
+
+    def test_every_route_has_a_budget(self):
+        url_names = {f"{urls.app_name}:{pattern.name}" for pattern in urls.urlpatterns}
+        self.assertEqual(url_names - QUERY_BUDGETS.keys() - UNBUDGETED_ROUTES.keys(), set())
+
+    def check_budgets(self):
+        for url_name, budget in QUERY_BUDGETS.items():
+            with self.subTest(url_name):
+                for cache in caches.all():
+                    cache.clear()
+                self.client.force_login(self.user)
+                with query_budget(budget, url_name):
+                    response = self.client.get(self.get_url(url_name))
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                self.assertLess(response.status_code, 400)
+
+    def test_routes_are_within_their_budget(self):
+        self.check_budgets()
+
+    def test_budgets_do_not_depend_on_the_number_of_posts(self):
+        authors = list(User.objects.all())
+        for i in range(30):
+            ticket = Ticket.objects.create(title=f"More {i}", user=authors[i % len(authors)])
+            Review.objects.create(ticket=ticket, rating=3, headline=f"More {i}", user=authors[(i + 1) % len(authors)])
+        self.check_budgets()
+
+
+class DatabaseProfileTests(ReviewsTestCase):
+    def test_production_pragmas(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class Connection:  # New SQLite connection, as given by the connection_created signal
+            vendor = "sqlite"
+            connection = sqlite3.connect(os.path.join(directory, "db.sqlite3"))
+
+        with self.settings(REVIEWS_DATABASE_PROFILE="production"):
+            database.apply_pragmas(Connection)
+        self.assertEqual(Connection.connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(Connection.connection.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+        Connection.connection.close()
+
+    def test_write_lock_serializes_the_writers(self):
+        events = []
+
+        def write():
+            with database.write_lock():
+                events.append("second writer")
+
+        with database.write_lock():
+            writer = threading.Thread(target=write)
+            writer.start()
+            time.sleep(0.1)
+            events.append("first writer")
+        writer.join()
+        self.assertEqual(events, ["first writer", "second writer"])
+
+
+@override_settings(REVIEWS_DATABASE_PROFILE="production")
+class WriteSerializationTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="writer", password="secret")
+
+    def run_in_thread(self, target):
+        """Run a function in a new thread (with its own connection), return the thread and its events."""
+
+        events = []
+
+        def run():
+            try:
+                target()
+                events.append("done")
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, events
+
+    def test_transactions_hold_the_write_lock_until_they_end(self):
+        self.assertFalse(database._thread_lock.locked())
+        with transaction.atomic():
+            self.assertTrue(connection.holds_write_lock)
+            Ticket.objects.create(title="Livre", user=self.user)
+        self.assertFalse(database._thread_lock.locked())
+        with self.assertRaises(ValueError), transaction.atomic():
+            Ticket.objects.create(title="Livre", user=self.user)
+            raise ValueError
+        self.assertFalse(database._thread_lock.locked())
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_writers_wait_for_the_write_lock(self):
+        with database.write_lock():
+            writer, events = self.run_in_thread(lambda: Ticket.objects.create(title="Livre", user=self.user))
+            time.sleep(0.1)
+            self.assertEqual(events, [])
+        writer.join()
+        self.assertEqual(events, ["done"])
+        self.assertFalse(database._thread_lock.locked())
+
+    def test_readers_do_not_wait_for_the_write_lock(self):
+        def read():
+            list(Ticket.objects.all())
+            Client().get(reverse("reviews:connection"))
+
+        with database.write_lock():
+            reader, events = self.run_in_thread(read)
+            reader.join(5)
+            self.assertEqual(events, ["done"])
+
+
+def get_writes(queries):
+    """Get the SQL of the captured queries which write in the database."""
+
+    return [query.sql for query in queries if not query.sql.lstrip().upper().startswith("SELECT")]
+
+
+class SessionTests(ReviewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.ticket = Ticket.objects.create(title="Ticket", user=create_followed_users(self.user, 1).get())
+        self.client.force_login(self.user)
+
+    def test_feed_pages_do_not_write_in_the_database(self):
+        for url_name in ("reviews:home", "reviews:own-posts", "reviews:api-feed"):
+            with self.subTest(url_name), query_budget(Budget(None, None)) as queries:
+                response = self.client.get(reverse(url_name))
+                if response.streaming:
+                    b"".join(response.streaming_content)
+            self.assertEqual(get_writes(queries), [])
+
+    def test_reply_to_a_ticket_without_session(self):
+        with query_budget(Budget(None, None)) as queries:
+            # The ticket to review is given in the URL of the link (not in the session)
+            url = f"{reverse('reviews:review-create')}?ticket={self.ticket.id}"
+            self.assertContains(self.client.get(reverse("reviews:home")), f'href="{url}"')
+            response = self.client.get(url)
+        self.assertEqual(get_writes(queries), [])
+        self.assertTrue(response.context["has_ticket"])
+        self.assertEqual(response.context["post"], self.ticket)
+        self.assertEqual(self.client.get(f"{reverse('reviews:review-create')}?ticket=0").status_code, 404)
+
+    def test_session_is_written_only_when_it_changes(self):
+        session = SessionStore()
+        session["page"] = 1
+        session.save()
+
+        session = SessionStore(session.session_key)
+        session["page"] = 2
+        session["page"] = 1  # Modified, but as saved
+        with self.assertNumQueries(0):
+            self.assertEqual(session["page"], 1)  # Read from the cache
+            session.save()
+        session["page"] = 2
+        with query_budget(Budget(None, None)) as queries:
+            session.save()
+        self.assertTrue(any(sql.startswith('UPDATE "django_session"') for sql in get_writes(queries)))
+
+        caches["sessions"].clear()
+        self.assertEqual(SessionStore(session.session_key)["page"], 2)  # Read from the database
+
+    def test_deleted_session(self):
+        session = SessionStore()
+        session["page"] = 1
+        session.save()
+        session.delete()
+        self.assertNotIn("page", SessionStore(session.session_key))
+        self.assertFalse(session.exists(session.session_key))
+
+
+class ConditionalGetTests(ReviewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed_user = create_followed_users(self.user, 1).get()
+        self.ticket = Ticket.objects.create(title="Ticket", user=self.followed_user)
+        self.client.force_login(self.user)
+
+    def get(self, url, etag=None, **headers):
+        if etag:
+            headers["HTTP_IF_NONE_MATCH"] = etag
+        return self.client.get(url, **headers)
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.templates, [])
+        return queries
+
+    def test_unchanged_home_page(self):
+        url = reverse("reviews:home")
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Last-Modified", response)  # The feeds are validated by their ETag only
+        self.assertIn("no-cache", response["Cache-Control"])
+        queries = self.assertNotModified(url, response["ETag"])
+        self.assertFalse(any("UNION" in query["sql"] for query in queries))  # No feed query
+
+    def test_home_page_changes(self):
+        url = reverse("reviews:home")
+        stranger = User.objects.create_user(username="stranger")
+        changes = [
+            lambda: Ticket.objects.create(title="New ticket", user=self.followed_user),
+            # The ticket snippet shows whether the ticket has reviews
+            lambda: Review.objects.create(ticket=self.ticket, rating=3, headline="Reply", user=stranger),
+            lambda: UserFollows.objects.create(user=self.user, followed_user=stranger),  # Follow set
+            lambda: Ticket.objects.get(title="New ticket").delete(),
+        ]
+        etag = self.get(url)["ETag"]
+        for change in changes:
+            with self.captureOnCommitCallbacks(execute=True):  # The feed version changes after the commit
+                change()
+            response = self.get(url, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            etag = response["ETag"]
+
+    def test_ticket_of_a_review_changes(self):
+        # A followed user reviews the ticket of a stranger: the Home page shows the ticket with the review
+        stranger = User.objects.create_user(username="stranger")
+        ticket = Ticket.objects.create(title="Stranger ticket", user=stranger)
+        Review.objects.create(ticket=ticket, rating=3, headline="Reply", user=self.followed_user)
+        url = reverse("reviews:home")
+        etag = self.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.title = "Updated"
+            ticket.save()
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_validators_cost_does_not_depend_on_the_feed(self):
+        url = reverse("reviews:home")
+        for count in (1, 50):
+            with self.subTest(posts=count):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Ticket.objects.bulk_create(
+                        [Ticket(title=f"Ticket {i}", user=self.followed_user) for i in range(count)])
+                    feed_cache.invalidate([self.user.pk])  # bulk_create sends no signal
+                etag = self.get(url)["ETag"]
+                with self.assertNumQueries(1):  # The user (the session and the version are read from the caches)
+                    self.assertEqual(self.get(url, etag).status_code, 304)
+
+    def test_feeds_are_not_conditional_without_feed_cache(self):
+        with self.settings(REVIEWS_FEED_CACHE=None):
+            self.assertNotIn("ETag", self.get(reverse("reviews:home")))
+
+    def test_feed_is_not_validated_by_date(self):
+        url = reverse("reviews:home")
+        other_ticket = Ticket.objects.create(title="Other ticket", user=self.followed_user)
+        self.get(url)
+        other_ticket.delete()  # The newest update time of the feed does not change
+        for url_name in ("reviews:home", "reviews:own-posts", "reviews:api-feed", "reviews:api-own-posts"):
+            with self.subTest(url_name):
+                response = self.get(reverse(url_name), HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("Last-Modified", response)
+
+    def test_etag_depends_on_the_user(self):
+        url = reverse("reviews:own-posts")
+        etag = self.get(url)["ETag"]
+        self.assertNotModified(url, etag)
+        self.client.force_login(self.followed_user)
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_detail_pages(self):
+        review = Review.objects.create(ticket=self.ticket, rating=3, headline="Review", user=self.user)
+        for url, post in ((reverse("reviews:ticket-detail", args=[self.ticket.pk]), self.ticket),
+                          (reverse("reviews:review-detail", args=[review.pk]), review)):
+            with self.subTest(url):
+                response = self.get(url)
+                self.assertNotModified(url, response["ETag"])
+                self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+                post.headline = post.title = "Updated"
+                post.save()
+                self.assertEqual(self.get(url, response["ETag"]).status_code, 200)
+        self.assertEqual(self.get(reverse("reviews:ticket-detail", args=[0])).status_code, 404)
+
+    def test_pages_with_messages_are_not_conditional(self):
+        User.objects.create_user(username="stranger")
+        self.client.post(reverse("reviews:user-follows"), {"will_follow_user": "stranger"})  # Message, redirect
+        response = self.get(reverse("reviews:home"))
+        self.assertNotIn("ETag", response)
+        self.assertContains(response, "Le suivi est effectué.")
+        self.assertIn("ETag", self.get(reverse("reviews:home")))
+
+
+class SearchTests(ReviewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.followed_user = create_followed_users(self.user, 1).get()
+        self.stranger = User.objects.create_user(username="stranger")
+        self.client.force_login(self.user)
+
+    def search(self, text, user=None):
+        return [(row["content_type"], row["id"]) for row in search_posts(text, user)]
+
+    def test_posts_are_indexed_by_the_triggers(self):
+        ticket = Ticket.objects.create(title="Harry Potter", description="Un roman de sorciers", user=self.user)
+        review = Review.objects.create(ticket=ticket, rating=5, headline="Magique", body="Une école de sorciers",
+                                       user=self.followed_user)
+        self.assertCountEqual(self.search("sorciers"), [("TICKET", ticket.id), ("REVIEW", review.id)])
+
+        Ticket.objects.filter(id=ticket.id).update(title="Le Seigneur des anneaux")  # No signal
+        Review.objects.bulk_create([Review(ticket=ticket, rating=4, headline="Anneaux", user=self.user)])
+        self.assertEqual(self.search("harry"), [])
+        self.assertEqual(len(self.search("anneaux")), 2)
+
+        ticket.delete()
+        self.assertEqual(self.search("anneaux sorciers"), [])
+
+    def test_ranking_and_words(self):
+        body_match = Ticket.objects.create(title="Roman", description="Un élève de Poudlard", user=self.user)
+        title_match = Ticket.objects.create(title="L'élève", description="Un roman", user=self.user)
+        self.assertEqual(self.search("ELEVE"), [("TICKET", title_match.id), ("TICKET", body_match.id)])
+        self.assertEqual(self.search("poud eleve"), [("TICKET", body_match.id)])  # Prefixes, all the words
+        self.assertEqual(self.search('roman" OR (NEAR'), [])  # The FTS5 syntax is ignored
+        self.assertEqual(self.search("  "), [])
+
+    def test_search_in_the_viewable_posts(self):
+        own_ticket = Ticket.objects.create(title="Dune", user=self.user)
+        followed_ticket = Ticket.objects.create(title="Dune, tome 2", user=self.followed_user)
+        stranger_ticket = Ticket.objects.create(title="Dune, tome 3", user=self.stranger)
+        reply = Review.objects.create(ticket=own_ticket, rating=3, headline="Dune", user=self.stranger)
+        self.assertCountEqual(self.search("dune", self.user),
+                              [("TICKET", own_ticket.id), ("TICKET", followed_ticket.id), ("REVIEW", reply.id)])
+        self.assertIn(("TICKET", stranger_ticket.id), self.search("dune"))
+
+        response = self.client.get(reverse("reviews:search"), {"q": "tome"})
+        self.assertEqual([post.id for post in response.context["posts"]], [followed_ticket.id])
+        response = self.client.get(reverse("reviews:search"), {"q": "tome", "scope": "all"})
+        self.assertEqual(len(response.context["posts"]), 2)
+        response = self.client.get(reverse("reviews:api-search"), {"q": "tome 3", "scope": "all"})
+        self.assertEqual([post["id"] for post in json.loads(b"".join(response.streaming_content))],
+                         [stranger_ticket.id])
+
+    def test_rebuild_index(self):
+        ticket = Ticket.objects.create(title="Fondation", user=self.user)
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER reviews_ticket_search_insert")  # As a migration which rebuilds the table
+            cursor.execute("DELETE FROM reviews_post_search")
+        Ticket.objects.create(title="Fondation et Empire", user=self.user)
+        self.assertEqual(self.search("fondation"), [])
+
+        stdout = StringIO()
+        call_command("rebuild_search_index", stdout=stdout)
+        self.assertIn("2 posts indexed", stdout.getvalue())
+        self.assertEqual(self.search("fondation")[0], ("TICKET", ticket.id))
+        Ticket.objects.create(title="Seconde Fondation", user=self.user)
+        self.assertEqual(len(self.search("fondation")), 3)
+
+
+class TicketStatsTests(ReviewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="reader", password="secret-password")
+        self.ticket = Ticket.objects.create(title="Ticket", user=self.user)
+
+    def assertStats(self, ticket, review_count, rating_sum, last_review=None):
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.review_count, ticket.rating_sum), (review_count, rating_sum))
+        self.assertEqual(ticket.last_reviewed_at, last_review.time_created if last_review else None)
+
+    def test_stats_follow_the_reviews(self):
+        first = Review.objects.create(ticket=self.ticket, rating=4, headline="First", user=self.user)
+        second = Review.objects.create(ticket=self.ticket, rating=1, headline="Second", user=self.user)
+        self.assertStats(self.ticket, 2, 5, second)
+        self.assertEqual(self.ticket.average_rating, 2.5)
+
+        second.rating = 3
+        second.save()
+        self.assertStats(self.ticket, 2, 7, second)
+
+        other_ticket = Ticket.objects.create(title="Other ticket", user=self.user)
+        second.ticket = other_ticket
+        second.save()
+        self.assertStats(self.ticket, 1, 4, first)
+        self.assertStats(other_ticket, 1, 3, second)
+
+        first.delete()
+        self.assertStats(self.ticket, 0, 0)
+        self.assertIsNone(self.ticket.average_rating)
+
+    def test_saving_a_ticket_keeps_the_stats(self):
+        edited_ticket = Ticket.objects.get(pk=self.ticket.pk)  # Loaded by the edit form, before the review
+        review = Review.objects.create(ticket=self.ticket, rating=4, headline="Review", user=self.user)
+        edited_ticket.title = "Updated"
+        edited_ticket.save()
+        self.assertStats(self.ticket, 1, 4, review)
+        self.assertEqual(self.ticket.title, "Updated")
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("reviews:ticket-update", args=[self.ticket.pk]),
+                                    {"title": "Updated again", "description": ""})
+        self.assertEqual(response.status_code, 302)
+        self.assertStats(self.ticket, 1, 4, review)
+        self.assertEqual(self.ticket.title, "Updated again")
+
+    def test_repair(self):
+        Review.objects.create(ticket=self.ticket, rating=2, headline="Review", user=self.user)
+        # No signal for a bulk insertion
+        Review.objects.bulk_create([Review(ticket=self.ticket, rating=5, headline="Bulk", user=self.user)])
+        Ticket.objects.create(title="Without review", user=self.user)
+
+        stdout = StringIO()
+        call_command("repair_ticket_stats", stdout=stdout)
+        self.assertIn("1 tickets repaired", stdout.getvalue())
+        self.assertStats(self.ticket, 2, 7, self.ticket.reviews.latest("time_created"))
+        call_command("repair_ticket_stats", stdout=stdout)
+        self.assertIn("0 tickets repaired", stdout.getvalue())
+
+    @override_settings(REVIEWS_FEED_PAGE_SIZE=2)
+    def test_top_tickets_pages(self):
+        ratings = {"A": [5, 5], "B": [5], "C": [4, 3, 2], "D": [1], "E": []}
+        for title, title_ratings in ratings.items():
+            ticket = Ticket.objects.create(title=title, user=self.user)
+            for rating in title_ratings:
+                Review.objects.create(ticket=ticket, rating=rating, headline=title, user=self.user)
+        self.client.force_login(self.user)
+
+        def get_titles(order):
+            titles, url = [], f"{reverse('reviews:ticket-top')}?order={order}"
+            while url:
+                response = self.client.get(url)
+                titles.extend(ticket.title for ticket in response.context["tickets"])
+                cursor = response.context["next_cursor"]
+                url = cursor and f"{reverse('reviews:ticket-top')}?{urlencode({'order': order, 'before': cursor})}"
+            return titles
+
+        self.assertEqual(get_titles("rating"), ["B", "A", "C", "D"])  # Same average: the newest first
+        self.assertEqual(get_titles("reviews"), ["C", "A", "D", "B"])
+
+
+@mock.patch.object(routers, "has_replica", return_value=True)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Routing of the reads: outside of TestCase, whose transaction would send all the reads to the primary."""
+
+    def get_read_database(self, request):
+        """Process a request with PrimaryPinningMiddleware, return the response and the database read by the view."""
+
+        read_databases = []
+
+        def view(request):
+            read_databases.append(routers.PrimaryReplicaRouter().db_for_read(Ticket))
+            return HttpResponse()
+
+        response = PrimaryPinningMiddleware(view)(request)
+        return response, read_databases[0]
+
+    def test_reads_of_the_requests_go_to_the_replica(self, has_replica):
+        response, read_database = self.get_read_database(RequestFactory().get("/"))
+        self.assertEqual(read_database, "replica")
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_writes_go_to_the_primary(self, has_replica):
+        router = routers.PrimaryReplicaRouter()
+        token = routers.pinned_to_primary.set(False)
+        try:
+            self.assertEqual(router.db_for_write(Ticket), "default")
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Ticket), "default")
+        finally:
+            routers.pinned_to_primary.reset(token)
+        self.assertEqual(router.db_for_read(Ticket), "default")  # Outside of the requests
+
+    def test_reads_stick_to_the_primary_after_a_write(self, has_replica):
+        response, read_database = self.get_read_database(RequestFactory().post("/"))
+        self.assertEqual(read_database, "default")
+        cookie = response.cookies[PRIMARY_PIN_COOKIE]
+        self.assertEqual(cookie["max-age"], routers.get_pin_seconds())
+
+        request = RequestFactory().get("/")
+        request.COOKIES[PRIMARY_PIN_COOKIE] = cookie.value
+        self.assertEqual(self.get_read_database(request)[1], "default")
+        request.COOKIES[PRIMARY_PIN_COOKIE] = str(time.time() - 1)  # Expired pin
+        self.assertEqual(self.get_read_database(request)[1], "replica")
+
+    def test_replication(self, has_replica):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary, replica = os.path.join(directory, "primary.sqlite3"), os.path.join(directory, "replica.sqlite3")
+        connection = sqlite3.connect(primary)
+        connection.execute("CREATE TABLE post (title TEXT)")
+        connection.execute("INSERT INTO post VALUES ('First')")
+        connection.commit()
+        copy_database(primary, replica)
+        connection.execute("INSERT INTO post VALUES ('Second')")
+        connection.commit()
+        connection.close()
+
+        connection = sqlite3.connect(replica)
+        self.assertEqual(connection.execute("SELECT title FROM post").fetchall(), [("First",)])
+        copy_database(primary, replica)
+        self.assertEqual(connection.execute("SELECT COUNT(*) FROM post").fetchone()[0], 2)
+        connection.close()
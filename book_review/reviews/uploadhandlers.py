@@ -0,0 +1,113 @@
+#! /usr/bin/venv python3
+# coding: utf-8
+"""Upload handler for book_review project.
+
+The only uploaded files are the ticket images. ImageUploadHandler streams them to a temporary file on disk
+and validates them while they arrive, before any decoding:
+- the size is checked on each chunk (REVIEWS_UPLOAD_MAX_SIZE setting),
+- the image header is parsed as soon as enough bytes are received, to check the format
+and the number of pixels (REVIEWS_UPLOAD_MAX_PIXELS setting).
+
+A rejected file is dropped at once (the rest of it is not stored), and the reason is kept in
+request.upload_errors so the form can display it (see TicketModelForm).
+"""
+
+import struct
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+# The header of an image (with its metadata) must be found in the first bytes of the file
+MAX_HEADER_SIZE = 512 * 1024
+
+
+def get_upload_errors(request):
+    """Get the reasons of the rejected uploads of a request, by field name."""
+
+    return getattr(request, 'upload_errors', {})
+
+
+def read_image_header(data):
+    """Parse the header of an image without decoding it, return (format, (width, height)), None if incomplete.
+
+    Raise ValueError when the data is not an image.
+    """
+
+    try:
+        with Image.open(BytesIO(data)) as image:  # Lazy: only the header is read
+            return image.format, image.size
+    except Image.DecompressionBombError:
+        return 'BOMB', (0, 0)
+    except (OSError, SyntaxError, ValueError, EOFError, IndexError, struct.error):
+        if len(data) >= MAX_HEADER_SIZE:
+            raise ValueError("Le fichier n'est pas une image.")
+        return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Stream the uploaded images to disk by chunks and reject the invalid ones while they arrive."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_size = getattr(settings, 'REVIEWS_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+        self.max_pixels = getattr(settings, 'REVIEWS_UPLOAD_MAX_PIXELS', 40 * 1000 * 1000)
+        if request is not None:
+            request.upload_errors = {}
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received_size = 0
+        self.header = b''
+        self.header_checked = False
+
+    def drop(self, message):
+        """Drop the current file and keep the reason of the rejection."""
+
+        if self.request is not None:
+            self.request.upload_errors[self.field_name] = message
+        self.file.close()  # The temporary file is deleted
+
+    def check_header(self, is_complete=False):
+        """Check the format and the number of pixels of the image once its header is received.
+
+        Return the reason of the rejection of the file, None when the file is valid or when its header is incomplete.
+        """
+
+        try:
+            header = read_image_header(self.header)
+        except ValueError as error:
+            return str(error)
+        if header is None:
+            return "Le fichier n'est pas une image." if is_complete else None
+        image_format, (width, height) = header
+        if image_format == 'BOMB' or width * height > self.max_pixels:
+            return f"L'image doit avoir au plus {self.max_pixels} pixels."
+        if image_format not in ALLOWED_FORMATS:
+            return f"Le format de l'image doit être {', '.join(ALLOWED_FORMATS)}."
+        self.header_checked = True
+        self.header = b''
+        return None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received_size += len(raw_data)
+        error = None
+        if self.received_size > self.max_size:
+            error = f"Le fichier doit faire au plus {filesizeformat(self.max_size)}."
+        elif not self.header_checked:
+            self.header += raw_data
+            error = self.check_header()
+        if error:
+            self.drop(error)
+            raise SkipFile(error)  # The rest of the file is read but not stored
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        error = None if self.header_checked else self.check_header(is_complete=True)
+        if error:
+            self.drop(error)
+            return None  # The file is not added to request.FILES
+        return super().file_complete(file_size)
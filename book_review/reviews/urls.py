@@ -10,9 +10,11 @@ urlpatterns = [
     path("register/", views.register_view, name="register"),
     path("logout/", views.logout_view, name="logout"),
     path("home/", views.home_view, name="home"),
+    path("home/async/", views.home_async_view, name="home-async"),
 
     path('tickets/create/', views.TicketCreateView.as_view(), name='ticket-create'),
     path('tickets/list/', views.TicketListView.as_view(), name='ticket-list'),
+    path('tickets/top/', views.top_tickets_view, name='ticket-top'),
     path('tickets/<int:pk>/', views.TicketDetailView.as_view(), name='ticket-detail'),
     path('tickets/<int:pk>/update/', views.TicketUpdateView.as_view(), name='ticket-update'),
     path('tickets/<int:pk>/delete/', views.TicketDeleteView.as_view(), name='ticket-delete'),
@@ -27,4 +29,13 @@ urlpatterns = [
 
     path("user_follows/", views.user_follows_view, name="user-follows"),
     path('user_follows/<int:pk>/delete/', views.UserFollowsDeleteView.as_view(), name='user-follows-delete'),
+
+    path("api/feed/", views.home_feed_api_view, name="api-feed"),
+    path("api/own_posts/", views.own_posts_api_view, name="api-own-posts"),
+
+    path("search/", views.search_view, name="search"),
+    path("api/search/", views.search_api_view, name="api-search"),
+
+    path("feed/cache_stats/", views.feed_cache_stats_view, name="feed-cache-stats"),
+    path("metrics/", views.metrics_view, name="metrics"),
 ]
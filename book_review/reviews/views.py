@@ -6,21 +6,32 @@ Main views:
 - Connection page (for authentication)
 - Registration page (to register the site)
 - Home page (Flux view in the project: all posts of an authenticated user and which of his following users)
+- Async Home page (same page, served by an async view which loads the tickets and the reviews concurrently)
 - Posts page (All posts (tickets and reviews) of an authenticated user)
 - Abonnements page (to follow other users and to see who the user follows and who follows the user)
+- Feed API (Home feed and own posts streamed in JSON, for the clients and the exports)
+- Search page and API (full-text search of the posts, in the Home feed of the user or in all posts)
+- Top tickets page (the best rated or the most reviewed books, from the statistics of the tickets)
+- Cache statistics (hit ratios of the Home feed cache and of the post snippets cache, for staff members)
+- Metrics (performance metrics of the views, in the Prometheus text format)
 """
 
-from itertools import chain
+import asyncio
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import redirect
 from django.template.context_processors import csrf
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, authenticate, logout, get_user
 from django.contrib import messages  # import messages
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
-from django.db.models import CharField, Value
+from django.db import IntegrityError, close_old_connections
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
 from django.views.generic import (
     CreateView,
     DetailView,
@@ -29,6 +40,8 @@ from django.views.generic import (
     DeleteView
 )
 
+from . import conditional, feed, feed_cache, fragment_cache, metrics, search, serializers
+from .conditional import conditional_page
 from .forms import (
     NewUserForm,
     MyAuthenticationForm,
@@ -42,6 +55,8 @@ from .models import (
     Review,
     UserFollows
 )
+from .template_backends import get_feed_engine
+from .uploadhandlers import get_upload_errors
 
 
 def connection_view(request):
@@ -95,52 +110,55 @@ def logout_view(request):
     return redirect("reviews:connection")
 
 
+@conditional_page(conditional.get_home_feed_validators)
 def home_view(request):
     """The Home view used after a user is authenticated.
 
     This view displays all posts (tickets and reviews) related to the user and to his following users.
     """
 
-    reviews = Review.get_users_viewable_reviews(request.user)
-    # returns queryset of reviews
-    reviews = reviews.annotate(content_type=Value('REVIEW', CharField()))
+    # Only the posts of the requested page are merged, sorted and loaded by the database
+    posts, next_cursor = feed.get_home_feed_page(request.user, feed.decode_cursor(request.GET.get("before")))
+    return render(request, "reviews/users/home.html", context={'posts': posts, 'next_cursor': next_cursor},
+                  using=get_feed_engine())
 
-    tickets = Ticket.get_users_viewable_tickets(request.user)
-    # returns queryset of tickets
-    tickets = tickets.annotate(content_type=Value('TICKET', CharField()))
 
-    # combine and sort the two types of posts
-    posts = sorted(
-        chain(reviews, tickets),
-        key=lambda post: post.time_created,
-        reverse=True
-    )
-    if request.method == "POST":
-        if 'create_review' in request.POST:
-            post_id = request.POST.get('create_review')  # post is a ticket
-            request.session["ticket_id"] = post_id
-            request.session["has_already_ticket"] = True
-            return redirect("reviews:review-create")
-    return render(request, "reviews/users/home.html", context={'posts': posts})
+def run_in_thread(function, *args, **kwargs):
+    """Run a database function in a thread of the pool of asgiref (see home_async_view)."""
 
+    try:
+        return function(*args, **kwargs)
+    finally:
+        # The threads of the pool are not request threads, their connection is closed here.
+        close_old_connections()
 
-def own_posts_view(request):
-    """The Posts view used to display all posts (tickets and reviews) of the authenticated user."""
 
-    reviews = Review.get_reviews_posted_by_user(request.user)
-    # returns queryset of reviews
-    reviews = reviews.annotate(content_type=Value('REVIEW', CharField()))
+async def home_async_view(request):
+    """The async variant of the Home view (Flux page, read only).
 
-    tickets = Ticket.get_tickets_created_by_user(request.user)
-    # returns queryset of tickets
-    tickets = tickets.annotate(content_type=Value('TICKET', CharField()))
+    The page of tickets and the page of reviews are loaded concurrently in a thread pool, then merged.
+    Under ASGI, no worker thread is held while the request waits for the database or while a slow client
+    receives the response.
+    """
 
-    # combine and sort the two types of posts
-    posts = sorted(
-        chain(reviews, tickets),
-        key=lambda post: post.time_created,
-        reverse=True
-    )
+    in_thread = sync_to_async(run_in_thread, thread_sensitive=False)
+    user = await in_thread(get_user, request)
+    if not user.is_authenticated:
+        return redirect("reviews:connection")
+    request.user = user
+    cursor = feed.decode_cursor(request.GET.get("before"))
+    tickets, reviews = await asyncio.gather(
+        in_thread(feed.get_posts_page, Ticket.get_users_viewable_tickets(user), feed.TICKET, cursor),
+        in_thread(feed.get_posts_page, Review.get_users_viewable_reviews(user), feed.REVIEW, cursor))
+    posts, next_cursor = feed.merge_posts_pages(tickets, reviews)
+    return await in_thread(
+        render, request, "reviews/users/home.html", context={'posts': posts, 'next_cursor': next_cursor},
+        using=get_feed_engine())
+
+
+@conditional_page(conditional.get_own_posts_validators)
+def own_posts_view(request):
+    """The Posts view used to display all posts (tickets and reviews) of the authenticated user."""
 
     if request.method == "POST":
         if request.POST.get("deletePost"):
@@ -163,11 +181,17 @@ def own_posts_view(request):
                     request, f"Vous avez supprimé la critique {ticket} ")
             return redirect("reviews:own-posts")
 
+    posts, next_cursor = feed.get_feed_page(
+        Ticket.get_tickets_created_by_user(request.user),
+        Review.get_reviews_posted_by_user(request.user),
+        feed.decode_cursor(request.GET.get("before")))
     return render(
         request,
         "reviews/users/own_posts.html",
         context={
-            'posts': posts})
+            'posts': posts,
+            'next_cursor': next_cursor},
+        using=get_feed_engine())
 
 
 def user_follows_view(request):
@@ -204,6 +228,97 @@ def user_follows_view(request):
     return render(request, "reviews/users/user_follows.html", context=context)
 
 
+def stream_feed_as_json(request, tickets, reviews):
+    """Stream all posts of a feed (from the "before" cursor if any) in a JSON array."""
+
+    posts = feed.iter_feed_posts(tickets, reviews, feed.decode_cursor(request.GET.get("before")))
+    return StreamingHttpResponse(serializers.stream_posts_as_json(posts), content_type="application/json")
+
+
+@conditional_page(conditional.get_home_feed_validators)
+def home_feed_api_view(request):
+    """This view streams the whole Home feed of the authenticated user in JSON (see reviews.serializers)."""
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentification requise"}, status=403)
+    return stream_feed_as_json(
+        request,
+        Ticket.get_users_viewable_tickets(request.user),
+        Review.get_users_viewable_reviews(request.user))
+
+
+@conditional_page(conditional.get_own_posts_validators)
+def own_posts_api_view(request):
+    """This view streams all posts of the authenticated user in JSON (see reviews.serializers)."""
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentification requise"}, status=403)
+    return stream_feed_as_json(
+        request,
+        Ticket.get_tickets_created_by_user(request.user),
+        Review.get_reviews_posted_by_user(request.user))
+
+
+def get_search_results(request):
+    """Search the posts of the query string (q, scope and page), return the posts and the number of the next page."""
+
+    page = request.GET.get("page", "1")
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    page_size = feed.get_page_size()
+    user = None if request.GET.get("scope") == "all" else request.user
+    rows = search.search_posts(request.GET.get("q"), user, limit=page_size + 1, offset=(page - 1) * page_size)
+    return feed.load_posts(rows[:page_size]), page + 1 if len(rows) > page_size else None
+
+
+def search_view(request):
+    """The Search view: the posts matching the words of the query, from the most relevant one."""
+
+    if not request.user.is_authenticated:
+        return redirect("reviews:connection")
+    posts, next_page = get_search_results(request)
+    return render(request, "reviews/search.html", context={
+        "query": request.GET.get("q", ""),
+        "scope": request.GET.get("scope", "feed"),
+        "posts": posts,
+        "next_page": next_page})
+
+
+def search_api_view(request):
+    """This view returns a page of search results in JSON (see reviews.serializers)."""
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentification requise"}, status=403)
+    posts, next_page = get_search_results(request)
+    return StreamingHttpResponse(
+        serializers.stream_posts_as_json(posts), content_type="application/json",
+        headers={"X-Next-Page": str(next_page)} if next_page else None)
+
+
+@staff_member_required
+def feed_cache_stats_view(request):
+    """This view displays the number of hits and misses of the Home feed cache (to tune its timeout),
+    and of the cache of the post snippets."""
+
+    return JsonResponse({**feed_cache.get_stats(), "fragments": fragment_cache.get_stats()})
+
+
+def metrics_view(request):
+    """This view exposes the performance metrics of the views in the Prometheus text format.
+
+    The request must be authorized with the REVIEWS_METRICS_TOKEN setting (bearer token) or come from a staff member,
+    unless the REVIEWS_METRICS_PUBLIC setting opens the metrics to everyone.
+    """
+
+    token = getattr(settings, "REVIEWS_METRICS_TOKEN", None)
+    authorized = (
+        (token and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"))
+        or getattr(settings, "REVIEWS_METRICS_PUBLIC", False)
+        or request.user.is_staff)
+    if not authorized:
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 class TicketCreateView(CreateView):
     """This view is used when the authenticated user wants to create a ticket."""
 
@@ -211,6 +326,13 @@ class TicketCreateView(CreateView):
     form_class = TicketModelForm
     queryset = Ticket.objects.all()
 
+    def get_form_kwargs(self):
+        """Give the reasons of the rejected uploads to the form."""
+
+        kwargs = super().get_form_kwargs()
+        kwargs["upload_errors"] = get_upload_errors(self.request)
+        return kwargs
+
     def form_valid(self, form):
         """Validate the input for creating a Ticket model."""
 
@@ -223,13 +345,48 @@ class TicketCreateView(CreateView):
         return reverse('reviews:home')
 
 
-class TicketListView(ListView):
+class UserPostListView(ListView):
+    """List of the posts of one type of the authenticated user, from the newest one, by pages.
+
+    The pages are navigated with a cursor (the "before" parameter, as the feeds), and the large text columns
+    (deferred_fields), which only the detail views display, are not loaded.
+    """
+
+    content_type = None
+    deferred_fields = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return redirect("reviews:connection")
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_queryset(self):
+        posts = self.model.objects.filter(user=self.request.user)
+        cursor = feed.decode_cursor(self.request.GET.get("before"))
+        posts = feed.filter_posts_before(posts, self.content_type, cursor)
+        return posts.defer(*self.deferred_fields).order_by('-time_created', '-id')
+
+    def get_context_data(self, **kwargs):
+        page_size = feed.get_page_size()
+        posts = list(self.object_list[:page_size + 1])
+        next_cursor = None
+        if len(posts) > page_size:
+            last_post = posts[page_size - 1]
+            next_cursor = feed.encode_cursor(
+                {'content_type': self.content_type, 'id': last_post.id, 'time_created': last_post.time_created})
+        return super().get_context_data(object_list=posts[:page_size], next_cursor=next_cursor, **kwargs)
+
+
+class TicketListView(UserPostListView):
     """This view is used when the authenticated user wants to see his all tickets."""
 
     template_name = 'tickets/ticket_list.html'
-    queryset = Ticket.objects.all()
+    model = Ticket
+    content_type = feed.TICKET
+    deferred_fields = ('description',)
 
 
+@method_decorator(conditional_page(conditional.get_ticket_validators), name="get")
 class TicketDetailView(DetailView):
     """This view is used when the authenticated user wants to see the detail of one of his tickets."""
 
@@ -237,6 +394,35 @@ class TicketDetailView(DetailView):
     queryset = Ticket.objects.all()
 
 
+TOP_ORDERS = ("rating", "reviews")
+
+
+def decode_top_cursor(value, order):
+    """Parse the cursor of a top tickets page ("<value>_<id>" of the last ticket), None when missing or invalid."""
+
+    top_value, _, ticket_id = (value or "").rpartition("_")
+    try:
+        return (float(top_value) if order == "rating" else int(top_value)), int(ticket_id)
+    except ValueError:
+        return None
+
+
+def top_tickets_view(request):
+    """The Top view: the tickets with reviews, the best rated ("order=rating") or the most reviewed ones first."""
+
+    order = request.GET.get("order") if request.GET.get("order") in TOP_ORDERS else "rating"
+    page_size = feed.get_page_size()
+    tickets = list(Ticket.get_top_tickets(
+        order, decode_top_cursor(request.GET.get("before"), order),
+        min_reviews=getattr(settings, "REVIEWS_TOP_MIN_REVIEWS", 1))[:page_size + 1])
+    next_cursor = None
+    if len(tickets) > page_size:
+        last_ticket = tickets[page_size - 1]
+        next_cursor = f"{last_ticket.top_value!r}_{last_ticket.id}"
+    return render(request, "tickets/ticket_top.html", context={
+        "tickets": tickets[:page_size], "order": order, "next_cursor": next_cursor})
+
+
 class TicketUpdateView(UpdateView):
     """This view is used when the authenticated user wants to update/modify one of his tickets."""
 
@@ -244,6 +430,13 @@ class TicketUpdateView(UpdateView):
     form_class = TicketModelForm
     queryset = Ticket.objects.all()
 
+    def get_form_kwargs(self):
+        """Give the reasons of the rejected uploads to the form."""
+
+        kwargs = super().get_form_kwargs()
+        kwargs["upload_errors"] = get_upload_errors(self.request)
+        return kwargs
+
     def form_valid(self, form):
         """Validate the updated information for a ticket."""
 
@@ -272,11 +465,10 @@ def create_new_ticket_review_view(request):
 
     if request.method == "POST":
         if request.POST.get("new_ticket_review") == "new_ticket_review":
-            ticket_form = TicketModelForm(request.POST, request.FILES)
+            ticket_form = TicketModelForm(request.POST, request.FILES, upload_errors=get_upload_errors(request))
             review_form = ReviewModelForm(request.POST)
             user = request.user
             if ticket_form.is_valid() and review_form.is_valid():
-                print(ticket_form)
                 ticket = ticket_form.save(False)
                 ticket.user = user
                 ticket.save()
@@ -286,6 +478,8 @@ def create_new_ticket_review_view(request):
                 review.user = user
                 review.save()
                 return redirect("reviews:home")
+            for error in get_upload_errors(request).values():
+                messages.error(request, error)
         if "already_ticket" in request.POST:
             ticket_id = request.POST.get("already_ticket")
             ticket = Ticket.objects.get(id=ticket_id)
@@ -301,14 +495,12 @@ def create_new_ticket_review_view(request):
     context.update(csrf(request))
     review_form = ReviewModelForm()
     context["review_form"] = review_form
-    if request.session.get("has_already_ticket"):
-        ticket_id = request.session.get("ticket_id")
-        ticket = Ticket.objects.get(id=ticket_id)
+    ticket_id = request.GET.get("ticket")  # Reply to a ticket (link of the ticket snippet)
+    if ticket_id and ticket_id.isdigit():
+        ticket = get_object_or_404(Ticket, id=ticket_id)
         has_ticket = True
         context["has_ticket"] = has_ticket
         context["post"] = ticket
-        del request.session["has_already_ticket"]
-        del request.session["ticket_id"]
     else:
         ticket_form = TicketModelForm()
         context["ticket_form"] = ticket_form
@@ -317,13 +509,16 @@ def create_new_ticket_review_view(request):
     return render(request, "reviews/review_create.html", context=context)
 
 
-class ReviewListView(ListView):
+class ReviewListView(UserPostListView):
     """This view is used when the authenticated user wants to see his all reviews."""
 
     template_name = 'reviews/review_list.html'
-    queryset = Review.objects.all()
+    model = Review
+    content_type = feed.REVIEW
+    deferred_fields = ('body',)
 
 
+@method_decorator(conditional_page(conditional.get_review_validators), name="get")
 class ReviewDetailView(DetailView):
     """This view is used when the authenticated user wants to see the detail of one of his reviews."""
 